@@ -1,3 +1,5 @@
+from typing import Optional
+
 from fastapi import APIRouter
 from services.dashboard_service import (
     get_total_equity,
@@ -7,6 +9,7 @@ from services.dashboard_service import (
     get_bot_status,
     get_risk_metrics,
     get_module_reports,
+    get_stage_timings,
 )
 
 router = APIRouter()
@@ -45,4 +48,9 @@ def risk_metrics():
 @router.get("/module_reports")
 @router.get("/module_reports/")
 def module_reports():
-    return get_module_reports()
\ No newline at end of file
+    return get_module_reports()
+
+@router.get("/timings")
+@router.get("/timings/")
+def stage_timings(stage: Optional[str] = None, symbol: Optional[str] = None):
+    return get_stage_timings(stage, symbol)
@@ -3,6 +3,8 @@ BASE_PATH = "/home/mt23veo3/BabyShark"
 TRADE_LOG = f"{BASE_PATH}/trades_log.csv"
 SIGNALS_LOG = f"{BASE_PATH}/signals_log.csv"
 TRADE_STATE = f"{BASE_PATH}/trade_state.json"
+STATE_DB = f"{BASE_PATH}/bot_state.db"
+STAGE_TIMING = f"{BASE_PATH}/stage_timing.json"
 CONFIG = f"{BASE_PATH}/config.json"
 ALERTS_LOG = f"{BASE_PATH}/alerts_log.json"
 LOG_FILE = f"{BASE_PATH}/dashboard_api_access.log"
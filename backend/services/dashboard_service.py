@@ -3,10 +3,13 @@ import csv
 from datetime import datetime
 from collections import defaultdict
 from services.constants import TRADE_LOG, SIGNALS_LOG, TRADE_STATE, CONFIG, ALERTS_LOG
+from services.state_reader import load_stage_timings, load_trade_state
 
 TRADE_LOG = "../../trades_log.csv"
 SIGNALS_LOG = "../../signals_log.csv"
 TRADE_STATE = "../../trade_state.json"
+STATE_DB = "../../bot_state.db"
+STAGE_TIMING = "../../stage_timing.json"
 CONFIG = "../../config.json"
 
 def safe_float(val, default=0.0):
@@ -38,8 +41,12 @@ def safe_load_csv(path):
         pass
     return result
 
+def load_bot_state():
+    """trade state từ bot_state.db (SQLite WAL của bot); chưa có DB thì đọc file JSON cũ."""
+    return load_trade_state(STATE_DB) or safe_load_json(TRADE_STATE)
+
 def get_total_equity():
-    state = safe_load_json(TRADE_STATE)
+    state = load_bot_state()
     if state and "equity" in state:
         return {"equity": safe_float(state.get("equity", 0))}
     config = safe_load_json(CONFIG)
@@ -62,7 +69,7 @@ def get_daily_pnl():
     return [{"date": d, "pnl": daily[d]} for d in sorted(daily.keys())]
 
 def get_bot_status():
-    state = safe_load_json(TRADE_STATE)
+    state = load_bot_state()
     if not state:
         return {"status": "unknown", "detail": "No state file"}
     return {
@@ -106,6 +113,9 @@ def get_module_reports():
     }
     return module
 
+def get_stage_timings(stage=None, symbol=None):
+    return load_stage_timings(stage, symbol, STAGE_TIMING)
+
 def get_overview():
     eq = get_total_equity()
     pnl = get_total_pnl()
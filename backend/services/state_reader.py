@@ -0,0 +1,49 @@
+import json
+import os
+import sqlite3
+import sys
+
+from services.constants import STAGE_TIMING, STATE_DB
+
+# quy ước dòng trade_state và lọc timing lấy thẳng từ module của bot (chỉ dùng stdlib)
+BOT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if BOT_ROOT not in sys.path:
+    sys.path.append(BOT_ROOT)
+from state_store import unflatten_sections
+from timing import filter_timings
+
+def _connect(path):
+    # read-only: dashboard đọc song song với bot (WAL), không bao giờ ghi vào DB
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=2.0)
+    conn.execute("PRAGMA busy_timeout=2000")
+    return conn
+
+def load_table(table, path=STATE_DB):
+    """{key: value} của một bảng trong bot_state.db; {} nếu chưa có DB/bảng."""
+    try:
+        conn = _connect(path)
+    except sqlite3.Error:
+        return {}
+    try:
+        rows = conn.execute(f"SELECT key, value FROM {table}").fetchall()
+    except sqlite3.Error:
+        return {}
+    finally:
+        conn.close()
+    return {k: json.loads(v) for k, v in rows}
+
+def load_trade_state(path=STATE_DB):
+    """trade_state dựng lại từ các dòng "section/key" (state_store.flatten_sections)."""
+    return unflatten_sections(load_table("trade_state", path))
+
+def load_stage_timings(stage=None, symbol=None, path=STAGE_TIMING):
+    """
+    Tóm tắt timing bot ghi ra stage_timing.json (timing.StageTimer.dump), lọc bằng
+    timing.filter_timings. {} nếu bot chưa ghi file.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snap = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return filter_timings(snap, stage, symbol)
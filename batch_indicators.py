@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Tính chỉ báo cho nhiều symbol cùng lúc trên ma trận 2-D (symbols, bars).
+
+Mọi chuỗi đệ quy (EMA, RSI, ATR, tổng Wilder của ADX) của mọi symbol được xếp
+thành cột của một ma trận và chạy chung một vòng lặp theo nến, mỗi bước là phép
+toán vector trên trục cột; Supertrend có vòng lặp theo nến riêng; chỉ báo cửa sổ
+trượt chỉ đọc đuôi ma trận. Kết quả là IndicatorSnapshot (như
+calculate_indicators(mode="gate")) cho từng symbol, đưa thẳng vào
+build_indicator_results / tally_votes.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from indicators import NAN, IndicatorSnapshot
+
+def _ewm_stack(x: np.ndarray, alpha: np.ndarray, start: np.ndarray) -> np.ndarray:
+    """
+    Nhiều chuỗi đệ quy y = alpha*x + (1-alpha)*y_prev trong một vòng lặp theo nến.
+    x: (bars, K); alpha/start: (K,). Cột k lấy x làm seed tại hàng start[k]
+    (giá trị trước đó không dùng tới).
+    """
+    out = np.empty_like(x)
+    prev = x[0].copy()
+    out[0] = prev
+    keep = 1.0 - alpha
+    for i in range(1, len(x)):
+        prev = np.where(start >= i, x[i], alpha * x[i] + keep * prev)
+        out[i] = prev
+    return out
+
+def _true_range(h: np.ndarray, l: np.ndarray, c: np.ndarray) -> np.ndarray:
+    tr = h - l
+    pc = c[:-1]
+    tr[1:] = np.fmax(np.fmax(tr[1:], np.abs(h[1:] - pc)), np.abs(l[1:] - pc))
+    return tr
+
+def _supertrend_last(c: np.ndarray, bub: np.ndarray, blb: np.ndarray) -> np.ndarray:
+    fub, flb = bub[0], blb[0]
+    trend = np.ones(c.shape[1], dtype=np.int64)
+    for i in range(1, len(c)):
+        pc, ci = c[i-1], c[i]
+        nub = np.where(pc > fub, np.minimum(bub[i], fub), bub[i])
+        nlb = np.where(pc < flb, np.maximum(blb[i], flb), blb[i])
+        trend = np.where(ci > fub, 1, np.where(ci < flb, -1, trend))
+        fub, flb = nub, nlb
+    return trend
+
+def _trend(close: float, ema200: float) -> str:
+    if close != close or ema200 != ema200:
+        return "-"
+    return "UP" if close > ema200 else "DOWN"
+
+def compute_batch(close, high, low, volume, timeframe=None) -> List[Optional[IndicatorSnapshot]]:
+    """
+    close/high/low/volume: ma trận (symbols, bars) đã căn cùng nến. Trả về list
+    IndicatorSnapshot theo thứ tự hàng (None cả list nếu không đủ nến như calculate_indicators).
+    """
+    c = np.ascontiguousarray(np.asarray(close, dtype=np.float64).T)
+    h = np.ascontiguousarray(np.asarray(high, dtype=np.float64).T)
+    l = np.ascontiguousarray(np.asarray(low, dtype=np.float64).T)
+    v = np.ascontiguousarray(np.asarray(volume, dtype=np.float64).T)
+    n, n_sym = c.shape if c.ndim == 2 else (0, 0)
+    if n_sym == 0:
+        return []
+    if n < 200:
+        print(f"[ERROR] DataFrame quá nhỏ ({n}), cần >= 200")
+        return [None] * n_sym
+    if n - 199 < 5:
+        print("[ERROR] Indicator 'ema200' có quá ít giá trị hợp lệ.")
+        return [None] * n_sym
+
+    # Tầng 1: EMA200/12/26, RSI up/down, ATR14, ATR10 và tổng Wilder TR/+DM/-DM của ADX.
+    # Dạng Wilder (prev*(w-1) + x)/w chính là EMA alpha=1/w, seed bằng trung bình w giá trị đầu.
+    w = 14
+    diff = np.zeros_like(c)
+    diff[1:] = c[1:] - c[:-1]
+    tr = _true_range(h, l, c)
+    du = np.zeros_like(h); dd = np.zeros_like(l)
+    du[1:] = h[1:] - h[:-1]
+    dd[1:] = l[:-1] - l[1:]
+    pos = np.where((du > dd) & (du > 0), du, 0.0)
+    neg = np.where((dd > du) & (dd > 0), dd, 0.0)
+    tr14, tr10, trs, dip, din = tr.copy(), tr.copy(), tr.copy(), pos.copy(), neg.copy()
+    tr14[w - 1] = tr[:w].mean(axis=0)
+    tr10[9] = tr[:10].mean(axis=0)
+    trs[w] = tr[1:w+1].mean(axis=0)
+    dip[w] = pos[1:w+1].mean(axis=0)
+    din[w] = neg[1:w+1].mean(axis=0)
+    series = (
+        (c, 2 / 201, 0), (c, 2 / 13, 0), (c, 2 / 27, 0),
+        (np.where(diff > 0, diff, 0.0), 1 / 14, 0), (np.where(diff < 0, -diff, 0.0), 1 / 14, 0),
+        (tr14, 1 / w, w - 1), (tr10, 1 / 10, 9), (trs, 1 / w, w), (dip, 1 / w, w), (din, 1 / w, w),
+    )
+    stage1 = _ewm_stack(
+        np.hstack([x for x, _, _ in series]),
+        np.repeat([a for _, a, _ in series], n_sym),
+        np.repeat([s for _, _, s in series], n_sym),
+    ).reshape(n, len(series), n_sym)
+    ema200 = stage1[-1, 0]
+    macd_line = stage1[:, 1] - stage1[:, 2]
+    eu, ed = stage1[-14:, 3], stage1[-14:, 4]
+    atr = stage1[-1, 5]
+    atr10 = stage1[:, 6].copy()
+    atr10[:9] = 0.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ytr, ydip, ydin = stage1[w:, 7], stage1[w:, 8], stage1[w:, 9]
+        pdi = np.where(ytr != 0, 100 * (ydip / ytr), 0.0)
+        ndi = np.where(ytr != 0, 100 * (ydin / ytr), 0.0)
+        dx = np.where(pdi + ndi != 0, 100 * np.abs((pdi - ndi) / (pdi + ndi)), 0.0)
+
+    # Tầng 2: đường signal của MACD (từ nến 25) và ADX (seed = trung bình 14 DX đầu)
+    adx_in = np.zeros_like(c)
+    adx_in[w:] = dx
+    adx_in[2 * w - 1] = dx[:w].mean(axis=0)
+    stage2 = _ewm_stack(
+        np.hstack([macd_line, adx_in]),
+        np.repeat([2 / 10, 1 / w], n_sym),
+        np.repeat([25, 2 * w - 1], n_sym),
+    )
+    macd = macd_line[-1]
+    macd_signal = stage2[-1, :n_sym]
+    adx = stage2[-1, n_sym:]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi_win = np.where(ed == 0, 100.0, 100 - (100 / (1 + eu / ed)))
+        lo, hi = rsi_win.min(axis=0), rsi_win.max(axis=0)
+        stoch_rsi = (rsi_win[-1] - lo) / (hi - lo)
+    rsi = rsi_win[-1]
+
+    hl2 = (h + l) / 2
+    supertrend = _supertrend_last(c, hl2 + 3 * atr10, hl2 - 3 * atr10)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vol_sum = v.sum(axis=0)
+        vwap = np.where(vol_sum != 0, ((h + l + c) / 3 * v).sum(axis=0) / vol_sum, NAN)
+
+        rng = h[-20:] - l[-20:]
+        range_filter = (rng[-1] > rng.mean(axis=0) * 1.5).astype(int)
+        v20 = v[-20:]
+        volume_spike = (v20[-1] > v20.mean(axis=0) * 1.5).astype(int)
+        mfv = ((c[-20:] - l[-20:]) - (h[-20:] - c[-20:])) / (h[-20:] - l[-20:]) * v20
+        mfv[~np.isfinite(mfv)] = 0.0
+        v20_sum = v20.sum(axis=0)
+        chaikin_mf = np.where(v20_sum != 0, mfv.sum(axis=0) / v20_sum, NAN)
+
+    ma50 = c[-50:].mean(axis=0)
+    mid = c[-20:].mean(axis=0)
+    sd = c[-20:].std(axis=0)
+    upper, lower = mid + 2 * sd, mid - 2 * sd
+
+    tf = str(timeframe).lower() if timeframe is not None else ""
+    out = []
+    for j in range(n_sym):
+        trend = _trend(float(c[-1, j]), float(ema200[j]))
+        out.append(IndicatorSnapshot(
+            ema200=float(ema200[j]), ma50=float(ma50[j]), macd=float(macd[j]),
+            macd_signal=float(macd_signal[j]), rsi=float(rsi[j]), adx=float(adx[j]),
+            vwap=float(vwap[j]), supertrend=int(supertrend[j]), range_filter=int(range_filter[j]),
+            atr=float(atr[j]), chaikin_mf=float(chaikin_mf[j]), volume_spike=int(volume_spike[j]),
+            stoch_rsi=float(stoch_rsi[j]), bollinger_bands_upper=float(upper[j]),
+            bollinger_bands_lower=float(lower[j]), bollinger_bands_mid=float(mid[j]),
+            bollinger_bands=float(upper[j] - lower[j]),
+            trend_h4=trend if tf in ['4h','h4'] else "-",
+            trend_d1=trend if tf in ['1d','d1','daily'] else "-",
+        ))
+    return out
+
+def calculate_indicators_many(frames: Dict[str, pd.DataFrame], timeframe=None) -> Dict[str, Optional[IndicatorSnapshot]]:
+    """
+    {symbol: DataFrame OHLCV} → {symbol: IndicatorSnapshot | None}. Các frame được
+    gom theo số nến rồi mỗi nhóm tính một lượt, để giá trị EMA/ADX (phụ thuộc nến
+    đầu) khớp với calculate_indicators trên từng frame.
+    """
+    out: Dict[str, Optional[IndicatorSnapshot]] = {}
+    groups: Dict[int, List[str]] = {}
+    for symbol, df in frames.items():
+        if df is None or len(df) < 200:
+            out[symbol] = None
+            continue
+        groups.setdefault(len(df), []).append(symbol)
+    for syms in groups.values():
+        mats = [np.stack([frames[s][col].to_numpy(dtype=np.float64) for s in syms])
+                for col in ("close", "high", "low", "volume")]
+        for symbol, ind in zip(syms, compute_batch(*mats, timeframe=timeframe)):
+            out[symbol] = ind
+    return out
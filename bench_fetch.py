@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+So sánh fetch tuần tự (fetch_data) với AsyncFetcher.fetch_many trên sàn giả lập,
+và payload của CandleStore (fetch tăng dần) qua nhiều vòng.
+
+    python bench_fetch.py --latency 0.15 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from data import FETCH_PLAN, AsyncFetcher, CandleStore, fetch_data
+from fake_exchange import AsyncFakeExchange, FakeExchange
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.15)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--loops", type=int, default=3)
+    args = parser.parse_args()
+
+    cfg = json.load(open("config.json", "r", encoding="utf-8"))
+    symbols = cfg.get("symbols", ["BTC/USDT"])
+    requests = [(s, tf, limit) for s in symbols for tf, limit in FETCH_PLAN]
+
+    ex = FakeExchange(latency=args.latency)
+    t0 = time.perf_counter()
+    for s, tf, limit in requests:
+        fetch_data(s, tf, limit=limit, exchange=ex)
+    t_seq = time.perf_counter() - t0
+
+    async def _concurrent():
+        fetcher = AsyncFetcher(exchange=AsyncFakeExchange(latency=args.latency), concurrency=args.concurrency)
+        try:
+            return await fetcher.fetch_many(requests)
+        finally:
+            await fetcher.close()
+
+    t0 = time.perf_counter()
+    frames = asyncio.run(_concurrent())
+    t_conc = time.perf_counter() - t0
+
+    async def _incremental():
+        ex = AsyncFakeExchange(latency=args.latency)
+        store = CandleStore(AsyncFetcher(exchange=ex, concurrency=args.concurrency),
+                            derive=(cfg.get("data") or {}).get("derive"))
+        rows, calls = [], []
+        for _ in range(args.loops):
+            before_rows, before_calls = ex.rows_served, ex.requests
+            await store.update_many(requests)
+            rows.append(ex.rows_served - before_rows)
+            calls.append(ex.requests - before_calls)
+        return rows, calls
+
+    rows, calls = asyncio.run(_incremental())
+
+    ok = sum(1 for df in frames.values() if df is not None and not df.empty)
+    print(f"{len(requests)} requests | latency={args.latency}s | concurrency={args.concurrency}")
+    print(f"  tuần tự : {t_seq:.2f}s")
+    print(f"  song song: {t_conc:.2f}s ({ok}/{len(requests)} OK) → x{t_seq / max(t_conc, 1e-9):.1f}")
+    print(f"  CandleStore số nến nhận mỗi vòng: {rows} | số request: {calls}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark Supertrend: bản .iloc gốc ("pandas") vs kernel numpy ("numpy").
+
+    python bench_supertrend.py --sizes 300 5000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from indicators import SUPERTREND_IMPLS
+
+def _ohlcv(n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.005, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.005, n))
+    return pd.DataFrame({"open": open_, "high": high, "low": low, "close": close, "volume": rng.uniform(50, 500, n)})
+
+def _time(fn, df, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(df)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[300, 5000, 100000])
+    args = parser.parse_args()
+    for n in args.sizes:
+        df = _ohlcv(n)
+        repeat = 1 if n > 10000 else 5
+        t_old, ref = _time(SUPERTREND_IMPLS["pandas"], df, repeat)
+        t_new, got = _time(SUPERTREND_IMPLS["numpy"], df, repeat)
+        same = bool((ref.to_numpy() == got.to_numpy()).all())
+        print(f"n={n:>7} | pandas {t_old * 1e3:9.2f} ms | numpy {t_new * 1e3:8.2f} ms | x{t_old / max(t_new, 1e-9):6.1f} | khớp={same}")
+
+if __name__ == "__main__":
+    main()
@@ -30,4 +30,7 @@ class PaperBroker:
 
 def get_broker(cfg: Dict) -> PaperBroker:
     # Có thể mở rộng: nếu cfg.trading.mode == "live" -> trả CCXT broker
+    if ((cfg or {}).get("trading") or {}).get("mode") == "sim":
+        from sim_broker import SimBroker
+        return SimBroker(cfg)
     return PaperBroker(cfg)
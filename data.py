@@ -1,13 +1,302 @@
+import asyncio
+from typing import Dict, Iterable, List, Optional, Tuple
+
 import ccxt
+import ccxt.async_support as ccxt_async
+import numpy as np
 import pandas as pd
 
+from timing import get_stage_timer
+
+OHLCV_COLUMNS = ['timestamp','open','high','low','close','volume']
+
+# (timeframe, số nến) cần fetch cho mỗi symbol trong một vòng của main.run_once
+FETCH_PLAN = (("5m", 400), ("15m", 300), ("1h", 300), ("1d", 300))
+
 _exchange = ccxt.binance()
 
-def fetch_data(symbol, timeframe, limit=300):
+def _to_frame(ohlcv):
+    return pd.DataFrame(ohlcv, columns=OHLCV_COLUMNS)
+
+def timeframe_ms(timeframe: str) -> int:
+    return int(ccxt.Exchange.parse_timeframe(timeframe) * 1000)
+
+def aggregate_ohlcv(ts: np.ndarray, px: np.ndarray, target_ms: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Gộp nến khung nhỏ (ts tăng dần, px cột open/high/low/close/volume) lên khung
+    `target_ms`, căn biên theo epoch UTC như sàn: open=first, high=max, low=min,
+    close=last, volume=sum.
+    """
+    if len(ts) == 0:
+        return ts[:0], px[:0]
+    buckets = ts - ts % target_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(ts)]
+    out = np.empty((len(starts), 5), dtype=np.float64)
+    out[:, 0] = px[starts, 0]
+    out[:, 1] = np.maximum.reduceat(px[:, 1], starts)
+    out[:, 2] = np.minimum.reduceat(px[:, 2], starts)
+    out[:, 3] = px[ends - 1, 3]
+    out[:, 4] = np.add.reduceat(px[:, 4], starts)
+    return buckets[starts], out
+
+def resample_ohlcv(df: pd.DataFrame, timeframe: str) -> pd.DataFrame:
+    """Bản DataFrame của aggregate_ohlcv (dùng cho backtest/so sánh)."""
+    ts, px = aggregate_ohlcv(
+        df['timestamp'].to_numpy(dtype=np.int64),
+        df[OHLCV_COLUMNS[1:]].to_numpy(dtype=np.float64),
+        timeframe_ms(timeframe),
+    )
+    out = pd.DataFrame(px, columns=OHLCV_COLUMNS[1:])
+    out.insert(0, "timestamp", ts)
+    return out
+
+def fetch_data(symbol, timeframe, limit=300, exchange=None):
     try:
-        ohlcv = _exchange.fetch_ohlcv(symbol, timeframe, limit=limit)
-        df = pd.DataFrame(ohlcv, columns=['timestamp','open','high','low','close','volume'])
+        ohlcv = (exchange or _exchange).fetch_ohlcv(symbol, timeframe, limit=limit)
+        df = _to_frame(ohlcv)
         return df
     except Exception as e:
         print(f"Lỗi khi lấy dữ liệu {symbol} {timeframe}: {e}")
         return None
+
+class AsyncFetcher:
+    """
+    Fetch OHLCV song song cho nhiều cặp (symbol, timeframe) qua ccxt.async_support.
+    Dùng chung một exchange (một aiohttp session keep-alive) và giới hạn số request
+    đồng thời bằng semaphore. Kết quả là DataFrame y hệt fetch_data.
+    """
+
+    def __init__(self, exchange=None, concurrency: int = 8):
+        self.exchange = exchange or ccxt_async.binance({"enableRateLimit": True})
+        self.concurrency = max(1, int(concurrency))
+        self._sem = asyncio.Semaphore(self.concurrency)
+
+    async def fetch_rows(self, symbol: str, timeframe: str, limit: int = 300, since: Optional[int] = None) -> Optional[List[list]]:
+        async with self._sem:
+            try:
+                return await self.exchange.fetch_ohlcv(symbol, timeframe, since=since, limit=limit)
+            except Exception as e:
+                print(f"Lỗi khi lấy dữ liệu {symbol} {timeframe}: {e}")
+                return None
+
+    async def fetch(self, symbol: str, timeframe: str, limit: int = 300) -> Optional[pd.DataFrame]:
+        ohlcv = await self.fetch_rows(symbol, timeframe, limit=limit)
+        return _to_frame(ohlcv) if ohlcv is not None else None
+
+    async def fetch_many(self, requests: Iterable[Tuple[str, str, int]]) -> Dict[Tuple[str, str], Optional[pd.DataFrame]]:
+        reqs = list(requests)
+        frames = await asyncio.gather(*(self.fetch(s, tf, lim) for s, tf, lim in reqs))
+        return {(s, tf): df for (s, tf, _), df in zip(reqs, frames)}
+
+    async def fetch_last_prices(self, symbols: Iterable[str]) -> Dict[str, float]:
+        """Giá khớp gần nhất của nhiều symbol trong một request fetch_tickers."""
+        syms = list(dict.fromkeys(symbols))
+        if not syms:
+            return {}
+        async with self._sem:
+            try:
+                tickers = await self.exchange.fetch_tickers(syms)
+            except Exception as e:
+                print(f"Lỗi khi lấy ticker {len(syms)} symbol: {e}")
+                return {}
+        out = {}
+        for s in syms:
+            t = tickers.get(s) or {}
+            px = t.get("last") if t.get("last") is not None else t.get("close")
+            if px is not None:
+                out[s] = float(px)
+        return out
+
+    async def close(self):
+        try:
+            await self.exchange.close()
+        except Exception:
+            pass
+
+_async_fetcher: Optional[AsyncFetcher] = None
+_candle_store: Optional["CandleStore"] = None
+
+def get_async_fetcher(cfg: Optional[Dict] = None) -> AsyncFetcher:
+    """Fetcher dùng chung trong process (giữ session giữa các vòng lặp)."""
+    global _async_fetcher
+    if _async_fetcher is None:
+        conc = int(((cfg or {}).get("data") or {}).get("concurrency", 8))
+        _async_fetcher = AsyncFetcher(concurrency=conc)
+    return _async_fetcher
+
+async def close_async_fetcher():
+    global _async_fetcher, _candle_store
+    if _async_fetcher is not None:
+        await _async_fetcher.close()
+        _async_fetcher = None
+    _candle_store = None
+
+def fetch_many_sync(requests: Iterable[Tuple[str, str, int]], cfg: Optional[Dict] = None, exchange=None) -> Dict[Tuple[str, str], Optional[pd.DataFrame]]:
+    """Bản đồng bộ cho runner không chạy event loop (phase2/phase3)."""
+    async def _run():
+        conc = int(((cfg or {}).get("data") or {}).get("concurrency", 8))
+        fetcher = AsyncFetcher(exchange=exchange, concurrency=conc)
+        try:
+            return await fetcher.fetch_many(requests)
+        finally:
+            await fetcher.close()
+    return asyncio.run(_run())
+
+class CandleBuffer:
+    """
+    Ring buffer nến của một cặp (symbol, timeframe): tối đa `size` nến gần nhất,
+    nến cuối có thể là nến đang chạy và sẽ bị ghi đè ở lần merge sau.
+    Dữ liệu nằm liền trong mảng numpy dung lượng 2×size, khi đầy thì dồn về đầu
+    (chi phí khấu hao O(1) mỗi nến).
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, int(size))
+        self._cap = 2 * self.size
+        self._ts = np.zeros(self._cap, dtype=np.int64)
+        self._px = np.zeros((self._cap, 5), dtype=np.float64)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def last_ts(self) -> Optional[int]:
+        return int(self._ts[self._end - 1]) if self._end > self._start else None
+
+    def merge(self, rows: List[list]):
+        for row in rows:
+            ts = int(row[0])
+            if self._end > self._start:
+                last = int(self._ts[self._end - 1])
+                if ts < last:
+                    continue
+                if ts == last:
+                    self._px[self._end - 1] = row[1:6]
+                    continue
+            if self._end == self._cap:
+                keep = self.size - 1
+                self._ts[:keep] = self._ts[self._end - keep:self._end]
+                self._px[:keep] = self._px[self._end - keep:self._end]
+                self._start, self._end = 0, keep
+            self._ts[self._end] = ts
+            self._px[self._end] = row[1:6]
+            self._end += 1
+            if self._end - self._start > self.size:
+                self._start += 1
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self._ts[self._start:self._end], self._px[self._start:self._end]
+
+    def frame(self) -> pd.DataFrame:
+        """DataFrame view lên buffer (không copy); chỉ hợp lệ tới lần merge kế tiếp."""
+        df = pd.DataFrame(self._px[self._start:self._end], columns=OHLCV_COLUMNS[1:], copy=False)
+        df.insert(0, "timestamp", self._ts[self._start:self._end])
+        return df
+
+class CandleStore:
+    """
+    Kho nến in-memory theo (symbol, timeframe). Lần đầu fetch đủ `limit` nến,
+    các vòng sau chỉ hỏi sàn các nến từ timestamp cuối đã lưu (tức nến đang chạy)
+    trở đi, rồi merge vào CandleBuffer.
+
+    Khung trong `derive` (vd {"15m": "5m", "1h": "5m"}) không fetch riêng: sau lần
+    seed đầu tiên, chúng được gộp tăng dần từ buffer khung gốc. Bật `verify` để
+    so mỗi nến gộp vừa đóng với nến của sàn.
+    """
+
+    def __init__(self, fetcher: AsyncFetcher, derive: Optional[Dict[str, str]] = None, verify: bool = False):
+        self.fetcher = fetcher
+        self.derive = dict(derive or {})
+        self.verify = bool(verify)
+        self.buffers: Dict[Tuple[str, str], CandleBuffer] = {}
+        self.verify_mismatches = 0
+
+    def _buffer(self, symbol: str, timeframe: str, limit: int) -> CandleBuffer:
+        key = (symbol, timeframe)
+        buf = self.buffers.get(key)
+        if buf is None or buf.size != limit:
+            buf = CandleBuffer(limit)
+            self.buffers[key] = buf
+        return buf
+
+    async def update(self, symbol: str, timeframe: str, limit: int = 300) -> Optional[pd.DataFrame]:
+        buf = self._buffer(symbol, timeframe, limit)
+        since = buf.last_ts
+        if since is not None:
+            tf_ms = timeframe_ms(timeframe)
+            gap = int((self.fetcher.exchange.milliseconds() - since) // tf_ms) + 2
+            if gap >= limit:
+                since = None
+        if since is None:
+            rows = await self.fetcher.fetch_rows(symbol, timeframe, limit=limit)
+        else:
+            rows = await self.fetcher.fetch_rows(symbol, timeframe, limit=gap, since=since)
+        if rows is None:
+            return None
+        buf.merge(rows)
+        return buf.frame()
+
+    async def update_derived(self, symbol: str, timeframe: str, limit: int = 300) -> Optional[pd.DataFrame]:
+        """Cập nhật khung `timeframe` từ buffer khung gốc (phải update khung gốc trước)."""
+        base = self.buffers.get((symbol, self.derive[timeframe]))
+        buf = self._buffer(symbol, timeframe, limit)
+        if base is None or not len(base):
+            return None
+        base_ts, base_px = base.arrays()
+        last = buf.last_ts
+        if last is None or int(base_ts[0]) > last:
+            # Chưa có lịch sử hoặc khung gốc không còn phủ nến đang chạy: seed lại từ sàn
+            rows = await self.fetcher.fetch_rows(symbol, timeframe, limit=limit)
+            if rows is None:
+                return None
+            buf.merge(rows)
+            last = buf.last_ts
+            if last is None or int(base_ts[0]) > last:
+                return buf.frame() if last is not None else None
+        lo = int(np.searchsorted(base_ts, last))
+        ts, px = aggregate_ohlcv(base_ts[lo:], base_px[lo:], timeframe_ms(timeframe))
+        closed_ts = int(ts[-2]) if len(ts) > 1 else None
+        buf.merge([[t, *p] for t, p in zip(ts.tolist(), px.tolist())])
+        if self.verify and closed_ts is not None:
+            await self._verify(symbol, timeframe, buf, closed_ts)
+        return buf.frame()
+
+    async def _verify(self, symbol: str, timeframe: str, buf: CandleBuffer, bar_ts: int):
+        rows = await self.fetcher.fetch_rows(symbol, timeframe, limit=1, since=bar_ts)
+        if not rows or int(rows[0][0]) != bar_ts:
+            return
+        ts, px = buf.arrays()
+        i = int(np.searchsorted(ts, bar_ts))
+        if not np.allclose(px[i], np.asarray(rows[0][1:6], dtype=np.float64), rtol=1e-6, atol=0.0):
+            self.verify_mismatches += 1
+            print(f"[DATA] {symbol} {timeframe} nến gộp {bar_ts} lệch với sàn: {px[i].tolist()} vs {rows[0][1:6]}")
+            px[i] = rows[0][1:6]
+
+    async def update_many(self, requests: Iterable[Tuple[str, str, int]]) -> Dict[Tuple[str, str], Optional[pd.DataFrame]]:
+        reqs = list(requests)
+        direct = [r for r in reqs if r[1] not in self.derive]
+        derived = [r for r in reqs if r[1] in self.derive]
+        timer = get_stage_timer()
+        frames = await asyncio.gather(*(timer.timed(self.update(s, tf, lim), f"fetch:{tf}", s) for s, tf, lim in direct))
+        out = {(s, tf): df for (s, tf, _), df in zip(direct, frames)}
+        frames = await asyncio.gather(*(timer.timed(self.update_derived(s, tf, lim), f"fetch:{tf}", s) for s, tf, lim in derived))
+        out.update({(s, tf): df for (s, tf, _), df in zip(derived, frames)})
+        return out
+
+    def frame(self, symbol: str, timeframe: str) -> Optional[pd.DataFrame]:
+        buf = self.buffers.get((symbol, timeframe))
+        return buf.frame() if buf is not None and len(buf) else None
+
+def get_candle_store(cfg: Optional[Dict] = None) -> CandleStore:
+    global _candle_store
+    if _candle_store is None:
+        dcfg = (cfg or {}).get("data") or {}
+        _candle_store = CandleStore(
+            get_async_fetcher(cfg),
+            derive=dcfg.get("derive"),
+            verify=bool(dcfg.get("verify_aggregates", False)),
+        )
+    return _candle_store
@@ -2,10 +2,12 @@
 import csv
 import json
 import os
-from typing import Dict, Tuple
+from contextlib import contextmanager
+from typing import Dict, Iterable, Tuple
 
 from broker import get_broker
-from notifier import Notifier
+from notifier import NotificationQueue, Notifier
+from state_store import StateJournal, flatten_sections, get_state_store, unflatten_sections
 
 STATE_PATH_DEFAULT = "trade_state.json"
 TRADES_LOG_CSV = "trades_log.csv"
@@ -14,25 +16,125 @@ class ExecutionEngine:
     def __init__(self, cfg: Dict):
         self.cfg = cfg or {}
         self.state_path = self.cfg.get("trading", {}).get("state_path", STATE_PATH_DEFAULT)
+        self.store = get_state_store(self.cfg)
+        self.journal = None
+        if self.store is None:
+            snap_every = int(self.cfg.get("trading", {}).get("journal_snapshot_every", 500))
+            self.journal = StateJournal(self.state_path, snapshot_every=snap_every)
+        self.orders_archive = os.path.splitext(self.state_path)[0] + "_orders.jsonl"
         self.state = self._load_state()
         self.broker = get_broker(cfg)
         self.notifier = Notifier(cfg)
+        self.notify_queue = None
+        self._batch_depth = 0
+        self._save_pending = False
+        self._outbox = []
 
     def _load_state(self) -> Dict:
-        if os.path.exists(self.state_path):
-            try:
-                with open(self.state_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except Exception:
-                pass
+        if self.store is not None:
+            self.store.migrate_json("trade_state", self.state_path, flatten_sections)
+            state = unflatten_sections(self.store.load("trade_state", owner=id(self)))
+            if state:
+                return state
+        else:
+            # snapshot trade_state.json + phát lại journal
+            state = self.journal.load()
+            if state:
+                return state
         return {"positions": {}, "orders": {}, "pair_index": {}}
 
-    def _save_state(self):
+    def _compact_orders(self):
+        """Lệnh đã khớp/huỷ rời map orders (chuyển sang file archive) để state chỉ còn lệnh đang mở."""
+        orders = self.state.get("orders") or {}
+        done = [oid for oid, od in orders.items() if od.get("status") != "open"]
+        if not done:
+            return
         try:
-            with open(self.state_path, "w", encoding="utf-8") as f:
-                json.dump(self.state, f, ensure_ascii=False, indent=2)
+            with open(self.orders_archive, "a", encoding="utf-8") as f:
+                for oid in done:
+                    f.write(json.dumps(orders[oid], ensure_ascii=False, separators=(",", ":")) + "\n")
         except Exception:
-            pass
+            return
+        for oid in done:
+            orders.pop(oid, None)
+
+    def _notify(self, msg: str):
+        if self._batch_depth:
+            self._outbox.append(msg)
+        else:
+            self.notifier.send(msg)
+
+    @contextmanager
+    def batch(self):
+        """
+        Trong khối: state chỉ lưu một lần khi ra khối, tin nhắn được đưa vào
+        hàng đợi gửi nền thay vì post Discord đồng bộ từng cái.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                if self._save_pending:
+                    self._save_pending = False
+                    self._save_state()
+                if self._outbox:
+                    msgs, self._outbox = self._outbox, []
+                    if self.notifier.enabled():
+                        if self.notify_queue is None:
+                            self.notify_queue = NotificationQueue(self.notifier)
+                        self.notify_queue.put_many(msgs)
+
+    def tick_many(self, updates: Iterable[Tuple], timeframe: str = "15m", ts_now: float = None) -> Dict[str, Dict]:
+        """
+        tick cho nhiều cặp một lượt. updates: (symbol, side, plan, price_now) hoặc
+        (symbol, timeframe, side, plan, price_now). Kết quả {symbol|timeframe: summary}
+        giống gọi tick lần lượt; state lưu một lần, thông báo qua hàng đợi.
+        """
+        out = {}
+        with self.batch():
+            for u in updates:
+                if len(u) == 5:
+                    symbol, tf, side, plan, price_now = u
+                else:
+                    (symbol, side, plan, price_now), tf = u, timeframe
+                out[self._pair_key(symbol, tf)] = self.tick(symbol, tf, side, plan, price_now, ts_now=ts_now)
+        return out
+
+    def _save_state(self):
+        if self._batch_depth:
+            self._save_pending = True
+            return
+        self._compact_orders()
+        # chỉ các dòng position/order đổi mới được ghi
+        rows = flatten_sections(self.state)
+        try:
+            if self.store is not None:
+                self.store.sync("trade_state", rows, owner=id(self))
+            else:
+                self.journal.record(rows)
+        except Exception as e:
+            print(f"[WARN] Không lưu được trade state: {e!r}")
+
+    def risk_tick(self, prices: Dict[str, float], ts_now: float = None) -> Dict[str, list]:
+        """
+        Lượt SL/TP/hoà vốn/trailing cho mọi vị thế đã có SL/TP với giá mới nhất
+        {symbol: price} (một request ticker), không cần plan hay tính lại chỉ báo.
+        """
+        if ts_now is None:
+            ts_now = self.broker.now()
+        out = {}
+        with self.batch():
+            for pair_key, pos in list((self.state.get("positions") or {}).items()):
+                price_now = prices.get(pos.get("symbol"))
+                if price_now is None or pos.get("sl") is None or pos.get("tp") is None:
+                    continue
+                actions = self._update_risk_and_exit(pair_key, pos, float(price_now), {}, ts_now)
+                if actions:
+                    out[pair_key] = actions
+                    self._save_state()
+        return out
 
     def _pair_key(self, symbol: str, timeframe: str) -> str:
         return f"{symbol}|{timeframe}"
@@ -71,6 +173,10 @@ class ExecutionEngine:
         allow_mkt_fallback = bool(trading.get("allow_market_fallback", True))
         slippage_guard_pct = float(trading.get("slippage_guard_pct", 0.2))
 
+        if getattr(self.broker, "simulated", False):
+            # broker mô phỏng chạy theo giá/đồng hồ của tick (độ trễ, khớp, TTL)
+            self.broker.observe(symbol, ts_now, price_now)
+
         active_oid = self._get_active_order_id(pair_key)
         if active_oid:
             actions = self._handle_pending_order(active_oid, symbol, timeframe, price_now, ts_now, allow_mkt_fallback, slippage_guard_pct)
@@ -93,7 +199,7 @@ class ExecutionEngine:
                 summary["actions"].append(
                     f"Đặt lệnh thăm dò id={od['id']} giá={entry} khối lượng={size_probe} thời hạn TTL={ttl_sec}s"
                 )
-                self.notifier.send(msg)
+                self._notify(msg)
                 self._save_state()
 
         pos = (self.state.get("positions") or {}).get(pair_key)
@@ -114,6 +220,9 @@ class ExecutionEngine:
         if od["status"] != "open":
             return actions
 
+        if getattr(self.broker, "simulated", False):
+            return self._handle_sim_order(od, symbol, timeframe, price_now, ts_now, allow_mkt_fallback, slippage_guard_pct)
+
         side = od["side"]
         limit_px = float(od["price"])
         ok_cross = (price_now <= limit_px) if side == "LONG" else (price_now >= limit_px)
@@ -127,20 +236,9 @@ class ExecutionEngine:
             od["filled_price"] = float(price_now)
             od["filled_size"] = float(od["size"])
             actions.append(f"Khớp lệnh thăm dò id={order_id} giá={price_now}")
-            self.state.setdefault("positions", {})[pair_key] = {
-                "symbol": symbol,
-                "timeframe": timeframe,
-                "side": side,
-                "size": float(od["size"]),
-                "entry": float(price_now),
-                "stage": "probe",
-                "opened_at": ts_now,
-                "sl": None,
-                "tp": None,
-                "r_value": None
-            }
+            self._open_probe(pair_key, symbol, timeframe, side, od["size"], price_now, ts_now)
             self._clear_active_order_id(pair_key)
-            self.notifier.send(
+            self._notify(
                 f"KHỚP LỆNH THĂM DÒ {symbol} {side}\n├ Số lượng: {od['size']}\n└ Giá: {round(price_now,6)}"
             )
         else:
@@ -151,31 +249,87 @@ class ExecutionEngine:
                     od["filled_price"] = float(price_now)
                     od["filled_size"] = float(od["size"])
                     actions.append(f"Khớp lệnh thăm dò (fallback thị trường) id={order_id} giá={price_now}")
-                    self.state.setdefault("positions", {})[pair_key] = {
-                        "symbol": symbol,
-                        "timeframe": timeframe,
-                        "side": side,
-                        "size": float(od["size"]),
-                        "entry": float(price_now),
-                        "stage": "probe",
-                        "opened_at": ts_now,
-                        "sl": None,
-                        "tp": None,
-                        "r_value": None
-                    }
+                    self._open_probe(pair_key, symbol, timeframe, side, od["size"], price_now, ts_now)
                     self._clear_active_order_id(pair_key)
-                    self.notifier.send(
+                    self._notify(
                         f"KHỚP LỆNH THĂM DÒ (Thị trường) {symbol} {side}\n├ Số lượng: {od['size']}\n└ Giá: {round(price_now,6)}"
                     )
                 else:
                     od["status"] = "canceled"
                     actions.append(f"Hủy lệnh thăm dò id={order_id}")
                     self._clear_active_order_id(pair_key)
-                    self.notifier.send(
+                    self._notify(
                         f"HỦY LỆNH THĂM DÒ {symbol} do hết TTL\n├ Trượt giá: {round(slip_pct,3)}%\n└ Bảo vệ: {slippage_guard_pct}%"
                     )
         return actions
 
+    def _open_probe(self, pair_key: str, symbol: str, timeframe: str, side: str, size: float, entry: float, ts_now: float):
+        self.state.setdefault("positions", {})[pair_key] = {
+            "symbol": symbol,
+            "timeframe": timeframe,
+            "side": side,
+            "size": float(size),
+            "entry": float(entry),
+            "stage": "probe",
+            "opened_at": ts_now,
+            "sl": None,
+            "tp": None,
+            "r_value": None
+        }
+
+    def _handle_sim_order(self, od: Dict, symbol: str, timeframe: str, price_now: float, ts_now: float, allow_mkt_fallback: bool, slippage_guard_pct: float):
+        """
+        Lệnh của broker mô phỏng: trạng thái khớp (độ trễ, khớp một phần, TTL) lấy
+        từ broker thay vì so giá close với giá limit.
+        """
+        actions = []
+        order_id = od["id"]
+        pair_key = self._pair_key(symbol, timeframe)
+        upd = self.broker.order_update(order_id)
+        if upd is None:
+            od["status"] = "canceled"
+            self._clear_active_order_id(pair_key)
+            return actions
+        od["filled_size"] = float(upd["filled_size"])
+        if upd["status"] in ("pending", "open"):
+            return actions  # chờ khớp đủ hoặc hết TTL (broker tự huỷ phần còn lại)
+
+        side = od["side"]
+        filled = od["filled_size"]
+        self._clear_active_order_id(pair_key)
+        if filled > 0:
+            px = float(upd["avg_price"])
+            od["status"] = "filled" if upd["status"] == "filled" else "partially_filled"
+            od["filled_price"] = px
+            self._open_probe(pair_key, symbol, timeframe, side, filled, px, ts_now)
+            part = "" if od["status"] == "filled" else f" (một phần {round(filled,6)}/{od['size']})"
+            actions.append(f"Khớp lệnh thăm dò id={order_id} giá={round(px,6)}{part}")
+            self._notify(
+                f"KHỚP LỆNH THĂM DÒ {symbol} {side}{part}\n├ Số lượng: {round(filled,6)}\n└ Giá: {round(px,6)}"
+            )
+            return actions
+
+        limit_px = float(od["price"])
+        slip_pct = abs(price_now - limit_px) / max(1e-12, limit_px) * 100.0
+        if allow_mkt_fallback and slip_pct <= slippage_guard_pct:
+            px = self.broker.market_fill(symbol, side, od["size"], ref_price=price_now)
+            od["status"] = "filled"
+            od["type"] = "market_fallback"
+            od["filled_price"] = float(px)
+            od["filled_size"] = float(od["size"])
+            self._open_probe(pair_key, symbol, timeframe, side, od["size"], px, ts_now)
+            actions.append(f"Khớp lệnh thăm dò (fallback thị trường) id={order_id} giá={round(px,6)}")
+            self._notify(
+                f"KHỚP LỆNH THĂM DÒ (Thị trường) {symbol} {side}\n├ Số lượng: {od['size']}\n└ Giá: {round(px,6)}"
+            )
+        else:
+            od["status"] = "canceled"
+            actions.append(f"Hủy lệnh thăm dò id={order_id}")
+            self._notify(
+                f"HỦY LỆNH THĂM DÒ {symbol} do hết TTL\n├ Trượt giá: {round(slip_pct,3)}%\n└ Bảo vệ: {slippage_guard_pct}%"
+            )
+        return actions
+
     def promote_to_full(self, symbol: str, timeframe: str, plan: Dict, price_now: float) -> Tuple[bool, str]:
         pair_key = self._pair_key(symbol, timeframe)
         pos = (self.state.get("positions") or {}).get(pair_key)
@@ -201,7 +355,7 @@ class ExecutionEngine:
         pos["r_value"] = float(plan.get("r_value", 0.0))
         self.state.setdefault("positions", {})[pair_key] = pos
         self._save_state()
-        self.notifier.send(
+        self._notify(
             f"NÂNG LỆNH THĂM DÒ LÊN FULL {symbol}\n├ Số lượng mới: {round(size_new,6)}\n└ Giá bình quân: {round(entry_new,6)}"
         )
         return True, f"nâng lên full size={size_new} avg_entry={round(entry_new,6)}"
@@ -223,7 +377,7 @@ class ExecutionEngine:
             pos["tp"] = tp
             pos["r_value"] = float(r_value)
             actions.append(f"Thiết lập SL/TP ban đầu SL={round(sl,6)} TP={round(tp,6)}")
-            self.notifier.send(f"THIẾT LẬP SL/TP ban đầu SL={round(sl,6)} TP={round(tp,6)}")
+            self._notify(f"THIẾT LẬP SL/TP ban đầu SL={round(sl,6)} TP={round(tp,6)}")
 
         hit_tp = (price_now >= tp) if side == "LONG" else (price_now <= tp)
         hit_sl = (price_now <= sl) if side == "LONG" else (price_now >= sl)
@@ -240,7 +394,7 @@ class ExecutionEngine:
                 "sl": round(pos.get("sl", 0.0),6), "tp": round(pos.get("tp", 0.0),6),
                 "size": round(size,6), "opened_at": int(pos.get("opened_at", 0)), "closed_at": int(ts_now)
             })
-            self.notifier.send(
+            self._notify(
                 f"ĐÓNG LỆNH {result} {pos['symbol']} {side}\n├ Lợi nhuận: {round(pnl,6)}\n└ ({round(pnl_r,2)}R)"
             )
             (self.state.get("positions") or {}).pop(pair_key, None)
@@ -254,7 +408,7 @@ class ExecutionEngine:
                 if (side == "LONG" and (sl is None or new_sl > sl)) or (side == "SHORT" and (sl is None or new_sl < sl)):
                     pos["sl"] = new_sl
                     actions.append(f"Đưa SL về hòa vốn tại={round(new_sl,6)}")
-                    self.notifier.send(f"ĐƯA SL VỀ HÒA VỐN {pos['symbol']} tại={round(new_sl,6)}")
+                    self._notify(f"ĐƯA SL VỀ HÒA VỐN {pos['symbol']} tại={round(new_sl,6)}")
 
             if gain >= trailing_at * r_value:
                 if side == "LONG":
@@ -262,11 +416,11 @@ class ExecutionEngine:
                     if trail_sl > pos["sl"]:
                         pos["sl"] = trail_sl
                         actions.append(f"SL động (trailing) lên={round(trail_sl,6)}")
-                        self.notifier.send(f"SL ĐỘNG (TRAILING) {pos['symbol']} lên={round(trail_sl,6)}")
+                        self._notify(f"SL ĐỘNG (TRAILING) {pos['symbol']} lên={round(trail_sl,6)}")
                 else:
                     trail_sl = price_now + r_value
                     if trail_sl < pos["sl"]:
                         pos["sl"] = trail_sl
                         actions.append(f"SL động (trailing) xuống={round(trail_sl,6)}")
-                        self.notifier.send(f"SL ĐỘNG (TRAILING) {pos['symbol']} xuống={round(trail_sl,6)}")
+                        self._notify(f"SL ĐỘNG (TRAILING) {pos['symbol']} xuống={round(trail_sl,6)}")
         return actions
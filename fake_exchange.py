@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Sàn giả lập cục bộ cho fetch OHLCV / ticker (đo tốc độ offline, không cần mạng).
+
+Nến được sinh xác định theo (symbol, chỉ số nến 5m) nên cùng một tham số luôn
+trả về cùng dữ liệu; khung lớn hơn được gộp từ nến 5m như sàn thật.
+Mỗi request ngủ `latency` giây để mô phỏng round-trip REST.
+"""
+import asyncio
+import time
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+BASE_TF_MS = 5 * 60 * 1000
+
+TF_MS = {
+    "1m": 60 * 1000,
+    "5m": 5 * 60 * 1000,
+    "15m": 15 * 60 * 1000,
+    "30m": 30 * 60 * 1000,
+    "1h": 60 * 60 * 1000,
+    "4h": 4 * 60 * 60 * 1000,
+    "1d": 24 * 60 * 60 * 1000,
+}
+
+def _noise(idx: np.ndarray, seed: float) -> np.ndarray:
+    x = np.sin(idx * 12.9898 + seed) * 43758.5453
+    return x - np.floor(x)
+
+def _base_closes(idx: np.ndarray, seed: float, base_price: float) -> np.ndarray:
+    i = idx.astype(float)
+    return base_price * (
+        1.0
+        + 0.03 * np.sin(i / 97.0 + seed)
+        + 0.01 * np.sin(i / 13.7 + 2 * seed)
+        + 0.003 * (_noise(idx, seed) - 0.5)
+    )
+
+class FakeExchange:
+    """Stand-in đồng bộ: cùng chữ ký fetch_ohlcv với ccxt."""
+
+    def __init__(self, latency: float = 0.15, now_ms: Optional[int] = None):
+        self.latency = float(latency)
+        self._now_ms = now_ms
+        self.requests = 0
+        self.rows_served = 0
+
+    def milliseconds(self) -> int:
+        return int(self._now_ms) if self._now_ms is not None else int(time.time() * 1000)
+
+    def _candles(self, symbol: str, timeframe: str, since: Optional[int], limit: Optional[int]) -> List[list]:
+        tf_ms = TF_MS[timeframe]
+        ratio = max(1, tf_ms // BASE_TF_MS)
+        seed = (zlib.crc32(symbol.encode()) % 1000) / 7.0
+        base_price = 10.0 + (zlib.crc32(symbol.encode()) % 50000)
+
+        now_ms = self.milliseconds()
+        last_open = now_ms - now_ms % tf_ms
+        limit = int(limit or 500)
+        if since is None:
+            first_open = last_open - (limit - 1) * tf_ms
+        else:
+            first_open = since - since % tf_ms
+            if first_open < since:
+                first_open += tf_ms
+        n = int((last_open - first_open) // tf_ms) + 1
+        n = max(0, min(n, limit))
+        if n == 0:
+            return []
+
+        # Sinh nến 5m của toàn bộ cửa sổ (tới nến 5m đang chạy) rồi gộp lên khung yêu cầu
+        start_idx = first_open // BASE_TF_MS
+        stop_idx = min(start_idx + n * ratio, now_ms // BASE_TF_MS + 1)
+        idx = np.arange(start_idx - 1, stop_idx, dtype=np.int64)
+        closes = _base_closes(idx, seed, base_price)
+        opens = closes[:-1]
+        closes = closes[1:]
+        idx = idx[1:]
+        wick = 0.002 * _noise(idx, seed + 1.0)
+        highs = np.maximum(opens, closes) * (1 + wick)
+        lows = np.minimum(opens, closes) * (1 - wick)
+        vols = 100.0 + 50.0 * _noise(idx, seed + 2.0)
+
+        starts = np.arange(0, len(idx), ratio)
+        ends = np.minimum(starts + ratio, len(idx))
+        o = opens[starts]
+        h = np.maximum.reduceat(highs, starts)
+        l = np.minimum.reduceat(lows, starts)
+        c = closes[ends - 1]
+        v = np.add.reduceat(vols, starts)
+        ts = first_open + np.arange(n, dtype=np.int64) * tf_ms
+        return [[int(t), float(a), float(b), float(d), float(e), float(f)]
+                for t, a, b, d, e, f in zip(ts, o, h, l, c, v)]
+
+    def _tickers(self, symbols) -> dict:
+        out = {}
+        for s in symbols:
+            last = self._candles(s, "5m", None, 1)[-1]
+            out[s] = {"symbol": s, "timestamp": self.milliseconds(), "last": last[4], "close": last[4]}
+        return out
+
+    def fetch_tickers(self, symbols=None, params={}):
+        time.sleep(self.latency)
+        self.requests += 1
+        return self._tickers(symbols or [])
+
+    def fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=None, params={}):
+        time.sleep(self.latency)
+        rows = self._candles(symbol, timeframe, since, limit)
+        self.requests += 1
+        self.rows_served += len(rows)
+        return rows
+
+class AsyncFakeExchange(FakeExchange):
+    """Stand-in bất đồng bộ, thay cho ccxt.async_support.binance."""
+
+    async def fetch_tickers(self, symbols=None, params={}):
+        await asyncio.sleep(self.latency)
+        self.requests += 1
+        return self._tickers(symbols or [])
+
+    async def fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=None, params={}):
+        await asyncio.sleep(self.latency)
+        rows = self._candles(symbol, timeframe, since, limit)
+        self.requests += 1
+        self.rows_served += len(rows)
+        return rows
+
+    async def close(self):
+        return None
+
+def install_async_fake(latency: float = 0.15, concurrency: int = 8) -> AsyncFakeExchange:
+    """Cho fetcher dùng chung của process (data.get_async_fetcher) đọc từ sàn giả."""
+    import data
+    ex = AsyncFakeExchange(latency=latency)
+    data._async_fetcher = data.AsyncFetcher(exchange=ex, concurrency=concurrency)
+    return ex
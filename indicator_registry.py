@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Registry chỉ báo: mỗi chỉ báo khai báo field đầu ra (key trong kết quả
+calculate_indicators), cột OHLCV đầu vào, tham số, lookback và luật vote.
+
+- lookback: số nến frame cần để giá trị nến cuối ổn định (seed của chỉ báo đệ quy
+  đã phai, VWAP neo đầu frame) → dùng để chọn limit khi fetch.
+- min_bars: số nến tối thiểu để field có >= 5 giá trị hợp lệ (điều kiện trả về
+  None của calculate_indicators).
+- vote: (close nến cuối, {field: giá trị nến cuối}) → "LONG"/"SHORT"/"-";
+  None với chỉ báo không vote (ATR).
+- vote_vec: cùng luật trên cả chuỗi (mảng close, {field: mảng}) → int8 1/0/-1,
+  dùng cho direction_matrix / tally_votes_matrix khi chấm điểm lịch sử.
+
+Tham số là hằng số của các kernel trong indicators.py / batch_indicators.py;
+đổi ở đây thì phải đổi cả kernel.
+"""
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from votes import DEFAULT_WEIGHTS, _normalize_key
+
+def _vote_ema200(close, v): return "LONG" if close > v["ema200"] else "SHORT"
+def _vote_ma50(close, v): return "LONG" if close > v["ma50"] else "SHORT"
+def _vote_macd(close, v): return "LONG" if v["macd"] > v["macd_signal"] else "SHORT"
+def _vote_rsi(close, v): return "LONG" if v["rsi"] > 55 else ("SHORT" if v["rsi"] < 45 else "-")
+def _vote_adx(close, v): return "LONG" if v["adx"] > 25 else "-"
+def _vote_vwap(close, v): return "LONG" if close > v["vwap"] else "SHORT"
+def _vote_supertrend(close, v): return "LONG" if v["supertrend"] == 1 else "SHORT"
+def _vote_range(close, v): return "LONG" if v["range_filter"] == 1 else "SHORT"
+def _vote_chaikin(close, v): return "LONG" if v["chaikin_mf"] > 0 else "SHORT"
+def _vote_volume_spike(close, v): return "LONG" if v["volume_spike"] == 1 else "-"
+def _vote_stoch_rsi(close, v): return "LONG" if v["stoch_rsi"] > 0.8 else ("SHORT" if v["stoch_rsi"] < 0.2 else "-")
+def _vote_bollinger(close, v):
+    return (
+        "LONG" if close > v["bollinger_bands_upper"]
+        else ("SHORT" if close < v["bollinger_bands_lower"] else "-")
+    )
+
+def _sign(long_mask, short_mask=None):
+    out = np.where(long_mask, 1, 0).astype(np.int8)
+    if short_mask is not None:
+        out[short_mask & ~long_mask] = -1
+    return out
+
+# Bản vector của luật vote ở trên (NaN so sánh ra False → cùng kết quả với bản scalar)
+def _vec_ema200(c, v): return _sign(c > v["ema200"], ~(c > v["ema200"]))
+def _vec_ma50(c, v): return _sign(c > v["ma50"], ~(c > v["ma50"]))
+def _vec_macd(c, v): m = v["macd"] > v["macd_signal"]; return _sign(m, ~m)
+def _vec_rsi(c, v): return _sign(v["rsi"] > 55, v["rsi"] < 45)
+def _vec_adx(c, v): return _sign(v["adx"] > 25)
+def _vec_vwap(c, v): return _sign(c > v["vwap"], ~(c > v["vwap"]))
+def _vec_supertrend(c, v): m = v["supertrend"] == 1; return _sign(m, ~m)
+def _vec_range(c, v): m = v["range_filter"] == 1; return _sign(m, ~m)
+def _vec_chaikin(c, v): m = v["chaikin_mf"] > 0; return _sign(m, ~m)
+def _vec_volume_spike(c, v): return _sign(v["volume_spike"] == 1)
+def _vec_stoch_rsi(c, v): return _sign(v["stoch_rsi"] > 0.8, v["stoch_rsi"] < 0.2)
+def _vec_bollinger(c, v): return _sign(c > v["bollinger_bands_upper"], c < v["bollinger_bands_lower"])
+
+# Thứ tự = thứ tự map vote của build_indicator_results
+INDICATOR_REGISTRY: Dict[str, Dict] = {
+    "EMA200": {"fields": ("ema200",), "inputs": ("close",), "params": {"window": 200},
+               "lookback": 300, "min_bars": 204, "vote": _vote_ema200, "vote_vec": _vec_ema200},
+    "MA50": {"fields": ("ma50",), "inputs": ("close",), "params": {"window": 50},
+             "lookback": 50, "min_bars": 54, "vote": _vote_ma50, "vote_vec": _vec_ma50},
+    "MACD": {"fields": ("macd", "macd_signal"), "inputs": ("close",), "params": {"fast": 12, "slow": 26, "signal": 9},
+             "lookback": 150, "min_bars": 38, "vote": _vote_macd, "vote_vec": _vec_macd},
+    "RSI": {"fields": ("rsi",), "inputs": ("close",), "params": {"window": 14},
+            "lookback": 150, "min_bars": 18, "vote": _vote_rsi, "vote_vec": _vec_rsi},
+    "ADX": {"fields": ("adx",), "inputs": ("high", "low", "close"), "params": {"window": 14},
+            "lookback": 150, "min_bars": 28, "vote": _vote_adx, "vote_vec": _vec_adx},
+    "VWAP": {"fields": ("vwap",), "inputs": ("high", "low", "close", "volume"), "params": {},
+             "lookback": 300, "min_bars": 5, "vote": _vote_vwap, "vote_vec": _vec_vwap},
+    "Supertrend": {"fields": ("supertrend",), "inputs": ("high", "low", "close"), "params": {"period": 10, "multiplier": 3},
+                   "lookback": 150, "min_bars": 10, "vote": _vote_supertrend, "vote_vec": _vec_supertrend},
+    "Range": {"fields": ("range_filter",), "inputs": ("high", "low"), "params": {"window": 20, "threshold": 1.5},
+              "lookback": 20, "min_bars": 20, "vote": _vote_range, "vote_vec": _vec_range},
+    "Chaikin_MF": {"fields": ("chaikin_mf",), "inputs": ("high", "low", "close", "volume"), "params": {"window": 20},
+                   "lookback": 20, "min_bars": 24, "vote": _vote_chaikin, "vote_vec": _vec_chaikin},
+    "Volume_Spike": {"fields": ("volume_spike",), "inputs": ("volume",), "params": {"window": 20, "threshold": 1.5},
+                     "lookback": 20, "min_bars": 20, "vote": _vote_volume_spike, "vote_vec": _vec_volume_spike},
+    "StochRSI": {"fields": ("stoch_rsi",), "inputs": ("close",), "params": {"window": 14},
+                 "lookback": 150, "min_bars": 31, "vote": _vote_stoch_rsi, "vote_vec": _vec_stoch_rsi},
+    "BollingerBands": {"fields": ("bollinger_bands_upper", "bollinger_bands_lower", "bollinger_bands_mid", "bollinger_bands"),
+                       "inputs": ("close",), "params": {"window": 20, "window_dev": 2},
+                       "lookback": 20, "min_bars": 24, "vote": _vote_bollinger, "vote_vec": _vec_bollinger},
+    "ATR": {"fields": ("atr",), "inputs": ("high", "low", "close"), "params": {"window": 14},
+            "lookback": 150, "min_bars": 14, "vote": None, "vote_vec": None},
+}
+
+FIELD_TO_INDICATOR: Dict[str, str] = {
+    f: name for name, spec in INDICATOR_REGISTRY.items() for f in spec["fields"]
+}
+
+VOTE_NAMES: Tuple[str, ...] = tuple(n for n, s in INDICATOR_REGISTRY.items() if s["vote"] is not None)
+
+def active_indicators(weights: Optional[Dict[str, float]] = None, use_defaults: bool = True) -> Tuple[str, ...]:
+    """
+    Tên các chỉ báo vote có trọng số khác 0. use_defaults=True theo đúng tally_votes
+    (chỉ báo không có trong weights lấy DEFAULT_WEIGHTS); False: chỉ key có trong weights.
+    """
+    wmap = {_normalize_key(k): float(v) for k, v in DEFAULT_WEIGHTS.items()} if use_defaults else {}
+    for k, v in (weights or {}).items():
+        wmap[_normalize_key(k)] = float(v)
+    return tuple(n for n in VOTE_NAMES if wmap.get(_normalize_key(n), 1.0 if use_defaults else 0.0) != 0)
+
+def fields_for(names: Iterable[str], extra_fields: Iterable[str] = ()) -> frozenset:
+    """Tập field cần tính cho các chỉ báo `names` cộng thêm field dùng ngoài vote."""
+    out = set(extra_fields)
+    for name in names:
+        out.update(INDICATOR_REGISTRY[name]["fields"])
+    return frozenset(out)
+
+def _specs(fields: Iterable[str]):
+    return [INDICATOR_REGISTRY[FIELD_TO_INDICATOR[f]] for f in fields]
+
+def lookback(fields: Iterable[str]) -> int:
+    """Số nến cần fetch cho tập field (lookback lớn nhất)."""
+    return max((s["lookback"] for s in _specs(fields)), default=0)
+
+def min_bars(fields: Iterable[str]) -> int:
+    return max((s["min_bars"] for s in _specs(fields)), default=0)
+
+def direction_matrix(close, values: Dict[str, object], names: Sequence[str] = VOTE_NAMES) -> np.ndarray:
+    """
+    Ma trận hướng vote int8 (bars × len(names)) từ chuỗi chỉ báo đầy đủ
+    (kết quả calculate_indicators mode full) để đưa vào tally_votes_matrix.
+    """
+    c = np.asarray(close, dtype=np.float64)
+    arrs: Dict[str, np.ndarray] = {}
+    cols = []
+    for name in names:
+        spec = INDICATOR_REGISTRY[name]
+        for f in spec["fields"]:
+            if f not in arrs:
+                arrs[f] = np.asarray(values[f], dtype=np.float64)
+        cols.append(spec["vote_vec"](c, arrs))
+    return np.stack(cols, axis=1) if cols else np.zeros((len(c), 0), dtype=np.int8)
@@ -1,79 +1,399 @@
+import json
+import math
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
 import ta
 
-def calculate_indicators(ohlcv_df, config=None, timeframe=None):
-    min_window = 200
+from indicator_registry import FIELD_TO_INDICATOR, min_bars
+from stream_indicators import StreamingIndicators
+
+NAN = float("nan")
+
+GATE_KEYS = (
+    "ema200", "ma50", "macd", "macd_signal", "rsi", "adx", "vwap", "supertrend",
+    "range_filter", "atr", "chaikin_mf", "volume_spike", "stoch_rsi",
+    "bollinger_bands_upper", "bollinger_bands_lower", "bollinger_bands_mid", "bollinger_bands",
+    "trend_h4", "trend_d1",
+)
+
+def _supertrend_pandas(df, period=10, multiplier=3):
+    """Bản gốc duyệt từng dòng bằng .iloc (giữ làm chuẩn đối chiếu/benchmark)."""
+    atr = ta.volatility.average_true_range(df['high'], df['low'], df['close'], window=period)
+    hl2 = (df['high'] + df['low']) / 2
+    basic_ub = hl2 + multiplier * atr
+    basic_lb = hl2 - multiplier * atr
+    final_ub = basic_ub.copy()
+    final_lb = basic_lb.copy()
+    supertrend_list = [1]
+    for i in range(1,len(df)):
+        if df['close'].iloc[i-1] > final_ub.iloc[i-1]:
+            final_ub.iloc[i] = min(basic_ub.iloc[i], final_ub.iloc[i-1])
+        else:
+            final_ub.iloc[i] = basic_ub.iloc[i]
+        if df['close'].iloc[i-1] < final_lb.iloc[i-1]:
+            final_lb.iloc[i] = max(basic_lb.iloc[i], final_lb.iloc[i-1])
+        else:
+            final_lb.iloc[i] = basic_lb.iloc[i]
+        if df['close'].iloc[i] > final_ub.iloc[i-1]:
+            supertrend_list.append(1)
+        elif df['close'].iloc[i] < final_lb.iloc[i-1]:
+            supertrend_list.append(-1)
+        else:
+            supertrend_list.append(supertrend_list[-1])
+    return pd.Series(supertrend_list, index=df.index)
+
+def supertrend_kernel(close, basic_ub, basic_lb):
+    """
+    Vòng lặp Supertrend trên mảng float64 thuần (không index pandas).
+    Trả về mảng int64 gồm 1/-1, cùng logic dải final_ub/final_lb với bản gốc.
+    """
+    c = np.asarray(close, dtype=np.float64).tolist()
+    bub = np.asarray(basic_ub, dtype=np.float64).tolist()
+    blb = np.asarray(basic_lb, dtype=np.float64).tolist()
+    n = len(c)
+    out = [1] * n
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    fub, flb, trend = bub[0], blb[0], 1
+    for i in range(1, n):
+        pc = c[i-1]
+        nub = min(bub[i], fub) if pc > fub else bub[i]
+        nlb = max(blb[i], flb) if pc < flb else blb[i]
+        ci = c[i]
+        if ci > fub:
+            trend = 1
+        elif ci < flb:
+            trend = -1
+        out[i] = trend
+        fub, flb = nub, nlb
+    return np.asarray(out, dtype=np.int64)
+
+def true_range(high, low, close):
+    """TR như ta: nến đầu = high - low, sau đó max(h-l, |h-c_prev|, |l-c_prev|)."""
+    h = np.asarray(high, dtype=np.float64)
+    l = np.asarray(low, dtype=np.float64)
+    c = np.asarray(close, dtype=np.float64)
+    tr = h - l
+    if len(c) > 1:
+        pc = c[:-1]
+        tr[1:] = np.fmax(np.fmax(tr[1:], np.abs(h[1:] - pc)), np.abs(l[1:] - pc))
+    return tr
+
+def wilder_atr(tr, window=14):
+    """ATR của ta trên mảng TR: 0 trước nến window-1, seed = mean(TR đầu), rồi làm mượt Wilder."""
+    tr = np.asarray(tr, dtype=np.float64)
+    n = len(tr)
+    out = np.zeros(n, dtype=np.float64)
+    if n < window:
+        return out
+    prev = float(tr[:window].mean())
+    out[window - 1] = prev
+    vals = tr.tolist()
+    res = out.tolist()
+    for i in range(window, n):
+        prev = (prev * (window - 1) + vals[i]) / float(window)
+        res[i] = prev
+    return np.asarray(res, dtype=np.float64)
+
+def _supertrend_numpy(df, period=10, multiplier=3):
+    high = df['high'].to_numpy(dtype=np.float64)
+    low = df['low'].to_numpy(dtype=np.float64)
+    close = df['close'].to_numpy(dtype=np.float64)
+    atr = wilder_atr(true_range(high, low, close), period)
+    hl2 = (high + low) / 2
+    trend = supertrend_kernel(close, hl2 + multiplier * atr, hl2 - multiplier * atr)
+    return pd.Series(trend, index=df.index)
+
+SUPERTREND_IMPLS = {
+    "pandas": _supertrend_pandas,
+    "numpy": _supertrend_numpy,
+}
+DEFAULT_SUPERTREND_IMPL = "numpy"
+
+def last_value(x, default=None):
+    """Giá trị nến cuối: Series/mảng → phần tử cuối, scalar (mode="gate") → chính nó."""
+    if x is None:
+        return default
+    if hasattr(x, "iloc"):
+        return x.iloc[-1] if len(x) else default
+    if isinstance(x, (list, tuple, np.ndarray)):
+        return x[-1] if len(x) else default
+    return x
+
+class IndicatorSnapshot:
+    """Giá trị nến cuối của từng chỉ báo (mode="gate"), đọc như dict: ind["atr"], ind.get("rsi")."""
+    __slots__ = GATE_KEYS
+
+    def __init__(self, **values):
+        for key in GATE_KEYS:
+            setattr(self, key, values.get(key))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if isinstance(key, str) else default
+
+    def __contains__(self, key):
+        return key in GATE_KEYS
+
+    def keys(self):
+        return GATE_KEYS
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in GATE_KEYS]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"IndicatorSnapshot({self.to_dict()})"
+
+def _ema_values(vals, alpha):
+    """EMA adjust=False trên list float (chưa áp min_periods)."""
+    out = []
+    prev = None
+    for x in vals:
+        prev = x if prev is None else alpha * x + (1.0 - alpha) * prev
+        out.append(prev)
+    return out
+
+def _rsi_values(close, window=14):
+    """RSI của ta: up/down làm mượt Wilder (alpha=1/window), NaN trước nến window-1."""
+    alpha = 1.0 / window
+    out = [NAN] * len(close)
+    eu = ed = 0.0
+    for i in range(len(close)):
+        diff = close[i] - close[i-1] if i else 0.0
+        up = diff if diff > 0 else 0.0
+        dn = -diff if diff < 0 else 0.0
+        if i == 0:
+            eu, ed = up, dn
+        else:
+            eu = alpha * up + (1.0 - alpha) * eu
+            ed = alpha * dn + (1.0 - alpha) * ed
+        if i >= window - 1:
+            out[i] = 100.0 if ed == 0 else 100 - (100 / (1 + eu / ed))
+    return out
+
+def _adx_last(high, low, tr, window=14):
+    """ADX nến cuối theo ta.trend.adx (seed tổng `window` nến đầu, rồi trung bình `window` DX đầu)."""
+    w = window
+    trs = dip = din = adx = 0.0
+    dx_seed = []
+    for k in range(1, len(high)):
+        du = high[k] - high[k-1]
+        dd = low[k-1] - low[k]
+        pos = du if (du > dd and du > 0) else 0.0
+        neg = dd if (dd > du and dd > 0) else 0.0
+        if k <= w:
+            trs += tr[k]; dip += pos; din += neg
+        else:
+            trs = trs - trs / w + tr[k]
+            dip = dip - dip / w + pos
+            din = din - din / w + neg
+        if k < w:
+            continue
+        pdi = 100 * (dip / trs) if trs != 0 else 0.0
+        ndi = 100 * (din / trs) if trs != 0 else 0.0
+        dx = 100 * abs((pdi - ndi) / (pdi + ndi)) if pdi + ndi != 0 else 0.0
+        j = k - w
+        if j < w - 1:
+            dx_seed.append(dx)
+        elif j == w - 1:
+            adx = math.fsum(dx_seed + [dx]) / w
+        else:
+            adx = (adx * (w - 1) + dx) / w
+    return adx
+
+def _trend(close, ema200):
+    if close != close or ema200 != ema200:
+        return "-"
+    return "UP" if close > ema200 else "DOWN"
+
+def _trend_key(timeframe):
+    """Field trend mà timeframe này tính (trend_h4 / trend_d1) hoặc None."""
+    if timeframe is None:
+        return None
+    tf = str(timeframe).lower()
+    if tf in ['4h','h4']:
+        return 'trend_h4'
+    if tf in ['1d','d1','daily']:
+        return 'trend_d1'
+    return None
+
+def _gate_indicators(ohlcv_df, timeframe=None, fields=None):
+    """
+    Chỉ tính giá trị nến cuối. Chỉ báo cửa sổ trượt (MA50, Bollinger, CMF, range,
+    volume spike) chỉ đọc đuôi frame; chỉ báo đệ quy (EMA/MACD/RSI/ADX/ATR/Supertrend)
+    vẫn phải chạy hết frame để khớp seed của ta, nhưng trên float thuần, không dựng Series.
+    TR dùng chung cho ATR14, ATR10 (Supertrend) và ADX; EMA200 dùng chung cho trend.
+    """
+    want = (lambda f: True) if fields is None else fields.__contains__
+    h = ohlcv_df['high'].to_numpy(dtype=np.float64)
+    l = ohlcv_df['low'].to_numpy(dtype=np.float64)
+    c = ohlcv_df['close'].to_numpy(dtype=np.float64)
+    v = ohlcv_df['volume'].to_numpy(dtype=np.float64)
+    # Tương đương kiểm tra ">= 5 giá trị hợp lệ" của mode full
+    need = min_bars(fields if fields is not None else FIELD_TO_INDICATOR)
+    if np.count_nonzero(~np.isnan(c)) < need:
+        print(f"[ERROR] Chỉ báo cần >= {need} nến hợp lệ.")
+        return None
+
+    out = {}
+    cl = c.tolist()
+    close = cl[-1]
+    if want('atr') or want('supertrend') or want('adx'):
+        tr = true_range(h, l, c)
+
+    if want('ema200'):
+        out['ema200'] = _ema_values(cl, 2.0 / 201)[-1]
+    if want('macd') or want('macd_signal'):
+        fast = _ema_values(cl, 2.0 / 13)
+        slow = _ema_values(cl, 2.0 / 27)
+        macd_line = [f - s for f, s in zip(fast[25:], slow[25:])]
+        out['macd'] = macd_line[-1]
+        out['macd_signal'] = _ema_values(macd_line, 2.0 / 10)[-1] if len(macd_line) >= 9 else NAN
+
+    if want('rsi') or want('stoch_rsi'):
+        rsi_all = _rsi_values(cl, 14)
+        rsi = out['rsi'] = rsi_all[-1]
+        win = rsi_all[-14:]
+        if any(x != x for x in win):
+            out['stoch_rsi'] = NAN
+        else:
+            lo, hi = min(win), max(win)
+            out['stoch_rsi'] = (rsi - lo) / (hi - lo) if hi != lo else NAN
+
+    if want('supertrend'):
+        atr10 = wilder_atr(tr, 10)
+        hl2 = (h + l) / 2
+        out['supertrend'] = int(supertrend_kernel(c, hl2 + 3 * atr10, hl2 - 3 * atr10)[-1])
+    if want('atr'):
+        out['atr'] = float(wilder_atr(tr, 14)[-1])
+    if want('adx'):
+        out['adx'] = _adx_last(h.tolist(), l.tolist(), tr.tolist(), 14)
+
+    if want('vwap'):
+        vol_sum = float(v.sum())
+        out['vwap'] = float(((h + l + c) / 3 * v).sum()) / vol_sum if vol_sum != 0 else NAN
+    if want('ma50'):
+        out['ma50'] = float(c[-50:].mean())
+
+    v20 = v[-20:]
+    if want('range_filter'):
+        rng = h[-20:] - l[-20:]
+        out['range_filter'] = int(rng[-1] > rng.mean() * 1.5)
+    if want('volume_spike'):
+        out['volume_spike'] = int(v20[-1] > v20.mean() * 1.5)
+    if want('chaikin_mf'):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mfv = ((c[-20:] - l[-20:]) - (h[-20:] - c[-20:])) / (h[-20:] - l[-20:]) * v20
+        mfv[~np.isfinite(mfv)] = 0.0
+        v20_sum = float(v20.sum())
+        out['chaikin_mf'] = float(mfv.sum()) / v20_sum if v20_sum != 0 else NAN
+
+    if want('bollinger_bands') or want('bollinger_bands_upper') or want('bollinger_bands_lower') or want('bollinger_bands_mid'):
+        c20 = c[-20:]
+        mid = float(c20.mean())
+        sd = float(c20.std())
+        upper, lower = mid + 2 * sd, mid - 2 * sd
+        out.update(bollinger_bands_upper=upper, bollinger_bands_lower=lower,
+                   bollinger_bands_mid=mid, bollinger_bands=upper - lower)
+
+    values = {'trend_h4': "-", 'trend_d1': "-", **out}
+    trend_key = _trend_key(timeframe)
+    if trend_key:
+        values[trend_key] = _trend(close, out['ema200'])
+    return IndicatorSnapshot(**values)
+
+def calculate_indicators(ohlcv_df, config=None, timeframe=None, mode=None, fields=None):
+    """
+    mode="full" (mặc định): dict các Series đầy đủ, dùng cho backtest/biểu đồ.
+    mode="gate": IndicatorSnapshot chỉ chứa giá trị nến cuối, dùng cho vòng quét live.
+    Không truyền mode thì đọc config["indicators"]["mode"].
+    fields: chỉ tính các field này (xem indicator_registry); None = tất cả.
+    """
+    trend_key = _trend_key(timeframe)
+    if fields is not None:
+        fields = set(fields) | ({'ema200'} if trend_key else set())
+        min_window = min_bars(fields)
+    else:
+        min_window = 200
     if ohlcv_df is None or len(ohlcv_df) < min_window:
         print(f"[ERROR] DataFrame quá nhỏ ({len(ohlcv_df) if ohlcv_df is not None else 0}), cần >= {min_window}")
         return None
+    if mode is None:
+        mode = ((config or {}).get("indicators") or {}).get("mode", "full")
+    if mode == "gate":
+        return _gate_indicators(ohlcv_df, timeframe, fields)
 
+    want = (lambda f: True) if fields is None else fields.__contains__
+    close = ohlcv_df['close']
     indicators = {}
-    indicators['ema200'] = ta.trend.ema_indicator(ohlcv_df['close'], window=200)
-    indicators['ma50'] = ta.trend.sma_indicator(ohlcv_df['close'], window=50)
-    indicators['macd'] = ta.trend.macd(ohlcv_df['close'])
-    indicators['macd_signal'] = ta.trend.macd_signal(ohlcv_df['close'])
-    indicators['rsi'] = ta.momentum.rsi(ohlcv_df['close'], window=14)
-    indicators['adx'] = ta.trend.adx(ohlcv_df['high'], ohlcv_df['low'], ohlcv_df['close'], window=14)
-
-    typical_price = (ohlcv_df['high'] + ohlcv_df['low'] + ohlcv_df['close']) / 3
-    cum_tp_vol = (typical_price * ohlcv_df['volume']).cumsum()
-    cum_vol = ohlcv_df['volume'].cumsum()
-    indicators['vwap'] = cum_tp_vol / cum_vol
-
-    def supertrend(df, period=10, multiplier=3):
-        atr = ta.volatility.average_true_range(df['high'], df['low'], df['close'], window=period)
-        hl2 = (df['high'] + df['low']) / 2
-        basic_ub = hl2 + multiplier * atr
-        basic_lb = hl2 - multiplier * atr
-        final_ub = basic_ub.copy()
-        final_lb = basic_lb.copy()
-        supertrend_list = [1]
-        for i in range(1,len(df)):
-            if df['close'].iloc[i-1] > final_ub.iloc[i-1]:
-                final_ub.iloc[i] = min(basic_ub.iloc[i], final_ub.iloc[i-1])
-            else:
-                final_ub.iloc[i] = basic_ub.iloc[i]
-            if df['close'].iloc[i-1] < final_lb.iloc[i-1]:
-                final_lb.iloc[i] = max(basic_lb.iloc[i], final_lb.iloc[i-1])
-            else:
-                final_lb.iloc[i] = basic_lb.iloc[i]
-            if df['close'].iloc[i] > final_ub.iloc[i-1]:
-                supertrend_list.append(1)
-            elif df['close'].iloc[i] < final_lb.iloc[i-1]:
-                supertrend_list.append(-1)
-            else:
-                supertrend_list.append(supertrend_list[-1])
-        return pd.Series(supertrend_list, index=df.index)
-    indicators['supertrend'] = supertrend(ohlcv_df)
+    if want('ema200'):
+        indicators['ema200'] = ta.trend.ema_indicator(close, window=200)
+    if want('ma50'):
+        indicators['ma50'] = ta.trend.sma_indicator(close, window=50)
+    if want('macd') or want('macd_signal'):
+        indicators['macd'] = ta.trend.macd(close)
+        indicators['macd_signal'] = ta.trend.macd_signal(close)
+    if want('rsi'):
+        indicators['rsi'] = ta.momentum.rsi(close, window=14)
+    if want('adx'):
+        indicators['adx'] = ta.trend.adx(ohlcv_df['high'], ohlcv_df['low'], close, window=14)
+
+    if want('vwap'):
+        typical_price = (ohlcv_df['high'] + ohlcv_df['low'] + close) / 3
+        cum_tp_vol = (typical_price * ohlcv_df['volume']).cumsum()
+        cum_vol = ohlcv_df['volume'].cumsum()
+        indicators['vwap'] = cum_tp_vol / cum_vol
+
+    if want('supertrend'):
+        impl = ((config or {}).get("indicators") or {}).get("supertrend_impl", DEFAULT_SUPERTREND_IMPL)
+        indicators['supertrend'] = SUPERTREND_IMPLS[impl](ohlcv_df)
 
     def range_filter(df, threshold=1.5):
         rng = df['high'] - df['low']
         return (rng > (rng.rolling(window=20).mean() * threshold)).astype(int)
-    indicators['range_filter'] = range_filter(ohlcv_df)
+    if want('range_filter'):
+        indicators['range_filter'] = range_filter(ohlcv_df)
 
-    indicators['atr'] = ta.volatility.average_true_range(
-        ohlcv_df['high'], ohlcv_df['low'], ohlcv_df['close'], window=14
-    )
+    if want('atr'):
+        indicators['atr'] = ta.volatility.average_true_range(
+            ohlcv_df['high'], ohlcv_df['low'], close, window=14
+        )
 
     def chaikin_money_flow(df, window=20):
         mfv = ((df['close'] - df['low']) - (df['high'] - df['close'])) / (df['high'] - df['low']) * df['volume']
         mfv = mfv.replace([float('inf'), -float('inf')], 0).fillna(0)
         cmf = mfv.rolling(window=window).sum() / df['volume'].rolling(window=window).sum()
         return cmf
-    indicators['chaikin_mf'] = chaikin_money_flow(ohlcv_df, window=20)
+    if want('chaikin_mf'):
+        indicators['chaikin_mf'] = chaikin_money_flow(ohlcv_df, window=20)
 
     def volume_spike(df, threshold=1.5):
         avg_vol = df['volume'].rolling(window=20).mean()
         return (df['volume'] > avg_vol * threshold).astype(int)
-    indicators['volume_spike'] = volume_spike(ohlcv_df)
+    if want('volume_spike'):
+        indicators['volume_spike'] = volume_spike(ohlcv_df)
 
-    indicators['stoch_rsi'] = ta.momentum.stochrsi(ohlcv_df['close'], window=14, smooth1=3, smooth2=3)
+    if want('stoch_rsi'):
+        indicators['stoch_rsi'] = ta.momentum.stochrsi(close, window=14, smooth1=3, smooth2=3)
 
-    bb = ta.volatility.BollingerBands(ohlcv_df['close'], window=20, window_dev=2)
-    indicators['bollinger_bands_upper'] = bb.bollinger_hband()
-    indicators['bollinger_bands_lower'] = bb.bollinger_lband()
-    indicators['bollinger_bands_mid'] = bb.bollinger_mavg()
-    indicators['bollinger_bands'] = bb.bollinger_hband() - bb.bollinger_lband()
+    if any(want(k) for k in ('bollinger_bands', 'bollinger_bands_upper', 'bollinger_bands_lower', 'bollinger_bands_mid')):
+        bb = ta.volatility.BollingerBands(close, window=20, window_dev=2)
+        indicators['bollinger_bands_upper'] = bb.bollinger_hband()
+        indicators['bollinger_bands_lower'] = bb.bollinger_lband()
+        indicators['bollinger_bands_mid'] = bb.bollinger_mavg()
+        indicators['bollinger_bands'] = bb.bollinger_hband() - bb.bollinger_lband()
 
     for key, series in indicators.items():
         if isinstance(series, pd.Series):
@@ -84,7 +404,7 @@ def calculate_indicators(ohlcv_df, config=None, timeframe=None):
     def calc_trend(df):
         if df is None or len(df) < 200: return "-"
         close = df['close'].iloc[-1]
-        ema200 = ta.trend.ema_indicator(df['close'], window=200).iloc[-1]
+        ema200 = indicators['ema200'].iloc[-1]
         if pd.isna(close) or pd.isna(ema200): return "-"
         return "UP" if close > ema200 else "DOWN"
 
@@ -98,3 +418,150 @@ def calculate_indicators(ohlcv_df, config=None, timeframe=None):
     indicators.setdefault('trend_h4', "-")
     indicators.setdefault('trend_d1', "-")
     return indicators
+
+
+def _config_key(config):
+    """Hash phần config mà calculate_indicators đọc (mục "indicators")."""
+    return json.dumps((config or {}).get("indicators") or {}, sort_keys=True, default=str)
+
+class IndicatorMemo:
+    """
+    LRU memo kết quả calculate_indicators theo (symbol, timeframe, nến đầu, nến đóng
+    cuối, hash config, mode). Entry giữ CRC32 OHLCV các nến đã đóng (nến đóng bị
+    sửa tại chỗ, vd CandleStore._verify, là miss) và dấu vân nến cuối (nến đang
+    chạy, ts + OHLCV): khớp cả hai là hit.
+
+    Giữa hai lần đóng nến chỉ nến đang chạy đổi. Kết quả dạng IndicatorSnapshot
+    (mode gate/batch) được tính lại theo đuôi: state StreamingIndicators sau các nến
+    đã đóng được giữ trong entry và chỉ nến đang chạy đi qua update(closed=False),
+    O(1) thay vì chạy lại cả frame (tail hit). Dựng state (StreamingIndicators.
+    from_closed) tốn cỡ 1.5 lần tính gate cả frame nên chỉ dựng khi cùng một phần đã
+    đóng đã phải tính lại tail_after lần; timeframe mỗi lượt đều có nến đóng mới (vd
+    M5 khi chạy theo nến) không tốn thêm.
+    Một instance dùng chung cho mọi runner trong process (kể cả worker thread tính
+    chỉ báo, nên get/put giữ lock).
+    """
+
+    def __init__(self, maxsize=256, tail_after=2):
+        self.maxsize = int(maxsize)
+        self.tail_after = int(tail_after)
+        self._entries = OrderedDict()  # key -> [closed_crc, forming_sig, result, recomputes, stream]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.tail_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(symbol, timeframe, ohlcv_df, config, mode):
+        """(key, CRC các nến đã đóng, dấu vân nến đang chạy)."""
+        ts = ohlcv_df['timestamp'].to_numpy()
+        key = (symbol, timeframe, int(ts[0]), int(ts[-2]), len(ts), _config_key(config), mode)
+        crc = 0
+        forming = [int(ts[-1])]
+        for col in ('open', 'high', 'low', 'close', 'volume'):
+            arr = ohlcv_df[col].to_numpy(dtype=np.float64)
+            crc = zlib.crc32(np.ascontiguousarray(arr[:-1]), crc)
+            forming.append(float(arr[-1]))
+        return key, crc, tuple(forming)
+
+    @staticmethod
+    def _usable(ohlcv_df):
+        return ohlcv_df is not None and len(ohlcv_df) >= 2 and 'timestamp' in ohlcv_df
+
+    @staticmethod
+    def _tail(stream, like, timeframe, sig):
+        """Snapshot cùng các field như `like`, với nến đang chạy sig = (ts, o, h, l, c, v)."""
+        _, _, high, low, close, volume = sig
+        vals = stream.update(high, low, close, volume, closed=False)
+        out = {'trend_h4': "-", 'trend_d1': "-", **{k: vals[k] for k, v in like.items() if v is not None and k in vals}}
+        trend_key = _trend_key(timeframe)
+        if trend_key:
+            out[trend_key] = _trend(close, vals['ema200'])
+        return IndicatorSnapshot(**out)
+
+    def get(self, symbol, timeframe, ohlcv_df, config=None, mode=None):
+        if not self._usable(ohlcv_df):
+            return None
+        key, crc, sig = self._key(symbol, timeframe, ohlcv_df, config, mode)
+        with self._lock:
+            ent = self._entries.get(key)
+            if ent is None or ent[0] != crc:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if ent[1] == sig:
+                self.hits += 1
+                return ent[2]
+            stream, like = ent[4], ent[2]
+            if stream is None:
+                self.misses += 1
+                return None
+            self.tail_hits += 1
+        result = self._tail(stream, like, timeframe, sig)
+        with self._lock:
+            if ent[0] == crc:
+                ent[1], ent[2] = sig, result
+        return result
+
+    def put(self, symbol, timeframe, ohlcv_df, result, config=None, mode=None):
+        if result is None or not self._usable(ohlcv_df):
+            return
+        key, crc, sig = self._key(symbol, timeframe, ohlcv_df, config, mode)
+        with self._lock:
+            ent = self._entries.get(key)
+            recomputes = ent[3] + 1 if ent is not None and ent[0] == crc else 1
+            stream = ent[4] if ent is not None and ent[0] == crc else None
+        if stream is None and recomputes >= self.tail_after and isinstance(result, IndicatorSnapshot):
+            stream = self._warm(ohlcv_df)
+        with self._lock:
+            self._entries[key] = [crc, sig, result, recomputes, stream]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    @staticmethod
+    def _warm(ohlcv_df):
+        """State streaming sau mọi nến đã đóng của frame (bắt đầu từ nến đầu như gate)."""
+        cols = [ohlcv_df[c].to_numpy(dtype=np.float64)[:-1] for c in ('high', 'low', 'close', 'volume')]
+        return StreamingIndicators.from_closed(*cols)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.tail_hits + self.misses
+        return {
+            "hits": self.hits,
+            "tail_hits": self.tail_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.tail_hits) / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+        }
+
+_indicator_memo = None
+
+def get_indicator_memo(config=None):
+    global _indicator_memo
+    if _indicator_memo is None:
+        icfg = (config or {}).get("indicators") or {}
+        _indicator_memo = IndicatorMemo(maxsize=icfg.get("memo_size", 256), tail_after=icfg.get("memo_tail_after", 2))
+    return _indicator_memo
+
+def calculate_indicators_cached(ohlcv_df, config=None, timeframe=None, symbol=None, mode=None, fields=None):
+    """
+    calculate_indicators qua memo dùng chung. Kết quả trả về có thể là object đã cache:
+    caller không được sửa tại chỗ. Không có symbol thì tính thẳng, không cache.
+    """
+    memo = get_indicator_memo(config)
+    if symbol is None or not memo._usable(ohlcv_df):
+        return calculate_indicators(ohlcv_df, config, timeframe=timeframe, mode=mode, fields=fields)
+    variant = (mode, tuple(sorted(fields)) if fields is not None else None)
+    ind = memo.get(symbol, timeframe, ohlcv_df, config, variant)
+    if ind is None:
+        ind = calculate_indicators(ohlcv_df, config, timeframe=timeframe, mode=mode, fields=fields)
+        memo.put(symbol, timeframe, ohlcv_df, ind, config, variant)
+    return ind
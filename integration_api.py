@@ -4,8 +4,8 @@ from typing import Dict, Optional
 
 import pandas as pd
 
-from indicators import calculate_indicators
-from votes import tally_votes
+from indicators import calculate_indicators_cached, last_value
+from votes import compile_weight_sets, VoteScorer
 from tight_gate import (
     StablePassTracker,
     CooldownManager,
@@ -15,6 +15,7 @@ from tight_gate import (
 )
 from order_planner import plan_probe_and_topup
 from exec_engine import ExecutionEngine
+from state_store import get_state_store
 
 class SharkEngineFacade:
     def __init__(self, cfg: Dict):
@@ -24,8 +25,13 @@ class SharkEngineFacade:
             path=(self.cfg.get("tight_mode") or {}).get("state_path", "tight_state.json"),
             min_gap_sec=int((self.cfg.get("tight_mode") or {}).get("snapshot_min_gap_sec", 300)),
             required_passes=int((self.cfg.get("tight_mode") or {}).get("snapshot_confirmations", 2)),
+            store=get_state_store(self.cfg),
+        )
+        self.cd = CooldownManager(
+            path=(self.cfg.get("tight_mode") or {}).get("cooldown_path", "tight_cooldown.json"),
+            default_cooldown_sec=int((self.cfg.get("tight_mode") or {}).get("cooldown_m15_min", 15)) * 60,
+            store=get_state_store(self.cfg),
         )
-        self.cd = CooldownManager(path=(self.cfg.get("tight_mode") or {}).get("cooldown_path", "tight_cooldown.json"))
 
         self.th_m15 = float((self.cfg.get("thresholds") or {}).get("M15", self.cfg.get("score_threshold", 17.0)))
         self.adx_h1_th = int(self.cfg.get("adx_h1_threshold", 25))
@@ -36,6 +42,8 @@ class SharkEngineFacade:
         self.wsets = (self.cfg or {}).get("weights_sets", {})
         self.w_m15 = self.wsets.get("M15", {})
         self.w_h1 = self.wsets.get("H1", {})
+        self.scorers = compile_weight_sets(self.wsets)
+        self.scorer_m15 = self.scorers.get("M15") or VoteScorer(self.w_m15)
 
     @staticmethod
     def _decide_side(score_long: float, score_short: float, eps: float = 0.1) -> str:
@@ -64,16 +72,16 @@ class SharkEngineFacade:
         if m15 is None or m15.empty or h1 is None or h1.empty or m5 is None or m5.empty:
             return {"entry_ready": False, "blocked_by": ["No data"], "actions": []}
 
-        ind_m15 = calculate_indicators(m15, config, timeframe="15m")
-        ind_h1 = calculate_indicators(h1, config, timeframe="4h")
-        ind_d1 = calculate_indicators(d1, config, timeframe="1d") if d1 is not None and not d1.empty else None  # <--- Tính trend D1
+        ind_m15 = calculate_indicators_cached(m15, config, timeframe="15m", symbol=symbol)
+        ind_h1 = calculate_indicators_cached(h1, config, timeframe="4h", symbol=symbol)
+        ind_d1 = calculate_indicators_cached(d1, config, timeframe="1d", symbol=symbol) if d1 is not None and not d1.empty else None  # <--- Tính trend D1
 
         map_m15 = build_indicator_results(m15, ind_m15)
-        vr_m15 = tally_votes(map_m15, self.w_m15)
+        vr_m15 = self.scorer_m15.score(map_m15)
         sl15, ss15 = float(vr_m15.get("score_long", 0)), float(vr_m15.get("score_short", 0))
         side = self._decide_side(sl15, ss15)
 
-        adx_h1 = float(ind_h1["adx"].iloc[-1])
+        adx_h1 = float(last_value(ind_h1["adx"]))
         hh1 = _heavy_hits(build_indicator_results(h1, ind_h1), ind_h1["ema200"], side) if side != "NEUTRAL" else 0
         h1_ok = (adx_h1 >= self.adx_h1_th) and (hh1 >= self.heavy_required) and (side != "NEUTRAL")
         m15_score = sl15 if side == "LONG" else (ss15 if side == "SHORT" else 0.0)
@@ -151,5 +159,9 @@ class SharkEngineFacade:
             "cooldown": in_cooldown,
         }
 
+    def check_risk(self, prices: Dict[str, float], now_ts: Optional[float] = None) -> Dict[str, list]:
+        """SL/TP/trailing nhịp nhanh cho vị thế đang mở với giá ticker {symbol: price}."""
+        return self.eng.risk_tick(prices, ts_now=now_ts)
+
 def init_facade(cfg: Dict) -> SharkEngineFacade:
     return SharkEngineFacade(cfg)
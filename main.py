@@ -9,6 +9,7 @@ import asyncio
 import json
 import signal
 import time
+from contextlib import nullcontext
 from datetime import datetime
 from typing import Dict, Any, Tuple
 
@@ -16,16 +17,20 @@ import pandas as pd
 import csv
 import os
 
-from data import fetch_data
-from indicators import calculate_indicators
-from tight_gate import build_indicator_results, StablePassTracker, _heavy_hits
-from votes import tally_votes
+from data import get_async_fetcher, close_async_fetcher
+from tf_cache import get_tf_cache
+from indicators import get_indicator_memo
+from tight_gate import CooldownManager, StablePassTracker
 from notifier import Notifier
-from order_planner import plan_probe_and_topup
 from config import SIGNAL_MONITOR_CONFIG
 from signal_manager import SignalMonitor
 from trade_simulator import TradeSimulator
 from utils import log_latency, log_score
+from state_store import get_state_store
+from scheduler import BarCloseScheduler
+from pipeline import decide_side, analyze_universe, pipeline_report
+from sharding import get_shard_pool, close_shard_pool
+from timing import get_stage_timer
 
 import unicodedata
 
@@ -37,8 +42,9 @@ PRE_STATE: Dict[str, Dict[str, Any]] = {}
 monitor = SignalMonitor(SIGNAL_MONITOR_CONFIG)
 simulator = TradeSimulator(capital=100.0, leverage=10, fee_bps=4)
 stable_tracker = StablePassTracker(path="tight_state.json", min_gap_sec=30, required_passes=2)
-
-COOLDOWN_M15: Dict[str, float] = {}
+# Cooldown sau khi đóng lệnh: chờ 1 nến M15 trước khi nhận tín hiệu mới của symbol
+CLOSE_COOLDOWN_SEC = 15 * 60
+close_cooldown = CooldownManager(path="tight_cooldown.json", default_cooldown_sec=CLOSE_COOLDOWN_SEC)
 
 PROBE_M5_COUNT = 3
 PROBE_INDICATOR_PCT = 90
@@ -50,12 +56,16 @@ WEAK_RSI_RANGE = (45, 55)
 LEVERAGE = 10
 
 CLOSE_WARNED = {}
+# Ngữ cảnh M15 (side, adx, rsi) của vòng tín hiệu gần nhất theo symbol, cho risk loop
+RISK_CONTEXT: Dict[str, Dict[str, Any]] = {}
+DAILY_REPORT_DATE = None
+HOUSEKEEPING_JOB = "__housekeeping__"
+UNIVERSE_JOB = "__universe__"
 
 SPAM_PROBE_WARNED = {}
 TRAILING_STEPS = [
     {"roi": 0.03, "lock": 0.002},   # trailing stop 0.2% tại ROI 3%
 ]
-LAST_CLOSE_TIME = {}
 
 def safe_float_fmt(val, digits=4, default=""):
     try:
@@ -72,22 +82,15 @@ def load_config() -> Dict[str, Any]:
     with open(CONFIG_PATH, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def decide_side(score_long: float, score_short: float, eps: float = 0.1) -> str:
-    if score_long - score_short > eps: return "LONG"
-    if score_short - score_long > eps: return "SHORT"
-    return "NEUTRAL"
-
-def check_indicator_input(df, min_required, label):
-    if df is None or not isinstance(df, pd.DataFrame) or df.empty or len(df) < min_required:
-        print(f"[WARN] {label}: DataFrame qua nho ({len(df) if df is not None else 0}) can >= {min_required}")
-        return False
-    return True
-
 def remove_accents(input_str):
     nfkd_form = unicodedata.normalize('NFKD', input_str)
     return ''.join([c for c in nfkd_form if not unicodedata.combining(c)])
 
 def log_reason_vi_no_accent(log_dict):
+    with get_stage_timer().stage("csv_log", log_dict.get("symbol")):
+        _log_reason_vi_no_accent(log_dict)
+
+def _log_reason_vi_no_accent(log_dict):
     out = {}
     for k, v in log_dict.items():
         if isinstance(v, str):
@@ -136,34 +139,6 @@ def mark_closed_entry(symbol, timeframe, direction):
     key = (normalize_symbol(symbol), timeframe)
     SENT_SIDE.pop(key, None)
 
-def is_data_fresh(df, tf_min, symbol, tf_name, max_lag_n=2):
-    if df is None or df.empty:
-        print(f"[ERROR] DataFrame {symbol} {tf_name} rỗng!")
-        return False
-    last_ts = None
-    if 'timestamp' in df.columns:
-        last_ts = df['timestamp'].iloc[-1]
-    elif hasattr(df.index, "astype"):
-        try:
-            last_ts = int(df.index[-1].timestamp())
-        except Exception:
-            pass
-    if last_ts is None:
-        print(f"[ERROR] Không lấy được timestamp {symbol} {tf_name}.")
-        return False
-    now = time.time()
-    lag = now - last_ts
-    max_lag = tf_min * 60 * max_lag_n
-    if lag > max_lag:
-        print(f"[ERROR] Dữ liệu {symbol} {tf_name} QUÁ CŨ! Lệch {lag/60:.1f} phút (> {max_lag/60:.1f} phút)")
-        return False
-    try:
-        last_price = float(df['close'].iloc[-1])
-        print(f"[DATA_CHECK] {symbol} {tf_name} | last price: {last_price} | last ts: {datetime.fromtimestamp(last_ts)} | now: {datetime.fromtimestamp(now)} | lag: {lag:.1f}s")
-    except Exception:
-        pass
-    return True
-
 def snapshot_m5_confirmed(side_m15, m5, ind_m5, count=PROBE_M5_COUNT):
     if m5 is None or len(m5) < count:
         return False
@@ -220,28 +195,6 @@ def should_suggest_close(active_trade, newest_side, ind_m15, adx_val, rsi_val, n
         return True, reason, content
     return False, None, None
 
-def is_breakout_candle(df, ind, ma_col="ema200", volume_col="volume", direction="LONG"):
-    if df is None or ind is None or len(df) < 20:
-        return False
-    atr = ind.get('atr', pd.Series([0]*len(df)))
-    atr_val = float(atr.iloc[-1]) if hasattr(atr, "iloc") else float(atr[-1]) if isinstance(atr, (list, tuple)) else 0
-    body = abs(df['close'].iloc[-1] - df['open'].iloc[-1])
-    vol = df[volume_col].iloc[-1]
-    avg_vol = df[volume_col].rolling(20).mean().iloc[-1]
-    close = df['close'].iloc[-1]
-    ma = ind.get(ma_col, pd.Series([0]*len(df)))
-    ma_val = float(ma.iloc[-1]) if hasattr(ma, "iloc") else float(ma[-1]) if isinstance(ma, (list, tuple)) else 0
-    if direction == "LONG":
-        breakout_body = (df['close'].iloc[-1] - df['open'].iloc[-1]) > 1.2 * atr_val if atr_val > 0 else False
-        breakout_vol = vol > 1.5 * avg_vol if avg_vol > 0 else False
-        breakout_close = close > ma_val if ma_val > 0 else False
-        return breakout_body and breakout_vol and breakout_close
-    else:
-        breakout_body = (df['open'].iloc[-1] - df['close'].iloc[-1]) > 1.2 * atr_val if atr_val > 0 else False
-        breakout_vol = vol > 1.5 * avg_vol if avg_vol > 0 else False
-        breakout_close = close < ma_val if ma_val > 0 else False
-        return breakout_body and breakout_vol and breakout_close
-
 def get_open_trades(symbol, direction=None, stage=None):
     trades = []
     for t in simulator.get_all_trades():
@@ -270,298 +223,285 @@ def update_trailing_stop(trade, price_now):
             trade["sl"] = round(new_sl, 6)
             trade["trailing_applied"].add(roi_level)
 
-LAST_CLOSE_TIME = {}  # {symbol: last_close_ts}
-
-async def run_once(cfg: Dict[str, Any], notifier: Notifier):
-    now_epoch = time.time()
-    th_m15 = float((cfg.get("thresholds") or {}).get("M15", 15.0))
-    th_h1 = float((cfg.get("thresholds") or {}).get("H1", 8.0))
-    heavy_required = int(cfg.get("tight_mode", {}).get("heavy_required", 3))
-    snapshot_conf_normal = int(cfg.get("tight_mode", {}).get("snapshot_confirmations", 2))
-    cooldown_min = int(cfg.get("tight_mode", {}).get("cooldown_m15_min", 5))
-    symbols = cfg.get("symbols", ["BTC/USDT"])
-    w_m15 = (cfg.get("weights_sets") or {}).get("M15", {})
-    w_h1 = (cfg.get("weights_sets") or {}).get("H1", {})
+def manage_open_trade(t, price_now, now_epoch, notifier, side_m15=None, adx_latest=None, rsi_latest=None, auto_close_on_warning=True):
+    """
+    Trailing, TP/SL, đảo chiều, đề xuất đóng và đóng khi giữ quá lâu cho một lệnh
+    đang mở. Dùng chung cho run_once và risk loop (giá ticker + ngữ cảnh M15 của
+    vòng tín hiệu gần nhất). Trả về True nếu lệnh đã đóng.
+    """
+    symbol = t["symbol"]
+    dside = t.get("direction")
+    tp_sim = t.get("tp")
+    sl_sim = t.get("sl")
+    active_id = f"{symbol}|{t.get('entry')}"
+    closed = False
+
+    update_trailing_stop(t, price_now)
+
+    if price_now is not None and tp_sim is not None and (
+        (dside == "LONG" and price_now >= tp_sim) or
+        (dside == "SHORT" and price_now <= tp_sim)
+    ):
+        simulator.close_trade(t, price_now, "TP", now_epoch, reason="take_profit")
+        closed = True
+
+    if not closed and price_now is not None and sl_sim is not None and (
+        (dside == "LONG" and price_now <= sl_sim) or
+        (dside == "SHORT" and price_now >= sl_sim)
+    ):
+        simulator.close_trade(t, price_now, "SL", now_epoch, reason="stop_loss")
+        closed = True
+
+    if not closed and side_m15 and dside and side_m15 != dside and side_m15 in ("LONG", "SHORT"):
+        simulator.close_trade(t, price_now, "REVERSE", now_epoch, reason="reverse_signal")
+        closed = True
+
+    suggest, reason, content = should_suggest_close(
+        t, side_m15, None, adx_latest, rsi_latest, now_epoch
+    )
+    pnl = t.get("result", 0)
+    if not closed and (suggest and pnl is not None and pnl > 0 and auto_close_on_warning):
+        simulator.close_trade(t, price_now, "CLOSE_WARN_PNL_POS", now_epoch, reason="close_on_warning_pnl_positive")
+        notifier.text(f"✅ Đóng vị thế {symbol} do cảnh báo & đang lãi {safe_float_fmt(pnl,2)}")
+        closed = True
+    elif not closed and suggest:
+        last_warned = CLOSE_WARNED.get(active_id)
+        if last_warned != reason:
+            notifier.text(content)
+            CLOSE_WARNED[active_id] = reason
+    else:
+        if CLOSE_WARNED.get(active_id):
+            CLOSE_WARNED.pop(active_id, None)
+
+    # ======= ĐÓNG LỆNH NẾU GIỮ QUÁ LÂU MÀ ĐANG CÓ LÃI =======
+    if not closed:
+        MAX_HOLD_M15_PROFIT = 12  # Số nến M15 tối đa giữ lệnh khi đang có lãi, có thể chỉnh
+        n_open = int((time.time() - t.get("time_open", 0)) // (15 * 60)) if t.get("time_open") else 0
+        direction = t.get("direction")
+        entry = float(t.get("entry") or 0)
+        size = float(t.get("size") or 0)
+        pnl_now = (price_now - entry) * size if direction == "LONG" else (entry - price_now) * size
+        if n_open >= MAX_HOLD_M15_PROFIT and pnl_now > 0:
+            simulator.close_trade(t, price_now, "MAX_HOLD_PROFIT", int(time.time()), reason="max_hold_pnl_positive")
+            notifier.text(f"⏰ Đóng {t['symbol']} {direction} do giữ quá lâu nhưng đang lãi ({n_open} nến, PnL={pnl_now:.2f})")
+            closed = True
+
+    if closed:
+        mark_closed_entry(symbol, "15m", dside)
+        monitor.remove_signal(symbol)
+        CLOSE_WARNED.pop(active_id, None)
+        close_cooldown.mark(symbol, "15m", now_ts=time.time(), cooldown_sec=CLOSE_COOLDOWN_SEC)
+    return closed
+
+def apply_decision(cfg: Dict[str, Any], notifier: Notifier, rec: Dict[str, Any], now_epoch: float):
+    """
+    Áp bản ghi quyết định của pipeline.analyze_symbol vào state giao dịch: gate ổn
+    định, log, probe breakout, promote/trap và quản lý lệnh đang mở của symbol.
+    Chỉ chạy trong process giữ simulator (event loop của run_once).
+    """
+    with get_stage_timer().stage("simulator", rec["symbol"]):
+        _apply_decision(cfg, notifier, rec, now_epoch)
+
+def _apply_decision(cfg, notifier, rec, now_epoch):
+    symbol = rec["symbol"]
+    if rec.get("pruned"):
+        # trượt gate H1 ở bước lọc: gates_ok chắc chắn False, reset chuỗi pass ổn định và ghi dòng scan
+        stable_tracker.update(symbol, "15m", "NEUTRAL", False, now_ts=now_epoch)
+        # cùng thứ tự cột với dòng scan đầy đủ để decision nằm đúng cột; điểm M15 không có
+        log_reason_vi_no_accent({
+            "timestamp": int(now_epoch),
+            "symbol": symbol,
+            "phase": "scan",
+            "side": "NEUTRAL",
+            "m15_score": "",
+            "h1_score": "",
+            "heavy_hits": "",
+            "adx_h1": "",
+            "dist_vwap_atr": "",
+            "anti_chase_tier": "",
+            "fast_flags": "",
+            "decision": f"pruned:{rec['pruned']}",
+            "trend_h4": "",
+            "trend_d1": "",
+        })
+        return
+    side_m15 = rec["side_m15"]
+    probe_direction = rec["probe_direction"]
+    price_now = rec["price_now"]
+    atr_val = rec["atr"]
+    anti_chase = rec["anti_chase"]
+    avg_volume = rec["avg_volume"]
+    plan = rec["plan"]
 
     PROBE_PCT = float((cfg.get("trading", {}) or {}).get("probe_pct", 0.1))
     FULL_PCT = float((cfg.get("trading", {}) or {}).get("full_pct", 0.5))
     min_notional = float((cfg.get("risk", {}) or {}).get("min_notional", 5.0))
-
-    PROBE_EARLY_SIZE_RATIO = cfg.get("probe_early_size_ratio", 0.08)
     PROMOTE_PULLBACK_ATR = cfg.get("promote_pullback_atr", 0.5)
     AUTO_CLOSE_ON_WARNING_IF_PNL_POS = cfg.get("auto_close_on_warning_if_pnl_positive", True)
 
-    h1_keys = set([k.upper() for k in w_h1.keys()])
+    gates_ok = rec["gates_ok"]
+    is_stable = stable_tracker.update(symbol, "15m", side_m15, gates_ok, now_ts=now_epoch)
+    full_ready = gates_ok and is_stable
+
+    log_data = {
+        "timestamp": int(now_epoch),
+        "symbol": symbol,
+        "phase": "scan",
+        "side": side_m15,
+        "m15_score": safe_float_fmt(rec["m15_score"],2),
+        "h1_score": safe_float_fmt(rec["h1_score"],2),
+        "heavy_hits": rec["heavy_hits"],
+        "adx_h1": safe_float_fmt(rec["adx_h1"],2),
+        "dist_vwap_atr": 0.0,
+        "anti_chase_tier": "anti" if anti_chase else "ok",
+        "fast_flags": 0,
+        "decision": f"full_ready={full_ready}; stable={is_stable};",
+        "trend_h4": rec["trend_h4"],
+        "trend_d1": rec["trend_d1"],
+    }
+    for k, v in rec["m15_breakdown"].items():
+        log_data[f"m15_{k}"] = v
+    for k, v in rec["h1_breakdown"].items():
+        log_data[f"h1_{k}"] = v
+
+    log_reason_vi_no_accent(log_data)
+
+    # ==== TP ROI 100% (chuẩn trailing stop; leverage 10x = 10%) ====
+    roi_target = 1.0  # 100%
+    sim_tp_long = price_now * (1 + roi_target / LEVERAGE)
+    sim_tp_short = price_now * (1 - roi_target / LEVERAGE)
+
+    # --- Chuẩn bị kiểm tra lệnh đang mở ---
+    active_probe = None
+    active_full = None
+    for t in simulator.get_all_trades():
+        if t["symbol"] == symbol and t["direction"] == probe_direction and t["time_close"] is None:
+            if t["stage"] == "probe":
+                active_probe = t
+            elif t["stage"] == "full":
+                active_full = t
+
+    # --- Logic breakout: chỉ vào probe nhỏ nếu anti-chase ---
+    key = (symbol, probe_direction)
+    if rec["breakout"]:
+        if not active_probe and not active_full:
+            probe_size = max(simulator.balance * PROBE_PCT, 0)
+            if probe_size >= min_notional:
+                sim_tp = sim_tp_long if probe_direction == "LONG" else sim_tp_short
+                simulator.open_trade(
+                    symbol, probe_direction, entry=price_now,
+                    sl=None, tp=sim_tp,
+                    size_quote=probe_size, is_probe=True,
+                    now_ts=now_epoch, r_value=plan.get("r_value") if plan else None,
+                    reason=f"probe_breakout_{probe_direction.lower()}",
+                    ma=rec["ma_probe"], atr=atr_val, breakout_volume=rec["last_volume"], avg_volume=avg_volume
+                )
+                notifier.text(f"⚡️ Breakout mạnh trên {symbol} – vào probe nhỏ {probe_direction}! Entry: {safe_float_fmt(price_now)} (Anti-chase: {'YES' if anti_chase else 'NO'})")
+                log_data_break = {
+                    "timestamp": int(now_epoch),
+                    "symbol": symbol,
+                    "phase": "probe_breakout",
+                    "direction": probe_direction,
+                    "entry": safe_float_fmt(price_now),
+                    "tp": safe_float_fmt(sim_tp),
+                    "size": safe_float_fmt(probe_size),
+                    "anti_chase": anti_chase,
+                    "reason": f"probe_breakout_{probe_direction.lower()}"
+                }
+                log_reason_vi_no_accent(log_data_break)
+                SPAM_PROBE_WARNED.pop(key, None)
+            else:
+                notifier.text(f"❌ Vốn khả dụng quá nhỏ để vào probe {symbol} {probe_direction}. Vốn khả dụng: {simulator.balance}, cần tối thiểu: {min_notional}")
+                SPAM_PROBE_WARNED.pop(key, None)
+        else:
+            SPAM_PROBE_WARNED[key] = True
+
+    # --- Promote lên full nếu có pullback xác nhận ---
+    active_probe = None
+    active_full = None
+    for t in simulator.get_all_trades():
+        if t["symbol"] == symbol and t["direction"] == probe_direction and t["time_close"] is None:
+            if t["stage"] == "probe":
+                active_probe = t
+            elif t["stage"] == "full":
+                active_full = t
+    if active_probe and active_probe.get("stage") == "probe":
+        last_close = rec["last_close"]
+        probe_entry = float(active_probe["entry"])
+        pullback_ok = abs(last_close - probe_entry) <= PROMOTE_PULLBACK_ATR * atr_val
+        last_candle_dir = "LONG" if last_close > rec["last_open"] else "SHORT"
+        big_trap = (last_candle_dir != active_probe["direction"]) and (rec["last_volume"] > 1.8 * avg_volume)
+        if pullback_ok and not big_trap and not anti_chase:
+            if not active_full:
+                promote_size = max(simulator.balance * FULL_PCT, 0)
+                if promote_size >= min_notional:
+                    simulator.promote_trade(active_probe, promote_size, price_now)
+                    notifier.text(f"🔁 Promote lên FULL {symbol} sau pullback xác nhận. Giá hiện tại: {safe_float_fmt(price_now)}")
+        elif big_trap:
+            simulator.close_trade(active_probe, price_now, "TRAP", now_epoch, reason="trap_reversal")
+            notifier.text(f"⚠️ Đóng probe {symbol} do phát hiện trap đảo chiều volume lớn!")
+
+    adx_latest, rsi_latest = rec["adx"], rec["rsi"]
+    RISK_CONTEXT[symbol] = {"side": side_m15, "adx": adx_latest, "rsi": rsi_latest}
+    for t in simulator.get_all_trades():
+        if t["symbol"] == symbol and t["time_close"] is None:
+            manage_open_trade(t, price_now, now_epoch, notifier, side_m15, adx_latest, rsi_latest,
+                              auto_close_on_warning=AUTO_CLOSE_ON_WARNING_IF_PNL_POS)
+
+async def run_once(cfg: Dict[str, Any], notifier: Notifier, symbols=None, housekeeping: bool = True):
+    """
+    Một lượt pipeline tín hiệu cho `symbols` (mặc định cfg["symbols"]). housekeeping:
+    chạy luôn phần việc cuối vòng (báo cáo ngày, cảnh báo treo lệnh); scheduler theo
+    nến chạy phần này thành job riêng. Bật sharding thì phần phân tích chạy trong các
+    worker process, quyết định vẫn áp tại đây theo thứ tự bản ghi về.
+    """
+    now_epoch = time.time()
+    timer = get_stage_timer(cfg)
+    if symbols is None:
+        symbols = cfg.get("symbols", ["BTC/USDT"])
 
+    active_symbols = []
     for symbol in symbols:
-        cooldown_period = 15 * 60  # 1 nến M15
-        if symbol in LAST_CLOSE_TIME and time.time() - LAST_CLOSE_TIME[symbol] < cooldown_period:
+        if close_cooldown.in_cooldown(symbol, "15m", CLOSE_COOLDOWN_SEC, now_epoch):
             print(f"[COOLDOWN] {symbol}: Chờ 1 nến M15 sau khi vừa đóng lệnh. Bỏ qua tín hiệu mới.")
             continue
+        active_symbols.append(symbol)
 
-        m5 = fetch_data(symbol, "5m", limit=400)
-        m15 = fetch_data(symbol, "15m", limit=300)
-        h1 = fetch_data(symbol, "1h", limit=300)
-        d1 = fetch_data(symbol, "1d", limit=300)
-
-        if not check_indicator_input(m5, 215, f"{symbol} M5"): continue
-        if not check_indicator_input(m15, 200, f"{symbol} M15"): continue
-        if not check_indicator_input(h1, 200, f"{symbol} H1"): continue
-        if not check_indicator_input(d1, 200, f"{symbol} D1"): continue
-
-        if not is_data_fresh(m5, tf_min=5, symbol=symbol, tf_name="M5"): continue
-        if not is_data_fresh(m15, tf_min=15, symbol=symbol, tf_name="M15"): continue
-        if not is_data_fresh(h1, tf_min=60, symbol=symbol, tf_name="H1"): continue
-        if not is_data_fresh(d1, tf_min=1440, symbol=symbol, tf_name="D1"): continue
-
-        ind_m5 = calculate_indicators(m5, cfg, timeframe="5m")
-        ind_m15 = calculate_indicators(m15, cfg, timeframe="15m")
-        ind_h1 = calculate_indicators(h1, cfg, timeframe="4h")
-        ind_d1 = calculate_indicators(d1, cfg, timeframe="1d")
-        if ind_m5 is None or ind_m15 is None or ind_h1 is None or ind_d1 is None: continue
-
-        map_m5 = build_indicator_results(m5, ind_m5)
-        map_m15 = build_indicator_results(m15, ind_m15)
-        map_h1_full = build_indicator_results(h1, ind_h1)
-        map_h1 = {k.upper(): v for k, v in map_h1_full.items() if k.upper() in h1_keys}
-
-        vr_m5 = tally_votes(map_m5, w_m15)
-        vr_m15 = tally_votes(map_m15, w_m15)
-        vr_h1 = tally_votes(map_h1, w_h1)
-
-        sl5, ss5 = float(vr_m5.get("score_long", 0) or 0), float(vr_m5.get("score_short", 0) or 0)
-        sl15, ss15 = float(vr_m15.get("score_long", 0) or 0), float(vr_m15.get("score_short", 0) or 0)
-        slh1, ssh1 = float(vr_h1.get("score_long", 0) or 0), float(vr_h1.get("score_short", 0) or 0)
-
-        if sl15 - ss15 > 0.1:
-            probe_direction = "LONG"
-        elif ss15 - sl15 > 0.1:
-            probe_direction = "SHORT"
-        else:
-            probe_direction = "LONG" # mặc định
-
-        side_m5 = decide_side(sl5, ss5)
-        side_m15 = decide_side(sl15, ss15)
-        side_h1 = decide_side(slh1, ssh1)
-
-        m5_score = sl5 if side_m5 == "LONG" else (ss5 if side_m5 == "SHORT" else 0.0)
-        m15_score = sl15 if side_m15 == "LONG" else (ss15 if side_m15 == "SHORT" else 0.0)
-        h1_score = slh1 if side_h1 == "LONG" else (ssh1 if side_h1 == "SHORT" else 0.0)
-
-        hhits = _heavy_hits(map_h1, ind_h1['ema200'], side_m15) if side_m15 != "NEUTRAL" else 0
-        try:
-            adx_h1 = float(ind_h1['adx'].iloc[-1])
-        except Exception:
-            adx_h1 = 0.0
-
-        price_now = float(m15['close'].iloc[-1]) if m15 is not None and not pd.isnull(m15['close'].iloc[-1]) else 0.0
-
-        ma20_series = ind_m15.get("ma50", None)
-        ma20_val = float(ma20_series.iloc[-1]) if ma20_series is not None and hasattr(ma20_series, "iloc") else price_now
-        atr_series = ind_m15.get("atr", None)
-        atr_val = float(atr_series.iloc[-1]) if atr_series is not None and hasattr(atr_series, "iloc") else price_now*0.01
-
-        anti_chase = abs(price_now - ma20_val) > 1.2 * atr_val if price_now is not None and ma20_val is not None and atr_val is not None else False
+    def _apply(symbol, rec):
+        apply_decision(cfg, notifier, rec, now_epoch)
 
-        gates_ok = (
-            side_m5 == side_m15 == side_h1 != "NEUTRAL"
-            and m15_score >= th_m15
-            and h1_score >= th_h1
-            and hhits >= heavy_required
-            and adx_h1 >= int(cfg.get("adx_h1_threshold", 25))
-        )
-        is_stable = stable_tracker.update(symbol, "15m", side_m15, gates_ok, now_ts=now_epoch)
-        full_ready = gates_ok and is_stable
-
-        m15_breakdown = vr_m15.get("breakdown_long", {}) if side_m15 == "LONG" else vr_m15.get("breakdown_short", {})
-        h1_breakdown = vr_h1.get("breakdown_long", {}) if side_h1 == "LONG" else vr_h1.get("breakdown_short", {})
-
-        trend_h4 = ind_h1.get("trend_h4", "-")
-        trend_d1 = ind_d1.get("trend_d1", "-")
-
-        log_data = {
-            "timestamp": int(now_epoch),
-            "symbol": symbol,
-            "phase": "scan",
-            "side": side_m15,
-            "m15_score": safe_float_fmt(m15_score,2),
-            "h1_score": safe_float_fmt(h1_score,2),
-            "heavy_hits": hhits,
-            "adx_h1": safe_float_fmt(adx_h1,2),
-            "dist_vwap_atr": 0.0,
-            "anti_chase_tier": "anti" if anti_chase else "ok",
-            "fast_flags": 0,
-            "decision": f"full_ready={full_ready}; stable={is_stable};",
-            "trend_h4": trend_h4,
-            "trend_d1": trend_d1,
-        }
-        for k, v in m15_breakdown.items():
-            log_data[f"m15_{k}"] = v
-        for k, v in h1_breakdown.items():
-            log_data[f"h1_{k}"] = v
-
-        log_reason_vi_no_accent(log_data)
-
-        plan = plan_probe_and_topup(probe_direction, m15, ind_m15, cfg)
-        ema200_series = ind_m15.get("ema200", None)
-        ma_probe = float(ema200_series.iloc[-1]) if ema200_series is not None and hasattr(ema200_series, "iloc") else float(price_now)
-        breakout_volume = float(m15['volume'].iloc[-1]) if m15 is not None and not pd.isnull(m15['volume'].iloc[-1]) else 0.0
-        avg_volume = float(m15['volume'].rolling(20).mean().iloc[-1]) if m15 is not None and not pd.isnull(m15['volume'].rolling(20).mean().iloc[-1]) else 0.0
-
-        # ==== TP ROI 100% (chuẩn trailing stop; leverage 10x = 10%) ====
-        roi_target = 1.0  # 100%
-        sim_tp_long = price_now * (1 + roi_target / LEVERAGE)
-        sim_tp_short = price_now * (1 - roi_target / LEVERAGE)
-
-        # --- Chuẩn bị kiểm tra lệnh đang mở ---
-        active_probe = None
-        active_full = None
-        for t in simulator.get_all_trades():
-            if t["symbol"] == symbol and t["direction"] == probe_direction and t["time_close"] is None:
-                if t["stage"] == "probe":
-                    active_probe = t
-                elif t["stage"] == "full":
-                    active_full = t
-
-        # --- Logic breakout: chỉ vào probe nhỏ nếu anti-chase ---
-        key = (symbol, probe_direction)
-        if is_breakout_candle(m15, ind_m15, direction=probe_direction):
-            if not active_probe and not active_full:
-                probe_size = max(simulator.balance * PROBE_PCT, 0)
-                if probe_size >= min_notional:
-                    sim_tp = sim_tp_long if probe_direction == "LONG" else sim_tp_short
-                    simulator.open_trade(
-                        symbol, probe_direction, entry=price_now,
-                        sl=None, tp=sim_tp,
-                        size_quote=probe_size, is_probe=True,
-                        now_ts=now_epoch, r_value=plan.get("r_value") if plan else None,
-                        reason=f"probe_breakout_{probe_direction.lower()}",
-                        ma=ma_probe, atr=atr_val, breakout_volume=breakout_volume, avg_volume=avg_volume
-                    )
-                    notifier.text(f"⚡️ Breakout mạnh trên {symbol} – vào probe nhỏ {probe_direction}! Entry: {safe_float_fmt(price_now)} (Anti-chase: {'YES' if anti_chase else 'NO'})")
-                    log_data_break = {
-                        "timestamp": int(now_epoch),
-                        "symbol": symbol,
-                        "phase": "probe_breakout",
-                        "direction": probe_direction,
-                        "entry": safe_float_fmt(price_now),
-                        "tp": safe_float_fmt(sim_tp),
-                        "size": safe_float_fmt(probe_size),
-                        "anti_chase": anti_chase,
-                        "reason": f"probe_breakout_{probe_direction.lower()}"
-                    }
-                    log_reason_vi_no_accent(log_data_break)
-                    SPAM_PROBE_WARNED.pop(key, None)
-                else:
-                    notifier.text(f"❌ Vốn khả dụng quá nhỏ để vào probe {symbol} {probe_direction}. Vốn khả dụng: {simulator.balance}, cần tối thiểu: {min_notional}")
-                    SPAM_PROBE_WARNED.pop(key, None)
-            else:
-                SPAM_PROBE_WARNED[key] = True
-
-        # --- Promote lên full nếu có pullback xác nhận ---
-        active_probe = None
-        active_full = None
-        for t in simulator.get_all_trades():
-            if t["symbol"] == symbol and t["direction"] == probe_direction and t["time_close"] is None:
-                if t["stage"] == "probe":
-                    active_probe = t
-                elif t["stage"] == "full":
-                    active_full = t
-        if active_probe and active_probe.get("stage") == "probe":
-            last_close = float(m15["close"].iloc[-1])
-            probe_entry = float(active_probe["entry"])
-            atr_current = atr_val
-            pullback_ok = abs(last_close - probe_entry) <= PROMOTE_PULLBACK_ATR * atr_current if last_close is not None and probe_entry is not None and atr_current is not None else False
-            last_candle_dir = "LONG" if last_close > m15["open"].iloc[-1] else "SHORT"
-            last_candle_vol = float(m15['volume'].iloc[-1])
-            big_trap = (last_candle_dir != active_probe["direction"]) and (last_candle_vol > 1.8 * avg_volume if avg_volume is not None else False)
-            if pullback_ok and not big_trap and not anti_chase:
-                if not active_full:
-                    plan_full = plan_probe_and_topup(active_probe["direction"], m15, ind_m15, cfg)
-                    promote_size = max(simulator.balance * FULL_PCT, 0)
-                    if promote_size >= min_notional:
-                        simulator.promote_trade(active_probe, promote_size, price_now)
-                        notifier.text(f"🔁 Promote lên FULL {symbol} sau pullback xác nhận. Giá hiện tại: {safe_float_fmt(price_now)}")
-            elif big_trap:
-                simulator.close_trade(active_probe, price_now, "TRAP", now_epoch, reason="trap_reversal")
-                notifier.text(f"⚠️ Đóng probe {symbol} do phát hiện trap đảo chiều volume lớn!")
-
-        for t in simulator.get_all_trades():
-            if t["symbol"] == symbol and t["time_close"] is None:
-                dside = t.get("direction")
-                tp_sim = t.get("tp")
-                sl_sim = t.get("sl")
-                active_id = f"{symbol}|{t.get('entry')}"
-                closed = False
-
-                update_trailing_stop(t, price_now)
-
-                if price_now is not None and tp_sim is not None and (
-                    (dside == "LONG" and price_now >= tp_sim) or
-                    (dside == "SHORT" and price_now <= tp_sim)
-                ):
-                    simulator.close_trade(t, price_now, "TP", now_epoch, reason="take_profit")
-                    closed = True
-
-                if not closed and price_now is not None and sl_sim is not None and (
-                    (dside == "LONG" and price_now <= sl_sim) or
-                    (dside == "SHORT" and price_now >= sl_sim)
-                ):
-                    simulator.close_trade(t, price_now, "SL", now_epoch, reason="stop_loss")
-                    closed = True
-
-                if not closed and side_m15 and dside and side_m15 != dside and side_m15 in ("LONG", "SHORT"):
-                    simulator.close_trade(t, price_now, "REVERSE", now_epoch, reason="reverse_signal")
-                    closed = True
-
-                adx_latest = None
-                rsi_latest = None
-                try:
-                    adx_latest = float(ind_m15['adx'].iloc[-1])
-                except Exception:
-                    pass
-                try:
-                    rsi_latest = float(ind_m15['rsi'].iloc[-1])
-                except Exception:
-                    pass
-                suggest, reason, content = should_suggest_close(
-                    t, side_m15, ind_m15, adx_latest, rsi_latest, now_epoch
-                )
-                pnl = t.get("result", 0)
-                if not closed and (suggest and pnl is not None and pnl > 0 and AUTO_CLOSE_ON_WARNING_IF_PNL_POS):
-                    simulator.close_trade(t, price_now, "CLOSE_WARN_PNL_POS", now_epoch, reason="close_on_warning_pnl_positive")
-                    notifier.text(f"✅ Đóng vị thế {symbol} do cảnh báo & đang lãi {safe_float_fmt(pnl,2)}")
-                    closed = True
-                elif not closed and suggest:
-                    last_warned = CLOSE_WARNED.get(active_id)
-                    if last_warned != reason:
-                        notifier.text(content)
-                        CLOSE_WARNED[active_id] = reason
-                else:
-                    if CLOSE_WARNED.get(active_id):
-                        CLOSE_WARNED.pop(active_id, None)
-
-                # ======= ĐÓNG LỆNH NẾU GIỮ QUÁ LÂU MÀ ĐANG CÓ LÃI =======
-                if not closed:
-                    MAX_HOLD_M15_PROFIT = 12  # Số nến M15 tối đa giữ lệnh khi đang có lãi, có thể chỉnh
-                    n_open = int((time.time() - t.get("time_open", 0)) // (15 * 60)) if t.get("time_open") else 0
-                    direction = t.get("direction")
-                    entry = float(t.get("entry") or 0)
-                    size = float(t.get("size") or 0)
-                    pnl_now = (price_now - entry) * size if direction == "LONG" else (entry - price_now) * size
-                    if n_open >= MAX_HOLD_M15_PROFIT and pnl_now > 0:
-                        simulator.close_trade(t, price_now, "MAX_HOLD_PROFIT", int(time.time()), reason="max_hold_pnl_positive")
-                        notifier.text(f"⏰ Đóng {t['symbol']} {direction} do giữ quá lâu nhưng đang lãi ({n_open} nến, PnL={pnl_now:.2f})")
-                        closed = True
-
-                if closed:
-                    mark_closed_entry(symbol, "15m", dside)
-                    monitor.remove_signal(symbol)
-                    CLOSE_WARNED.pop(active_id, None)
-                    LAST_CLOSE_TIME[symbol] = time.time()
+    # symbol đang có lệnh luôn đi đủ pipeline (quản lý lệnh cần M15), không qua lọc H1
+    open_symbols = {t["symbol"] for t in simulator.get_all_trades() if t["time_close"] is None}
+    started = time.monotonic()
+    shards = get_shard_pool(cfg)
+    if shards is not None:
+        status, cost = await shards.run(active_symbols, now_epoch, _apply, keep=open_symbols)
+    else:
+        status, cost = await analyze_universe(cfg, active_symbols, now_epoch, _apply, keep=open_symbols)
+    report = pipeline_report(active_symbols, status, time.monotonic() - started, cost)
+    report["stages_ms"] = timer.end_iteration(active_symbols, time.monotonic() - started)
+
+    stable_tracker.flush()
+    close_cooldown.flush()
+    if housekeeping:
+        run_housekeeping(cfg, notifier)
+    return report
+
+def run_housekeeping(cfg: Dict[str, Any], notifier: Notifier):
+    """Việc rẻ cuối vòng: thống kê cache, báo cáo cuối ngày (một lần/ngày), cảnh báo treo lệnh."""
+    global DAILY_REPORT_DATE
+    print(f"[CACHE] {get_tf_cache(cfg).stats()}")
+    print(f"[MEMO] {get_indicator_memo(cfg).stats()}")
+    shards = get_shard_pool(cfg)
+    if shards is not None:
+        print(f"[SHARD] {shards.stats()}")
+    slowest = sorted(get_stage_timer(cfg).last_iteration.items(), key=lambda kv: -kv[1][0])[:5]
+    if slowest:
+        print("[TIMING] " + ", ".join(f"{stage} {wall:.1f}ms" for stage, (wall, _) in slowest))
 
     now_dt = datetime.now()
-    if now_dt.hour == 23 and now_dt.minute >= 59:
+    if now_dt.hour == 23 and now_dt.minute >= 59 and DAILY_REPORT_DATE != now_dt.date():
+        DAILY_REPORT_DATE = now_dt.date()
         csv_path = "trades_sim_log.csv"
         simulator.save_report(csv_path, date=now_dt.strftime("%Y-%m-%d"))
         md_report = simulator.format_markdown_report(date=now_dt.strftime("%Y-%m-%d"))
@@ -581,6 +521,126 @@ async def run_once(cfg: Dict[str, Any], notifier: Notifier):
                 notifier.text(f"⚠️ Lệnh {symbol} đã treo {hold_m15} nến M15, cân nhắc đóng hoặc kiểm tra lại!")
                 active_trade["hold_warned"] = True
 
+async def risk_check_once(cfg: Dict[str, Any], notifier: Notifier) -> int:
+    """
+    Một lượt risk loop: một request ticker cho các symbol đang có lệnh mở rồi chạy
+    manage_open_trade với giá mới nhất. Trả về số lệnh đã đóng.
+    """
+    open_trades = [t for t in simulator.get_all_trades() if t.get("time_close") is None]
+    if not open_trades:
+        return 0
+    prices = await get_async_fetcher(cfg).fetch_last_prices(t["symbol"] for t in open_trades)
+    now_epoch = time.time()
+    auto_close = cfg.get("auto_close_on_warning_if_pnl_positive", True)
+    closed = 0
+    for t in open_trades:
+        price_now = prices.get(t["symbol"])
+        if price_now is None or t.get("time_close") is not None:
+            continue
+        ctx = RISK_CONTEXT.get(t["symbol"]) or {}
+        if manage_open_trade(t, price_now, now_epoch, notifier, ctx.get("side"), ctx.get("adx"), ctx.get("rsi"),
+                             auto_close_on_warning=auto_close):
+            closed += 1
+            print(f"[RISK] Đóng {t['symbol']} {t.get('direction')} tại {safe_float_fmt(price_now)} ({t.get('status')})")
+    if closed:
+        close_cooldown.flush()
+    return closed
+
+async def risk_loop(cfg: Dict[str, Any], notifier: Notifier, stop_event: asyncio.Event):
+    """
+    Vòng SL/TP/trailing nhịp nhanh (risk_loop.interval_sec), tách khỏi vòng tín hiệu.
+    Không mở store.batch(): cooldown sau lệnh đóng (một lần flush mỗi lượt) phải
+    commit ngay, không chờ lượt phân tích đang chạy song song.
+    """
+    interval = float((cfg.get("risk_loop") or {}).get("interval_sec", 2.0))
+    while not stop_event.is_set():
+        start = time.time()
+        try:
+            await asyncio.wait_for(risk_check_once(cfg, notifier), timeout=max(1.0, interval * 5))
+        except asyncio.TimeoutError:
+            print("[WARN] risk loop timeout")
+        except Exception as e:
+            print(f"[ERROR] risk loop: {e!r}")
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=max(0.0, interval - (time.time() - start)))
+        except asyncio.TimeoutError:
+            pass
+
+async def run_interval(cfg: Dict[str, Any], notifier: Notifier, stop_event: asyncio.Event, store=None):
+    """Chế độ cũ: chạy cả pipeline mỗi scheduler.interval_sec."""
+    interval_sec = int((cfg.get("scheduler") or {}).get("interval_sec", 60))
+    while not stop_event.is_set():
+        start = time.time()
+        print(f"[LOOP] {datetime.now().isoformat(timespec='seconds')}")
+        try:
+            # mọi ghi state trong một vòng gom vào một transaction
+            with store.batch() if store is not None else nullcontext():
+                await asyncio.wait_for(run_once(cfg, notifier), timeout=max(5, interval_sec - 5))
+        except asyncio.TimeoutError:
+            print("[WARN] iteration timeout")
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            print(f"[ERROR] run_once: {e!r}")
+        elapsed = time.time() - start
+        remain = max(0, interval_sec - elapsed)
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=remain)
+        except asyncio.TimeoutError:
+            pass
+
+async def run_scheduled(cfg: Dict[str, Any], notifier: Notifier, stop_event: asyncio.Event, store=None):
+    """
+    Chế độ bar_close: một lượt run_once cho cả universe ngay sau khi nến
+    scheduler.timeframe đóng (+ grace_sec), nên batch chỉ báo, lọc H1 một request
+    ticker và tổng "@iter" của timing vẫn tính trên cả lượt. Symbol chậm bị cắt ở
+    hạn pipeline.symbol_timeout_sec của riêng nó (status timeout, thử lại ở nến
+    sau) thay vì giữ cả lượt; lượt vẫn quá job_timeout_sec thì các nến lỡ được đếm
+    vào skipped và lượt kế chạy ở nến đóng tiếp theo. Việc rẻ cuối vòng chạy mỗi
+    phút; giữa hai lần đóng nến chỉ còn risk loop.
+    """
+    scfg = cfg.get("scheduler") or {}
+    tf = scfg.get("timeframe", "5m")
+    sched = BarCloseScheduler(grace_sec=float(scfg.get("grace_sec", 2.0)))
+    job_timeout = float(scfg.get("job_timeout_sec", 120))
+    sched.arm(UNIVERSE_JOB, tf, run_now=True)
+    sched.arm(HOUSEKEEPING_JOB, "1m")
+    watch_tfs = tuple(dict.fromkeys((tf, "5m", "15m", "1h", "4h", "1d")))
+    running = {}
+
+    async def _job(key, due):
+        try:
+            with store.batch() if store is not None else nullcontext():
+                if key == HOUSEKEEPING_JOB:
+                    run_housekeeping(cfg, notifier)
+                else:
+                    closed = sched.closed_timeframes(due, watch_tfs)
+                    print(f"[SCHED] nến đóng {'/'.join(closed) or 'khởi động'} (trễ {time.time() - due:.2f}s)")
+                    await asyncio.wait_for(run_once(cfg, notifier, housekeeping=False), timeout=job_timeout)
+        except asyncio.TimeoutError:
+            print(f"[WARN] {key}: job timeout")
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            print(f"[ERROR] job {key}: {e!r}")
+        finally:
+            running.pop(key, None)
+            sched.arm(key, sched.timeframe_of(key) or tf)
+
+    while not stop_event.is_set():
+        for key, due in sched.pop_due():
+            if key not in running:
+                running[key] = asyncio.create_task(_job(key, due))
+        nxt = sched.next_due()
+        wait = 1.0 if nxt is None else min(60.0, max(0.0, nxt - time.time()))
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+    if running:
+        await asyncio.gather(*running.values(), return_exceptions=True)
+    print(f"[SCHED] {sched.stats()}")
+
 async def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--profile", choices=["strict","medium","test_soft"])
@@ -595,6 +655,11 @@ async def main():
         if "adx_h1_threshold" in p:
             cfg["adx_h1_threshold"] = p["adx_h1_threshold"]
 
+    store = get_state_store(cfg)
+    if store is not None:
+        stable_tracker.use_store(store)
+        close_cooldown.use_store(store)
+
     notifier = Notifier(cfg)
     if notifier.enabled():
         notifier.text(f"Bot started profile={prof}")
@@ -607,26 +672,20 @@ async def main():
     except NotImplementedError:
         pass
 
-    interval_sec = int((cfg.get("scheduler") or {}).get("interval_sec", 60))
+    risk_task = None
+    if (cfg.get("risk_loop") or {}).get("enabled", True):
+        risk_task = asyncio.create_task(risk_loop(cfg, notifier, stop_event))
 
-    while not stop_event.is_set():
-        start = time.time()
-        print(f"[LOOP] {datetime.now().isoformat(timespec='seconds')}")
-        try:
-            await asyncio.wait_for(run_once(cfg, notifier), timeout=max(5, interval_sec - 5))
-        except asyncio.TimeoutError:
-            print("[WARN] iteration timeout")
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            print(f"[ERROR] run_once: {e!r}")
-        elapsed = time.time() - start
-        remain = max(0, interval_sec - elapsed)
-        try:
-            await asyncio.wait_for(stop_event.wait(), timeout=remain)
-        except asyncio.TimeoutError:
-            pass
+    if (cfg.get("scheduler") or {}).get("mode", "interval") == "bar_close":
+        await run_scheduled(cfg, notifier, stop_event, store)
+    else:
+        await run_interval(cfg, notifier, stop_event, store)
 
+    if risk_task is not None:
+        await risk_task
+    await close_async_fetcher()
+    close_shard_pool()
+    get_stage_timer(cfg).dump()
     print("[MAIN] Stopped")
 
 if __name__ == "__main__":
@@ -1,11 +1,15 @@
 from __future__ import annotations
-import os, re, sys
+import atexit, os, queue, re, sys, threading, weakref
 from typing import Any, Dict, Optional
 
 try:
     from .discord_bot import send_text, send_action, send_signal
 except Exception:
     from discord_bot import send_text, send_action, send_signal
+try:
+    from .timing import get_stage_timer
+except Exception:
+    from timing import get_stage_timer
 
 NUM = r'[-+]?(?:\d+(?:\.\d+)?|\.\d+)(?:[eE][-+]?\d+)?'
 
@@ -22,7 +26,8 @@ class Notifier:
         if not self.enabled():
             print("[DISCORD] webhook rỗng", file=sys.stderr); return False
         try:
-            ok = send_signal(self.webhook_url, entry_signal)
+            with get_stage_timer().stage("discord"):
+                ok = send_signal(self.webhook_url, entry_signal)
             if not ok: print("[DISCORD] send signal fail", file=sys.stderr)
             return ok
         except Exception as e:
@@ -31,7 +36,8 @@ class Notifier:
     def _send_text(self, content: str) -> bool:
         if not self.enabled(): return False
         try:
-            ok = send_text(self.webhook_url, content)
+            with get_stage_timer().stage("discord"):
+                ok = send_text(self.webhook_url, content)
             if not ok: print("[DISCORD] send text fail", file=sys.stderr)
             return ok
         except Exception as e:
@@ -54,4 +60,71 @@ class Notifier:
             print(f"[DISCORD] Lỗi gửi file: {e}", file=sys.stderr)
             return False
 
-__all__=["Notifier"]
+_LIVE_QUEUES = weakref.WeakSet()  # hàng đợi còn sống, flush một lần lúc thoát tiến trình
+
+@atexit.register
+def _flush_live_queues():
+    for q in list(_LIVE_QUEUES):
+        q.flush(5.0)
+
+class NotificationQueue:
+    """
+    Hàng đợi gửi Discord chạy nền: put() không chặn; worker gom các tin đang chờ
+    thành ít bài post nhất (mỗi bài <= max_chars) rồi gửi qua notifier.send.
+    """
+    def __init__(self, notifier: Notifier, max_chars: int = 1900):
+        self.notifier = notifier
+        self.max_chars = int(max_chars)
+        self._q: "queue.Queue[str]" = queue.Queue()
+        self.sent_posts = 0
+        self._worker = threading.Thread(target=self._run, name="notify-queue", daemon=True)
+        self._worker.start()
+        _LIVE_QUEUES.add(self)
+
+    def put(self, content: str):
+        self._q.put(str(content))
+
+    def put_many(self, contents):
+        for c in contents:
+            self._q.put(str(c))
+
+    def _chunks(self, msgs):
+        buf = ""
+        for m in msgs:
+            if buf and len(buf) + 2 + len(m) > self.max_chars:
+                yield buf
+                buf = ""
+            buf = f"{buf}\n\n{m}" if buf else m
+        if buf:
+            yield buf
+
+    def _run(self):
+        while True:
+            msgs = [self._q.get()]
+            while True:
+                try:
+                    msgs.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for post in self._chunks(msgs):
+                    # lỗi một bài không làm rơi các bài còn lại của lượt
+                    try:
+                        self.notifier.send(post)
+                        self.sent_posts += 1
+                    except Exception as e:
+                        print(f"[DISCORD] Lỗi hàng đợi: {e}", file=sys.stderr)
+            finally:
+                for _ in msgs:
+                    self._q.task_done()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Chờ gửi hết tin đang chờ (tối đa timeout giây). True nếu đã hết."""
+        if timeout is None:
+            self._q.join()
+            return True
+        done = threading.Event()
+        threading.Thread(target=lambda: (self._q.join(), done.set()), daemon=True).start()
+        return done.wait(timeout)
+
+__all__=["Notifier", "NotificationQueue"]
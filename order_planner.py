@@ -1,4 +1,5 @@
 from typing import Dict
+from indicators import last_value
 from position_sizer import compute_size
 
 def _get_account_balance_quote(cfg: Dict) -> float:
@@ -8,7 +9,7 @@ def plan_probe_and_topup(side: str, ohlcv_m15, indicators_m15: Dict, cfg: Dict)
     # LẤY ENTRY LÀ GIÁ CLOSE MỚI NHẤT, KHÔNG DÙNG VWAP
     entry = float(ohlcv_m15['close'].iloc[-1])
     atr_series = indicators_m15.get("atr")
-    atr = float(atr_series.iloc[-1]) if atr_series is not None else entry * 0.01
+    atr = float(last_value(atr_series)) if atr_series is not None else entry * 0.01
 
     tight = cfg.get("tight_mode") or {}
     sl_mult = float(tight.get("sl_atr_mult", 1.2))
@@ -6,11 +6,12 @@ from typing import Dict
 
 import pandas as pd
 
-from data import fetch_data
-from indicators import calculate_indicators
-from votes import tally_votes
+from data import fetch_many_sync
+from indicators import calculate_indicators_cached, last_value
+from votes import get_vote_scorer
 from report_utils import format_votes
 
+from state_store import get_state_store
 from tight_gate import (
     StablePassTracker,
     CooldownManager,
@@ -54,22 +55,31 @@ def main():
         path=cfg.get("tight_mode", {}).get("state_path", "tight_state.json"),
         min_gap_sec=int(cfg.get("tight_mode", {}).get("snapshot_min_gap_sec", 300)),
         required_passes=int(cfg.get("tight_mode", {}).get("snapshot_confirmations", 2)),
+        store=get_state_store(cfg),
+    )
+    cd = CooldownManager(
+        path=cfg.get("tight_mode", {}).get("cooldown_path", "tight_cooldown.json"),
+        default_cooldown_sec=cooldown_min * 60,
+        store=get_state_store(cfg),
+    )
+
+    frames = fetch_many_sync(
+        [(symbol, tf, 300) for symbol in symbols for tf in ("15m", "1h")], cfg=cfg
     )
-    cd = CooldownManager(path=cfg.get("tight_mode", {}).get("cooldown_path", "tight_cooldown.json"))
 
     for symbol in symbols:
         for timeframe in timeframes:
             print(f"\n[Phase2] {symbol} {timeframe} at {datetime.now(timezone.utc).isoformat(timespec='seconds')}")
             now_ts = time.time()
 
-            m15 = fetch_data(symbol, "15m", limit=300)
-            h1 = fetch_data(symbol, "1h", limit=300)
+            m15 = frames.get((symbol, "15m"))
+            h1 = frames.get((symbol, "1h"))
             # Kiểm tra đủ nến cho các chỉ báo window lớn nhất
             if not check_indicator_input(m15, 200, f"{symbol} M15"): continue
             if not check_indicator_input(h1, 200, f"{symbol} H1"): continue
 
-            ind_m15 = calculate_indicators(m15, cfg)
-            ind_h1 = calculate_indicators(h1, cfg)
+            ind_m15 = calculate_indicators_cached(m15, cfg, symbol=symbol)
+            ind_h1 = calculate_indicators_cached(h1, cfg, symbol=symbol)
 
             map_m15 = build_indicator_results(m15, ind_m15)
             map_h1 = build_indicator_results(h1, ind_h1)
@@ -77,12 +87,12 @@ def main():
             wsets = (cfg or {}).get("weights_sets", {})
             w_m15 = wsets.get("M15", {})
             w_h1 = wsets.get("H1", {})
-            vr_m15 = tally_votes(map_m15, w_m15)
-            vr_h1 = tally_votes(map_h1, w_h1)
+            vr_m15 = get_vote_scorer(cfg, "M15").score(map_m15)
+            vr_h1 = get_vote_scorer(cfg, "H1").score(map_h1)
             sl15, ss15 = float(vr_m15.get("score_long", 0)), float(vr_m15.get("score_short", 0))
             side = decide_side(sl15, ss15)
 
-            adx_h1 = float(ind_h1["adx"].iloc[-1])
+            adx_h1 = float(last_value(ind_h1["adx"]))
             hh1 = _heavy_hits(map_h1, ind_h1["ema200"], side) if side != "NEUTRAL" else 0
             h1_ok = (adx_h1 >= adx_h1_th) and (hh1 == 3) and (side != "NEUTRAL")
 
@@ -123,6 +133,8 @@ def main():
                 if not is_stable: reasons.append("Not stable 2×M5")
                 print(" - BLOCKED by:", ", ".join(reasons))
 
+    stable.flush()
+    cd.flush()
     print("\n[Done] Phase 2 dry-run kết thúc.")
 
 if __name__ == "__main__":
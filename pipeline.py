@@ -0,0 +1,541 @@
+# -*- coding: utf-8 -*-
+"""
+Phần thuần của pipeline tín hiệu: fetch → chỉ báo → vote → gate cho một nhóm
+symbol, không đụng state giao dịch (simulator, tracker, thông báo).
+
+analyze_universe() trả mỗi symbol một bản ghi quyết định gọn (dict số/chuỗi,
+pickle được) qua callback; main.apply_decision áp bản ghi vào state. Cùng code
+chạy trong run_once (một process) hoặc trong worker shard (sharding.py).
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from data import get_candle_store
+from tf_cache import get_tf_cache, patch_live_price
+from indicators import calculate_indicators_cached, get_indicator_memo, last_value
+from batch_indicators import calculate_indicators_many
+from indicator_registry import active_indicators, fields_for, lookback, min_bars
+from tight_gate import build_indicator_results, _heavy_hits
+from votes import get_vote_scorer
+from order_planner import plan_probe_and_topup
+from timing import get_stage_timer
+
+def decide_side(score_long: float, score_short: float, eps: float = 0.1) -> str:
+    if score_long - score_short > eps: return "LONG"
+    if score_short - score_long > eps: return "SHORT"
+    return "NEUTRAL"
+
+def check_indicator_input(df, min_required, label):
+    if df is None or not isinstance(df, pd.DataFrame) or df.empty or len(df) < min_required:
+        print(f"[WARN] {label}: DataFrame qua nho ({len(df) if df is not None else 0}) can >= {min_required}")
+        return False
+    return True
+
+def is_data_fresh(df, tf_min, symbol, tf_name, max_lag_n=2):
+    if df is None or df.empty:
+        print(f"[ERROR] DataFrame {symbol} {tf_name} rỗng!")
+        return False
+    last_ts = None
+    if 'timestamp' in df.columns:
+        last_ts = df['timestamp'].iloc[-1]
+    elif hasattr(df.index, "astype"):
+        try:
+            last_ts = int(df.index[-1].timestamp())
+        except Exception:
+            pass
+    if last_ts is None:
+        print(f"[ERROR] Không lấy được timestamp {symbol} {tf_name}.")
+        return False
+    now = time.time()
+    lag = now - last_ts
+    max_lag = tf_min * 60 * max_lag_n
+    if lag > max_lag:
+        print(f"[ERROR] Dữ liệu {symbol} {tf_name} QUÁ CŨ! Lệch {lag/60:.1f} phút (> {max_lag/60:.1f} phút)")
+        return False
+    try:
+        last_price = float(df['close'].iloc[-1])
+        print(f"[DATA_CHECK] {symbol} {tf_name} | last price: {last_price} | last ts: {datetime.fromtimestamp(last_ts)} | now: {datetime.fromtimestamp(now)} | lag: {lag:.1f}s")
+    except Exception:
+        pass
+    return True
+
+def is_breakout_candle(df, ind, ma_col="ema200", volume_col="volume", direction="LONG"):
+    if df is None or ind is None or len(df) < 20:
+        return False
+    atr_val = float(last_value(ind.get('atr'), 0))
+    body = abs(df['close'].iloc[-1] - df['open'].iloc[-1])
+    vol = df[volume_col].iloc[-1]
+    avg_vol = df[volume_col].rolling(20).mean().iloc[-1]
+    close = df['close'].iloc[-1]
+    ma_val = float(last_value(ind.get(ma_col), 0))
+    if direction == "LONG":
+        breakout_body = (df['close'].iloc[-1] - df['open'].iloc[-1]) > 1.2 * atr_val if atr_val > 0 else False
+        breakout_vol = vol > 1.5 * avg_vol if avg_vol > 0 else False
+        breakout_close = close > ma_val if ma_val > 0 else False
+        return breakout_body and breakout_vol and breakout_close
+    else:
+        breakout_body = (df['open'].iloc[-1] - df['close'].iloc[-1]) > 1.2 * atr_val if atr_val > 0 else False
+        breakout_vol = vol > 1.5 * avg_vol if avg_vol > 0 else False
+        breakout_close = close < ma_val if ma_val > 0 else False
+        return breakout_body and breakout_vol and breakout_close
+
+# timeframe dữ liệu → timeframe truyền cho calculate_indicators (H1 tính trend_h4)
+BATCH_TIMEFRAMES = (("5m", "5m"), ("15m", "15m"), ("1h", "4h"), ("1d", "1d"))
+
+def indicator_plan(cfg):
+    """
+    Chỉ báo vote và field cần tính cho từng timeframe của pipeline, theo trọng số
+    đang dùng: M5/M15 chấm bằng weights M15 (có DEFAULT_WEIGHTS), H1 chỉ giữ key có
+    trong weights H1, D1 chỉ cần EMA200 cho trend. Field ngoài vote là các giá trị
+    analyze_symbol đọc trực tiếp (anti-chase, breakout, cảnh báo đóng lệnh, gate ADX H1).
+    """
+    wsets = cfg.get("weights_sets") or {}
+    m15_votes = active_indicators(wsets.get("M15", {}))
+    h1_votes = active_indicators(wsets.get("H1", {}), use_defaults=False)
+    votes = {"5m": m15_votes, "15m": m15_votes, "1h": h1_votes, "1d": ()}
+    fields = {
+        "5m": fields_for(m15_votes),
+        "15m": fields_for(m15_votes, ("ma50", "atr", "ema200", "adx", "rsi")),
+        "1h": fields_for(h1_votes, ("adx", "ema200")),
+        "1d": fields_for((), ("ema200",)),
+    }
+    return votes, fields
+
+def fetch_plan(fields):
+    """(timeframe, limit) vừa đủ lookback lớn nhất của các field cần tính."""
+    return tuple((tf, lookback(fields[tf])) for tf, _ in BATCH_TIMEFRAMES)
+
+_cpu_pool = None
+
+def get_cpu_pool(cfg) -> ThreadPoolExecutor:
+    """
+    Worker pool cho phần tính chỉ báo. Thread (không phải process) vì frame, memo và
+    cache chỉ báo là object trong process; kernel numpy/pandas nhả GIL khi tính.
+    """
+    global _cpu_pool
+    if _cpu_pool is None:
+        workers = int((cfg.get("pipeline") or {}).get("cpu_workers", 2))
+        _cpu_pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="indicators")
+    return _cpu_pool
+
+def batch_universe_indicators(cfg, symbols, frames, fields, tf_cache, now_epoch):
+    """
+    Tính chỉ báo cả universe theo từng timeframe bằng một lượt batch 2-D.
+    Bỏ qua H1/D1 còn cache chỉ báo và frame đã có trong memo; H1 được vá giá live
+    từ M5 như luồng từng symbol.
+    """
+    memo = get_indicator_memo(cfg)
+    out = {}
+    for tf, ind_tf in BATCH_TIMEFRAMES:
+        group = {}
+        for symbol in symbols:
+            df = frames.get((symbol, tf))
+            if df is None or len(df) < min_bars(fields[tf]) or tf_cache.has_indicators(symbol, tf, now_ts=now_epoch):
+                continue
+            if tf == "1h" and tf_cache.enabled("1h"):
+                m5 = frames.get((symbol, "5m"))
+                if m5 is None or m5.empty:
+                    continue
+                df = patch_live_price(df, float(m5['close'].iloc[-1]))
+            hit = memo.get(symbol, ind_tf, df, cfg, mode="batch")
+            if hit is not None:
+                out[(symbol, tf)] = hit
+            else:
+                group[symbol] = df
+        with get_stage_timer().stage(f"indicators_batch:{tf}"):
+            many = calculate_indicators_many(group, timeframe=ind_tf)
+        for symbol, ind in many.items():
+            memo.put(symbol, ind_tf, group[symbol], ind, cfg, mode="batch")
+            out[(symbol, tf)] = ind
+    return out
+
+def prepare_symbol(cfg, symbol, frames, ind_fields, tf_cache, batch_ind, now_epoch):
+    """Kiểm tra dữ liệu + tính chỉ báo M5/M15/H1/D1 của symbol; None nếu thiếu/cũ."""
+    def _indicators(tf, df, ind_tf):
+        ind = batch_ind.get((symbol, tf))
+        if ind is not None:
+            return ind
+        with get_stage_timer().stage(f"indicators:{tf}", symbol):
+            return calculate_indicators_cached(df, cfg, timeframe=ind_tf, symbol=symbol, fields=ind_fields[tf])
+
+    m5 = frames.get((symbol, "5m"))
+    m15 = frames.get((symbol, "15m"))
+    h1 = frames.get((symbol, "1h"))
+    d1 = frames.get((symbol, "1d"))
+
+    if not check_indicator_input(m5, min_bars(ind_fields["5m"]), f"{symbol} M5"): return None
+    if not check_indicator_input(m15, min_bars(ind_fields["15m"]), f"{symbol} M15"): return None
+    if not check_indicator_input(h1, min_bars(ind_fields["1h"]), f"{symbol} H1"): return None
+    if not check_indicator_input(d1, min_bars(ind_fields["1d"]), f"{symbol} D1"): return None
+
+    # M15/H1 gộp từ M5 thì cùng nhịp với M5, không cần kiểm tra độ trễ riêng
+    derived = get_candle_store(cfg).derive
+    if not is_data_fresh(m5, tf_min=5, symbol=symbol, tf_name="M5"): return None
+    if "15m" not in derived and not is_data_fresh(m15, tf_min=15, symbol=symbol, tf_name="M15"): return None
+    if "1h" not in derived and not is_data_fresh(h1, tf_min=60, symbol=symbol, tf_name="H1"): return None
+    if not is_data_fresh(d1, tf_min=1440, symbol=symbol, tf_name="D1"): return None
+
+    live_price = float(m5['close'].iloc[-1])
+    if tf_cache.enabled("1h"):
+        h1 = patch_live_price(h1, live_price)
+
+    ind_m5 = _indicators("5m", m5, "5m")
+    ind_m15 = _indicators("15m", m15, "15m")
+    ind_h1 = tf_cache.get_indicators(symbol, "1h", lambda: _indicators("1h", h1, "4h"), now_ts=now_epoch)
+    ind_d1 = tf_cache.get_indicators(symbol, "1d", lambda: _indicators("1d", d1, "1d"), live_price=live_price, now_ts=now_epoch)
+    if ind_m5 is None or ind_m15 is None or ind_h1 is None or ind_d1 is None: return None
+    return m5, m15, h1, d1, ind_m5, ind_m15, ind_h1, ind_d1
+
+def _last_float(series, default=0.0):
+    try:
+        v = series.iloc[-1]
+    except Exception:
+        return default
+    return default if pd.isnull(v) else float(v)
+
+def _h1_votes(cfg, h1, ind_h1, names, symbol=None):
+    """Map vote H1 (chỉ key có trong weights H1) và kết quả chấm điểm."""
+    timer = get_stage_timer()
+    h1_keys = set([k.upper() for k in ((cfg.get("weights_sets") or {}).get("H1", {})).keys()])
+    with timer.stage("build_indicator_results", symbol):
+        map_h1_full = build_indicator_results(h1, ind_h1, names)
+    map_h1 = {k.upper(): v for k, v in map_h1_full.items() if k.upper() in h1_keys}
+    with timer.stage("tally_votes", symbol):
+        return map_h1, get_vote_scorer(cfg, "H1").score(map_h1)
+
+def analyze_symbol(cfg, symbol, prep, vote_names) -> Dict[str, Any]:
+    """Vote + gate của symbol từ kết quả prepare_symbol → bản ghi quyết định gọn."""
+    with get_stage_timer().stage("gates", symbol):
+        return _analyze_symbol(cfg, symbol, prep, vote_names)
+
+def _analyze_symbol(cfg, symbol, prep, vote_names):
+    timer = get_stage_timer()
+    m5, m15, h1, d1, ind_m5, ind_m15, ind_h1, ind_d1 = prep
+    th_m15 = float((cfg.get("thresholds") or {}).get("M15", 15.0))
+    th_h1 = float((cfg.get("thresholds") or {}).get("H1", 8.0))
+    heavy_required = int(cfg.get("tight_mode", {}).get("heavy_required", 3))
+    scorer_m15 = get_vote_scorer(cfg, "M15")
+
+    with timer.stage("build_indicator_results", symbol):
+        map_m5 = build_indicator_results(m5, ind_m5, vote_names["5m"])
+        map_m15 = build_indicator_results(m15, ind_m15, vote_names["15m"])
+    map_h1, vr_h1 = _h1_votes(cfg, h1, ind_h1, vote_names["1h"], symbol)
+
+    with timer.stage("tally_votes", symbol):
+        vr_m5 = scorer_m15.score(map_m5)
+        vr_m15 = scorer_m15.score(map_m15)
+
+    sl5, ss5 = float(vr_m5.get("score_long", 0) or 0), float(vr_m5.get("score_short", 0) or 0)
+    sl15, ss15 = float(vr_m15.get("score_long", 0) or 0), float(vr_m15.get("score_short", 0) or 0)
+    slh1, ssh1 = float(vr_h1.get("score_long", 0) or 0), float(vr_h1.get("score_short", 0) or 0)
+
+    if sl15 - ss15 > 0.1:
+        probe_direction = "LONG"
+    elif ss15 - sl15 > 0.1:
+        probe_direction = "SHORT"
+    else:
+        probe_direction = "LONG" # mặc định
+
+    side_m5 = decide_side(sl5, ss5)
+    side_m15 = decide_side(sl15, ss15)
+    side_h1 = decide_side(slh1, ssh1)
+
+    m15_score = sl15 if side_m15 == "LONG" else (ss15 if side_m15 == "SHORT" else 0.0)
+    h1_score = slh1 if side_h1 == "LONG" else (ssh1 if side_h1 == "SHORT" else 0.0)
+
+    hhits = _heavy_hits(map_h1, ind_h1['ema200'], side_m15) if side_m15 != "NEUTRAL" else 0
+    try:
+        adx_h1 = float(last_value(ind_h1['adx']))
+    except Exception:
+        adx_h1 = 0.0
+
+    price_now = _last_float(m15['close']) if m15 is not None else 0.0
+
+    ma20_val = float(last_value(ind_m15.get("ma50"), price_now))
+    atr_val = float(last_value(ind_m15.get("atr"), price_now*0.01))
+
+    anti_chase = abs(price_now - ma20_val) > 1.2 * atr_val
+
+    gates_ok = (
+        side_m5 == side_m15 == side_h1 != "NEUTRAL"
+        and m15_score >= th_m15
+        and h1_score >= th_h1
+        and hhits >= heavy_required
+        and adx_h1 >= int(cfg.get("adx_h1_threshold", 25))
+    )
+
+    adx_latest = None
+    rsi_latest = None
+    try:
+        adx_latest = float(last_value(ind_m15['adx']))
+    except Exception:
+        pass
+    try:
+        rsi_latest = float(last_value(ind_m15['rsi']))
+    except Exception:
+        pass
+
+    return {
+        "symbol": symbol,
+        "side_m15": side_m15,
+        "probe_direction": probe_direction,
+        "m15_score": m15_score,
+        "h1_score": h1_score,
+        "heavy_hits": hhits,
+        "adx_h1": adx_h1,
+        "gates_ok": bool(gates_ok),
+        "anti_chase": bool(anti_chase),
+        "m15_breakdown": dict(vr_m15.get("breakdown_long", {}) if side_m15 == "LONG" else vr_m15.get("breakdown_short", {})),
+        "h1_breakdown": dict(vr_h1.get("breakdown_long", {}) if side_h1 == "LONG" else vr_h1.get("breakdown_short", {})),
+        "trend_h4": ind_h1.get("trend_h4", "-"),
+        "trend_d1": ind_d1.get("trend_d1", "-"),
+        "price_now": price_now,
+        "atr": atr_val,
+        "plan": plan_probe_and_topup(probe_direction, m15, ind_m15, cfg),
+        "ma_probe": float(last_value(ind_m15.get("ema200"), price_now)),
+        "breakout": bool(is_breakout_candle(m15, ind_m15, direction=probe_direction)),
+        "last_close": float(m15["close"].iloc[-1]),
+        "last_open": float(m15["open"].iloc[-1]),
+        "last_volume": _last_float(m15['volume']),
+        "avg_volume": _last_float(m15['volume'].rolling(20).mean()),
+        "adx": adx_latest,
+        "rsi": rsi_latest,
+    }
+
+# Gate H1 theo thứ tự rẻ → đắt; "h1_data" = thiếu dữ liệu/chỉ báo H1
+H1_GATES = ("h1_data", "h1_adx", "h1_side", "h1_score", "h1_heavy")
+FUNNEL_STATS: Dict[str, Any] = {"screened": 0, "passed": 0, "kept": 0, "pruned": {g: 0 for g in H1_GATES}}
+
+def screen_h1(cfg, symbol, h1, live_price, vote_names, ind_fields, tf_cache, now_epoch) -> str:
+    """
+    Phần gate H1 của analyze_symbol chạy riêng trước khi fetch M5/M15/D1: trả về gate
+    đầu tiên trượt ("" nếu qua). Trượt ở đây thì gates_ok cũng trượt (cùng ngưỡng,
+    side M15 phải trùng side H1). Chỉ báo H1 lấy qua tf_cache (một lần mỗi nến H1),
+    vote chấm theo giá live nên mỗi vòng chỉ tốn vài phép so sánh.
+    """
+    with get_stage_timer().stage("h1_screen", symbol):
+        return _screen_h1(cfg, symbol, h1, live_price, vote_names, ind_fields, tf_cache, now_epoch)
+
+def _screen_h1(cfg, symbol, h1, live_price, vote_names, ind_fields, tf_cache, now_epoch):
+    def _compute():
+        with get_stage_timer().stage("indicators:1h", symbol):
+            return calculate_indicators_cached(h1, cfg, timeframe="4h", symbol=symbol, fields=ind_fields["1h"])
+
+    if not check_indicator_input(h1, min_bars(ind_fields["1h"]), f"{symbol} H1"):
+        return "h1_data"
+    if tf_cache.enabled("1h") and live_price is not None:
+        h1 = patch_live_price(h1, live_price)
+    ind_h1 = tf_cache.get_indicators(symbol, "1h", _compute, now_ts=now_epoch)
+    if ind_h1 is None:
+        return "h1_data"
+    try:
+        adx_h1 = float(last_value(ind_h1['adx']))
+    except Exception:
+        adx_h1 = 0.0
+    if adx_h1 < int(cfg.get("adx_h1_threshold", 25)):
+        return "h1_adx"
+    map_h1, vr_h1 = _h1_votes(cfg, h1, ind_h1, vote_names["1h"], symbol)
+    slh1, ssh1 = float(vr_h1.get("score_long", 0) or 0), float(vr_h1.get("score_short", 0) or 0)
+    side_h1 = decide_side(slh1, ssh1)
+    if side_h1 == "NEUTRAL":
+        return "h1_side"
+    if (slh1 if side_h1 == "LONG" else ssh1) < float((cfg.get("thresholds") or {}).get("H1", 8.0)):
+        return "h1_score"
+    if _heavy_hits(map_h1, ind_h1['ema200'], side_h1) < int(cfg.get("tight_mode", {}).get("heavy_required", 3)):
+        return "h1_heavy"
+    return ""
+
+def funnel_report(screened: int, pruned: Dict[str, int], kept: int):
+    """Cộng dồn FUNNEL_STATS và in một dòng [FUNNEL] cho vòng này."""
+    passed = screened - sum(pruned.values())
+    FUNNEL_STATS["screened"] += screened
+    FUNNEL_STATS["passed"] += passed
+    FUNNEL_STATS["kept"] += kept
+    for gate, n in pruned.items():
+        FUNNEL_STATS["pruned"][gate] += n
+    cut = ", ".join(f"{g[3:]}: -{pruned[g]}" for g in H1_GATES if pruned.get(g))
+    print(f"[FUNNEL] H1 lọc {screened} symbol" + (f" | {cut}" if cut else "")
+          + f" | còn {passed}" + (f" (+{kept} đang có lệnh)" if kept else ""))
+
+async def analyze_universe(cfg: Dict[str, Any], symbols: List[str], now_epoch: float,
+                           on_record: Callable[[str, Dict[str, Any]], None],
+                           keep: Iterable[str] = ()) -> Tuple[Dict[str, str], Dict[str, float]]:
+    """
+    Fetch → chỉ báo → vote → gate cho `symbols`; on_record(symbol, record) được gọi
+    trên event loop ngay khi symbol xong. Mỗi symbol chạy trong task riêng (semaphore
+    pipeline.concurrency) với hạn pipeline.symbol_timeout_sec của riêng nó. Trả về
+    (status {symbol: "ok"/"skipped"/"pruned"/"timeout:<bước>"/"failed:<bước>:<lỗi>"},
+    cost {symbol: giây CPU tính chỉ báo + vote}).
+
+    pipeline.h1_prefilter: symbol ngoài `keep` (đang có lệnh) qua screen_h1 trước;
+    symbol trượt chỉ nhận bản ghi {"symbol", "pruned": gate}, không fetch M5/M15/D1.
+    """
+    tf_cache = get_tf_cache(cfg)
+    vote_names, ind_fields = indicator_plan(cfg)
+    pcfg = cfg.get("pipeline") or {}
+    sem = asyncio.Semaphore(max(1, int(pcfg.get("concurrency", 8))))
+    symbol_timeout = float(pcfg.get("symbol_timeout_sec", 20))
+    # cửa sổ gom batch chỉ chiếm một phần hạn của symbol, phần còn lại để tính + quyết định
+    batch_wait = min(float(pcfg.get("batch_wait_sec", 3)), symbol_timeout / 4)
+    pool = get_cpu_pool(cfg)
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    deadlines = {symbol: started + symbol_timeout for symbol in symbols}
+    status: Dict[str, str] = {}
+    cost: Dict[str, float] = {}
+
+    async def _staged(symbol, stage, coro):
+        """Chạy một bước của symbol trong hạn còn lại của nó; lỗi/timeout chỉ ghi vào status."""
+        left = deadlines[symbol] - time.monotonic()
+        try:
+            if left <= 0:
+                coro.close()
+                raise asyncio.TimeoutError
+            return await asyncio.wait_for(coro, timeout=left)
+        except asyncio.TimeoutError:
+            status[symbol] = f"timeout:{stage}"
+        except Exception as e:
+            status[symbol] = f"failed:{stage}:{e!r}"
+        return None
+
+    store = get_candle_store(cfg)
+    screened_h1 = {}
+
+    # Bước 0 (h1_prefilter): chỉ H1 + một request ticker cho cả nhóm
+    keep = set(keep)
+    to_screen = [s for s in symbols if s not in keep] if pcfg.get("h1_prefilter") else []
+    if to_screen:
+        h1_limit = dict(fetch_plan(ind_fields))["1h"]
+        prices = await store.fetcher.fetch_last_prices(to_screen) if tf_cache.enabled("1h") else {}
+
+        async def _screen(symbol):
+            async with sem:
+                h1 = tf_cache.get_frame(symbol, "1h", now_ts=now_epoch)
+                if h1 is None:
+                    # gọi thẳng sàn: H1 gộp từ M5 cần buffer M5 mà symbol bị lọc không cập nhật
+                    h1 = await get_stage_timer().timed(store.update(symbol, "1h", h1_limit), "fetch:1h", symbol)
+                    tf_cache.put_frame(symbol, "1h", h1, now_ts=now_epoch)
+            screened_h1[symbol] = h1
+            t0 = time.perf_counter()
+            gate = await loop.run_in_executor(pool, screen_h1, cfg, symbol, h1, prices.get(symbol),
+                                              vote_names, ind_fields, tf_cache, now_epoch)
+            cost[symbol] = time.perf_counter() - t0
+            return gate
+
+        gates = await asyncio.gather(*(_staged(s, "screen", _screen(s)) for s in to_screen))
+        pruned: Dict[str, int] = {}
+        for symbol, gate in zip(to_screen, gates):
+            if gate:
+                pruned[gate] = pruned.get(gate, 0) + 1
+                status[symbol] = "pruned"
+                on_record(symbol, {"symbol": symbol, "pruned": gate})
+        funnel_report(len(to_screen), pruned, len([s for s in symbols if s in keep]))
+        symbols = [s for s in symbols if s in keep or (s not in status)]
+
+    # Bước 1: fetch từng symbol song song (semaphore), H1/D1 còn cache thì không fetch lại
+    async def _fetch(symbol):
+        async with sem:
+            cached, requests = {}, []
+            for tf, limit in fetch_plan(ind_fields):
+                df = tf_cache.get_frame(symbol, tf, now_ts=now_epoch)
+                if df is None and tf == "1h":
+                    df = screened_h1.get(symbol)
+                if df is not None:
+                    cached[(symbol, tf)] = df
+                else:
+                    requests.append((symbol, tf, limit))
+            # từ vòng thứ 2 chỉ lấy nến mới (CandleStore)
+            got = await store.update_many(requests)
+        for (sym, tf), df in got.items():
+            tf_cache.put_frame(sym, tf, df, now_ts=now_epoch)
+        got.update(cached)
+        return got
+
+    # Symbol fetch xong trong batch_wait được tính chỉ báo chung một batch; symbol
+    # chậm hơn không giữ chân batch mà tự đi tiếp trong task riêng khi có dữ liệu.
+    frames = {}
+    fetch_tasks = {s: asyncio.ensure_future(_staged(s, "fetch", _fetch(s))) for s in symbols}
+    if fetch_tasks:
+        await asyncio.wait(fetch_tasks.values(), timeout=batch_wait)
+    ready, late = [], []
+    for symbol, task in fetch_tasks.items():
+        if not task.done():
+            late.append(symbol)
+        elif task.result() is not None:
+            frames.update(task.result())
+            ready.append(symbol)
+
+    # Bước 2: chỉ báo + vote (CPU) chạy trong worker pool để event loop không bị chặn
+    batch_ind = {}
+    if ready and (cfg.get("indicators") or {}).get("batch"):
+        t0 = time.perf_counter()
+        try:
+            batch_ind = await loop.run_in_executor(pool, batch_universe_indicators, cfg, ready, frames, ind_fields, tf_cache, now_epoch)
+        except Exception as e:
+            print(f"[WARN] batch indicators: {e!r}")
+        share = (time.perf_counter() - t0) / len(ready)
+        for symbol in ready:
+            cost[symbol] = share
+
+    def _expired(symbol):
+        # wait_for chỉ huỷ phía event loop; job trong pool vẫn chạy và giữ một worker,
+        # nên worker tự kiểm tra hạn trước mỗi phần nặng
+        if time.monotonic() >= deadlines[symbol]:
+            raise asyncio.TimeoutError
+
+    def _analyze(symbol):
+        _expired(symbol)
+        t0 = time.perf_counter()
+        prep = prepare_symbol(cfg, symbol, frames, ind_fields, tf_cache, batch_ind, now_epoch)
+        if prep is None:
+            return None, time.perf_counter() - t0
+        _expired(symbol)
+        rec = analyze_symbol(cfg, symbol, prep, vote_names)
+        return rec, time.perf_counter() - t0
+
+    # Bước 3: on_record (áp quyết định vào state dùng chung) chạy trên event loop
+    async def _evaluate(symbol):
+        async with sem:
+            rec, spent = await loop.run_in_executor(pool, _analyze, symbol)
+        cost[symbol] = cost.get(symbol, 0.0) + spent
+        if rec is None:
+            status[symbol] = "skipped"
+            return
+        on_record(symbol, rec)
+        status[symbol] = "ok"
+
+    async def _evaluate_late(symbol):
+        got = await fetch_tasks[symbol]
+        if got is not None:
+            frames.update(got)
+            await _staged(symbol, "evaluate", _evaluate(symbol))
+
+    await asyncio.gather(*(_staged(s, "evaluate", _evaluate(s)) for s in ready),
+                         *(_evaluate_late(s) for s in late))
+    return status, cost
+
+def pipeline_report(symbols, status: Dict[str, str], elapsed: float, cost: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """Gom trạng thái từng symbol của một lượt run_once và in một dòng [PIPELINE]."""
+    report = {"completed": [], "skipped": [], "pruned": [], "timeout": [], "failed": [], "elapsed_sec": round(elapsed, 3),
+              "cost_sec": {s: round(c, 4) for s, c in (cost or {}).items()}}
+    for symbol in symbols:
+        st = status.get(symbol, "timeout:evaluate")
+        if st == "ok":
+            report["completed"].append(symbol)
+        elif st in ("skipped", "pruned"):
+            report[st].append(symbol)
+        else:
+            report["timeout" if st.startswith("timeout") else "failed"].append(f"{symbol} ({st.split(':', 1)[1]})")
+    print(
+        f"[PIPELINE] xong {len(report['completed'])}/{len(symbols)} trong {report['elapsed_sec']}s"
+        + (f" | lọc H1: {len(report['pruned'])}" if report["pruned"] else "")
+        + (f" | bỏ qua: {', '.join(report['skipped'])}" if report["skipped"] else "")
+        + (f" | timeout: {', '.join(report['timeout'])}" if report["timeout"] else "")
+        + (f" | lỗi: {', '.join(report['failed'])}" if report["failed"] else "")
+    )
+    return report
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Lịch chạy theo giờ đóng nến thay cho poll cố định.
+
+Mỗi job (key, ví dụ symbol) gắn một timeframe; hạn chạy = giờ đóng nến kế tiếp
+của timeframe + grace_sec (chờ sàn chốt nến). Job được arm lại riêng khi chạy
+xong nên job chậm chỉ bỏ lỡ nến của chính nó, không đẩy lùi các job khác.
+"""
+import heapq
+import itertools
+import time
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from tf_cache import next_close_ts
+from data import timeframe_ms
+
+class BarCloseScheduler:
+    def __init__(self, grace_sec: float = 2.0):
+        self.grace_sec = float(grace_sec)
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._jobs: Dict[Hashable, Tuple[str, float]] = {}  # key -> (timeframe, due)
+        self._seq = itertools.count()
+        self.fired = 0
+        self.skipped = 0
+
+    def due_after(self, timeframe: str, now_ts: float) -> float:
+        """Hạn chạy kế tiếp: nến đóng gần nhất chưa qua grace, + grace."""
+        return next_close_ts(timeframe, now_ts - self.grace_sec) + self.grace_sec
+
+    def arm(self, key: Hashable, timeframe: str, now_ts: Optional[float] = None, run_now: bool = False) -> float:
+        """
+        Đặt (lại) hạn chạy của job (run_now: chạy ngay, ví dụ lúc khởi động); nến đã
+        lỡ trong lúc job chạy được đếm vào skipped.
+        """
+        if now_ts is None: now_ts = time.time()
+        due = now_ts if run_now else self.due_after(timeframe, now_ts)
+        prev = self._jobs.get(key)
+        if prev is not None and prev[1] < due:
+            tf_sec = timeframe_ms(prev[0]) / 1000.0
+            self.skipped += max(0, int(round((due - prev[1]) / tf_sec)) - 1)
+        self._jobs[key] = (timeframe, due)
+        heapq.heappush(self._heap, (due, next(self._seq), key))
+        return due
+
+    def disarm(self, key: Hashable):
+        self._jobs.pop(key, None)
+
+    def next_due(self) -> Optional[float]:
+        heap = self._heap
+        while heap and self._jobs.get(heap[0][2], (None, None))[1] != heap[0][0]:
+            heapq.heappop(heap)  # mục cũ của job đã arm lại / disarm
+        return heap[0][0] if heap else None
+
+    def pop_due(self, now_ts: Optional[float] = None) -> List[Tuple[Hashable, float]]:
+        """Các job tới hạn (key, due). Job giữ hạn cũ tới khi được arm lại."""
+        if now_ts is None: now_ts = time.time()
+        out = []
+        while True:
+            due = self.next_due()
+            if due is None or due > now_ts:
+                break
+            _, _, key = heapq.heappop(self._heap)
+            out.append((key, due))
+        self.fired += len(out)
+        return out
+
+    def closed_timeframes(self, due: float, timeframes: Iterable[str]) -> List[str]:
+        """Các timeframe có nến vừa đóng đúng tại lần chạy `due`."""
+        close_ms = int(round((due - self.grace_sec) * 1000))
+        return [tf for tf in timeframes if close_ms % timeframe_ms(tf) == 0]
+
+    def timeframe_of(self, key: Hashable) -> Optional[str]:
+        job = self._jobs.get(key)
+        return job[0] if job else None
+
+    def stats(self) -> Dict[str, int]:
+        return {"jobs": len(self._jobs), "fired": self.fired, "skipped": self.skipped}
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Chạy pipeline phân tích (fetch → chỉ báo → vote → gate) trên nhiều process.
+
+Coordinator (process của main) chia danh sách symbol thành shard, mỗi shard
+giao cho một worker process giữ event loop, CandleStore, cache và memo chỉ báo
+riêng qua các vòng. Worker chỉ trả về bản ghi quyết định gọn của
+pipeline.analyze_symbol; simulator, tracker, engine và thông báo vẫn chỉ nằm ở
+coordinator nên state không bị chia.
+
+ShardPlanner giữ symbol ở shard cũ (cache worker còn nóng), đo chi phí từng
+symbol (EWMA giây tính) và chỉ chia lại toàn bộ (LPT) khi shard nặng nhất vượt
+rebalance_ratio × tải trung bình.
+"""
+import asyncio
+import atexit
+import heapq
+import itertools
+import multiprocessing as mp
+import os
+import signal
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+class ShardPlanner:
+    def __init__(self, n_shards: int, alpha: float = 0.3, rebalance_ratio: float = 1.25):
+        self.n = max(1, int(n_shards))
+        self.alpha = float(alpha)
+        self.ratio = float(rebalance_ratio)
+        self.costs: Dict[str, float] = {}  # symbol -> EWMA chi phí (giây)
+        self.owner: Dict[str, int] = {}    # symbol -> shard
+        self.rebalances = 0
+
+    def observe(self, costs: Dict[str, float]):
+        for symbol, c in costs.items():
+            prev = self.costs.get(symbol)
+            self.costs[symbol] = float(c) if prev is None else prev + self.alpha * (float(c) - prev)
+
+    def cost(self, symbol: str) -> float:
+        """Chi phí ước lượng; symbol chưa đo lấy trung bình các symbol đã đo."""
+        c = self.costs.get(symbol)
+        if c is not None:
+            return c
+        return sum(self.costs.values()) / len(self.costs) if self.costs else 1.0
+
+    def loads(self, symbols: Iterable[str]) -> List[float]:
+        out = [0.0] * self.n
+        for symbol in symbols:
+            if symbol in self.owner:
+                out[self.owner[symbol]] += self.cost(symbol)
+        return out
+
+    def _lpt(self, symbols: List[str]) -> Dict[str, int]:
+        heap = [(0.0, k) for k in range(self.n)]
+        owner = {}
+        for symbol in sorted(symbols, key=lambda s: (-self.cost(s), s)):
+            load, k = heapq.heappop(heap)
+            owner[symbol] = k
+            heapq.heappush(heap, (load + self.cost(symbol), k))
+        return owner
+
+    def assign(self, symbols: Iterable[str]) -> List[List[str]]:
+        """Danh sách symbol của từng shard (giữ thứ tự symbols)."""
+        symbols = list(dict.fromkeys(symbols))
+        wanted = set(symbols)
+        for symbol in [s for s in self.owner if s not in wanted]:
+            del self.owner[symbol]
+        loads = self.loads(symbols)
+        for symbol in symbols:
+            if symbol not in self.owner:
+                k = min(range(self.n), key=loads.__getitem__)
+                self.owner[symbol] = k
+                loads[k] += self.cost(symbol)
+        mean = sum(loads) / self.n
+        if mean > 0 and max(loads) > self.ratio * mean:
+            owner = self._lpt(symbols)
+            new_loads = [0.0] * self.n
+            for symbol, k in owner.items():
+                new_loads[k] += self.cost(symbol)
+            if max(new_loads) < max(loads):
+                self.owner.update(owner)
+                self.rebalances += 1
+        shards = [[] for _ in range(self.n)]
+        for symbol in symbols:
+            shards[self.owner[symbol]].append(symbol)
+        return shards
+
+def _worker_main(conn, cfg: Dict[str, Any], initializer: Optional[Callable[[], None]] = None):
+    """Vòng lặp worker: nhận ("run", seq, symbols, now_epoch, keep), trả (seq, records, status, cost)."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C do coordinator xử lý
+    from data import close_async_fetcher
+    from pipeline import analyze_universe
+    from timing import get_stage_timer
+    if initializer is not None:
+        initializer()
+    # mỗi worker ghi timing ra file riêng: <path>.<shard-k>.json
+    tcfg = dict(cfg.get("timing") or {})
+    root, ext = os.path.splitext(tcfg.get("path", "stage_timing.json"))
+    timer = get_stage_timer(dict(cfg, timing=dict(tcfg, path=f"{root}.{mp.current_process().name}{ext}")))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            if msg[0] == "stop":
+                break
+            _, seq, symbols, now_epoch, keep = msg
+            records = []
+            try:
+                status, cost = loop.run_until_complete(
+                    analyze_universe(cfg, symbols, now_epoch, lambda s, rec: records.append((s, rec)), keep))
+            except Exception as e:
+                status, cost = {s: f"failed:shard:{e!r}" for s in symbols}, {}
+            timer.end_iteration(symbols)
+            conn.send((seq, records, status, cost))
+    finally:
+        timer.dump()
+        loop.run_until_complete(close_async_fetcher())
+        loop.close()
+
+def _recv(conn, seq: int, timeout: float):
+    """Chờ reply đúng seq (bỏ reply trễ của lượt trước); None nếu hết giờ."""
+    deadline = time.monotonic() + timeout
+    while True:
+        left = deadline - time.monotonic()
+        if left <= 0 or not conn.poll(left):
+            return None
+        reply = conn.recv()
+        if reply[0] == seq:
+            return reply
+
+class ShardPool:
+    def __init__(self, cfg: Dict[str, Any], workers: Optional[int] = None,
+                 initializer: Optional[Callable[[], None]] = None):
+        scfg = cfg.get("sharding") or {}
+        self.cfg = cfg
+        self.n = max(1, int(workers if workers is not None else scfg.get("workers", 4)))
+        self.initializer = initializer
+        # worker tự áp hạn symbol_timeout_sec cho từng symbol; thêm grace cho batch + IPC
+        self.timeout = float((cfg.get("pipeline") or {}).get("symbol_timeout_sec", 20)) + float(scfg.get("reply_grace_sec", 10))
+        self.planner = ShardPlanner(self.n, alpha=float(scfg.get("cost_alpha", 0.3)),
+                                    rebalance_ratio=float(scfg.get("rebalance_ratio", 1.25)))
+        self._ctx = mp.get_context("spawn")
+        self._workers: List[Optional[Tuple[Any, Any]]] = [None] * self.n
+        self._seq = itertools.count(1)
+        self.restarts = 0
+
+    def _worker(self, k: int):
+        w = self._workers[k]
+        if w is not None and w[0].is_alive():
+            return w
+        if w is not None:
+            self.restarts += 1
+            print(f"[SHARD] Worker {k} đã dừng (exitcode={w[0].exitcode}), khởi động lại")
+            w[1].close()
+        parent, child = self._ctx.Pipe()
+        proc = self._ctx.Process(target=_worker_main, args=(child, self.cfg, self.initializer),
+                                 name=f"shard-{k}", daemon=True)
+        proc.start()
+        child.close()
+        self._workers[k] = (proc, parent)
+        return self._workers[k]
+
+    async def run(self, symbols: List[str], now_epoch: float,
+                  on_record: Callable[[str, Dict[str, Any]], None],
+                  keep: Iterable[str] = ()) -> Tuple[Dict[str, str], Dict[str, float]]:
+        """
+        Như pipeline.analyze_universe nhưng chạy trên các worker; bản ghi của một shard
+        được áp (on_record, trên event loop này) ngay khi shard đó trả về.
+        """
+        loop = asyncio.get_running_loop()
+        status: Dict[str, str] = {}
+        costs: Dict[str, float] = {}
+        keep = set(keep)
+
+        async def _shard(k, part):
+            seq = next(self._seq)
+            try:
+                _, conn = self._worker(k)
+                conn.send(("run", seq, part, now_epoch, [s for s in part if s in keep]))
+                reply = await loop.run_in_executor(None, _recv, conn, seq, self.timeout)
+            except (EOFError, OSError) as e:
+                status.update({s: f"failed:shard:{e!r}" for s in part})
+                return
+            if reply is None:
+                status.update({s: "timeout:shard" for s in part})
+                return
+            _, records, st, cost = reply
+            status.update(st)
+            costs.update(cost)
+            for symbol, rec in records:
+                try:
+                    on_record(symbol, rec)
+                except Exception as e:
+                    status[symbol] = f"failed:apply:{e!r}"
+
+        await asyncio.gather(*(_shard(k, part) for k, part in enumerate(self.planner.assign(symbols)) if part))
+        self.planner.observe(costs)
+        return status, costs
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.n, "restarts": self.restarts, "rebalances": self.planner.rebalances,
+                "loads": [round(x, 4) for x in self.planner.loads(self.planner.owner)]}
+
+    def close(self, timeout: float = 5.0):
+        for k, w in enumerate(self._workers):
+            if w is None:
+                continue
+            proc, conn = w
+            try:
+                conn.send(("stop",))
+            except (EOFError, OSError):
+                pass
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+            conn.close()
+            self._workers[k] = None
+
+_pool: Optional[ShardPool] = None
+
+def get_shard_pool(cfg: Dict[str, Any]) -> Optional[ShardPool]:
+    """Pool dùng chung theo cfg["sharding"]; None nếu chưa bật (run_once phân tích tại chỗ)."""
+    global _pool
+    if _pool is None:
+        if not (cfg.get("sharding") or {}).get("enabled", False):
+            return None
+        _pool = ShardPool(cfg)
+        atexit.register(_pool.close)
+    return _pool
+
+def close_shard_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+__all__ = ["ShardPlanner", "ShardPool", "get_shard_pool", "close_shard_pool"]
@@ -1,9 +1,15 @@
 import json
 import os
 
+from state_store import current_state_store
+
 LAST_SIGNAL_FILE = "last_signal.json"
 
 def load_last_signal():
+    store = current_state_store()
+    if store is not None:
+        store.migrate_json("last_signal", LAST_SIGNAL_FILE)
+        return store.load("last_signal")
     if not os.path.exists(LAST_SIGNAL_FILE):
         return {}
     with open(LAST_SIGNAL_FILE, "r") as f:
@@ -13,5 +19,9 @@ def load_last_signal():
             return {}
 
 def save_last_signal(state):
+    store = current_state_store()
+    if store is not None:
+        store.sync("last_signal", state or {})
+        return
     with open(LAST_SIGNAL_FILE, "w") as f:
         json.dump(state, f)
@@ -32,11 +32,8 @@ def generate_signal(
     # Lấy weights theo timeframe hiện tại
     tf_raw = config.get('timeframe') or 'M15'
     tf_key = 'M15' if str(tf_raw).lower() in ['15m', 'm15', '15', 'm15'] else 'H1'
-    weights_sets = config.get('weights_sets', {}) or {}
-    weights = weights_sets.get(tf_key, {})
-
-    from votes import tally_votes
-    vote_result = tally_votes(indicator_results or {}, weights)
+    from votes import get_vote_scorer
+    vote_result = get_vote_scorer(config, tf_key).score(indicator_results or {})
 
     score_long = float(vote_result.get("score_long", 0.0))
     score_short = float(vote_result.get("score_short", 0.0))
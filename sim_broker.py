@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Broker mô phỏng khớp lệnh cục bộ (cùng interface PaperBroker: now, place_limit)
+chạy theo luồng trade/tick (ghi lại hoặc tổng hợp) thay vì giá close được poll.
+
+- Độ trễ gửi lệnh: lệnh chỉ vào sổ sau latency_ms tính từ lúc đặt (trạng thái
+  "pending"); lệnh LONG/SHORT đã chạm giá ngay khi vào sổ khớp như taker tại giá
+  trade cuối (+/- slippage_bps), không vượt giá limit.
+- Vị trí trong hàng đợi: lệnh maker đứng sau queue_ahead_mult × size khối lượng
+  ở cùng mức giá; trade đúng bằng giá limit tiêu hàng đợi trước rồi mới khớp,
+  trade xuyên qua mức giá khớp ngay. Khớp từng phần theo khối lượng trade.
+- TTL: tới expires_at phần chưa khớp bị huỷ (status "expired", hoặc "filled" nếu
+  đã khớp đủ). market_fill() cho fallback thị trường có trượt giá.
+
+Mỗi symbol có sổ lệnh và hàng đợi sự kiện (vào sổ / hết hạn) riêng nên có thể
+replay từng symbol độc lập. replay_arrays() bỏ qua bằng numpy các đoạn tick
+không chạm lệnh nào → replay cả ngày tick cho nhiều symbol trong vài giây.
+"""
+import bisect
+import csv
+import heapq
+import itertools
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+_EPS = 1e-12
+_INF = float("inf")
+
+class SimBroker:
+    simulated = True
+
+    def __init__(self, cfg: Dict):
+        self.cfg = cfg or {}
+        scfg = (self.cfg.get("trading") or {}).get("sim") or {}
+        self.latency = float(scfg.get("latency_ms", 50)) / 1000.0
+        self.slippage_bps = float(scfg.get("slippage_bps", 2.0))
+        self.queue_mult = float(scfg.get("queue_ahead_mult", 1.0))
+        self._id = itertools.count(1)
+        self._seq = itertools.count()
+        self._clock = 0.0
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        self._timers: Dict[str, list] = {}   # symbol -> heap (ts, seq, kind, oid)
+        self._books: Dict[str, Dict[str, list]] = {}  # symbol -> side -> [(key, seq, oid)] tốt nhất trước
+        self._last: Dict[str, float] = {}
+        self.trades_seen = 0
+        self.fills = 0
+
+    def now(self) -> float:
+        """Đồng hồ mô phỏng (ts trade mới nhất); chưa có trade thì dùng giờ thật."""
+        return self._clock or time.time()
+
+    # ---- lệnh ----
+    def place_limit(self, symbol: str, side: str, price: float, size: float, ttl_sec: int = 30) -> Dict[str, Any]:
+        oid = f"sim_{next(self._id)}"
+        now = self.now()
+        od = {
+            "id": oid,
+            "symbol": symbol,
+            "side": side,
+            "type": "limit",
+            "price": float(price),
+            "size": float(size),
+            "status": "open",
+            "created_at": float(now),
+            "expires_at": float(now + max(1, int(ttl_sec))),
+        }
+        self.orders[oid] = dict(od, status="pending", filled_size=0.0, avg_price=None,
+                                queue_ahead=self.queue_mult * float(size))
+        heap = self._timers.setdefault(symbol, [])
+        heapq.heappush(heap, (now + self.latency, next(self._seq), "arrive", oid))
+        heapq.heappush(heap, (od["expires_at"], next(self._seq), "expire", oid))
+        return od
+
+    def order_update(self, order_id: str) -> Optional[Dict[str, Any]]:
+        """Trạng thái hiện tại của lệnh: status, filled_size, avg_price."""
+        od = self.orders.get(order_id)
+        if od is None:
+            return None
+        return {"status": od["status"], "filled_size": od["filled_size"], "avg_price": od["avg_price"]}
+
+    def cancel(self, order_id: str) -> bool:
+        od = self.orders.get(order_id)
+        if od is None or od["status"] not in ("pending", "open"):
+            return False
+        self._close(od, "canceled")
+        return True
+
+    def market_fill(self, symbol: str, side: str, size: float, ref_price: Optional[float] = None) -> float:
+        """Giá khớp lệnh thị trường: trade cuối (hoặc ref_price) cộng trượt giá."""
+        px = float(self._last.get(symbol, ref_price if ref_price is not None else 0.0))
+        slip = px * self.slippage_bps / 1e4
+        self.fills += 1
+        return px + slip if side == "LONG" else px - slip
+
+    # ---- nội bộ sổ lệnh ----
+    def _book(self, symbol: str, side: str) -> list:
+        return self._books.setdefault(symbol, {"LONG": [], "SHORT": []})[side]
+
+    def _close(self, od: Dict[str, Any], status: str):
+        if od["status"] == "open":
+            book = self._book(od["symbol"], od["side"])
+            for i, (_, _, oid) in enumerate(book):
+                if oid == od["id"]:
+                    del book[i]
+                    break
+        od["status"] = status
+
+    def _fill(self, od: Dict[str, Any], qty: float, px: float):
+        done = od["filled_size"]
+        od["avg_price"] = px if not done else (od["avg_price"] * done + px * qty) / (done + qty)
+        od["filled_size"] = done + qty
+        self.fills += 1
+        if od["filled_size"] >= od["size"] - _EPS:
+            od["filled_size"] = od["size"]
+            self._close(od, "filled")
+
+    def _arrive(self, od: Dict[str, Any]):
+        if od["status"] != "pending":
+            return
+        last = self._last.get(od["symbol"])
+        limit = od["price"]
+        if last is not None and (last <= limit if od["side"] == "LONG" else last >= limit):
+            # đã chạm giá khi vào sổ → khớp như taker, không tệ hơn giá limit
+            slip = last * self.slippage_bps / 1e4
+            px = min(limit, last + slip) if od["side"] == "LONG" else max(limit, last - slip)
+            od["status"] = "open"
+            self._fill(od, od["size"], px)
+            if od["status"] == "filled":
+                return
+        od["status"] = "open"
+        key = -limit if od["side"] == "LONG" else limit
+        bisect.insort(self._book(od["symbol"], od["side"]), (key, next(self._seq), od["id"]))
+
+    def _run_timers(self, symbol: str, ts: float):
+        heap = self._timers.get(symbol)
+        while heap and heap[0][0] <= ts:
+            _, _, kind, oid = heapq.heappop(heap)
+            od = self.orders[oid]
+            if kind == "arrive":
+                self._arrive(od)
+            elif od["status"] in ("pending", "open"):
+                self._close(od, "expired")
+
+    def _match(self, symbol: str, price: float, qty: float):
+        books = self._books.get(symbol)
+        if not books:
+            return
+        for side in ("LONG", "SHORT"):
+            book = books[side]
+            avail = qty
+            while book and avail > _EPS:
+                key, _, oid = book[0]
+                limit = -key if side == "LONG" else key
+                if (price > limit) if side == "LONG" else (price < limit):
+                    break
+                od = self.orders[oid]
+                if price == limit and od["queue_ahead"] > 0:
+                    q = min(od["queue_ahead"], avail)
+                    od["queue_ahead"] -= q
+                    avail -= q
+                    if avail <= _EPS:
+                        break
+                take = min(od["size"] - od["filled_size"], avail)
+                avail -= take
+                self._fill(od, take, limit)
+                if od["status"] == "open":
+                    break  # khớp một phần: hết khối lượng trade
+
+    def _next_timer(self, symbol: str) -> float:
+        heap = self._timers.get(symbol)
+        return heap[0][0] if heap else _INF
+
+    def _bounds(self, symbol: str) -> Tuple[float, float]:
+        """(giá LONG tốt nhất, giá SHORT tốt nhất) đang nằm trong sổ."""
+        books = self._books.get(symbol) or {}
+        lb, sb = books.get("LONG"), books.get("SHORT")
+        return (-lb[0][0] if lb else -_INF), (sb[0][0] if sb else _INF)
+
+    # ---- nạp trade ----
+    def on_trade(self, symbol: str, ts: float, price: float, qty: Optional[float] = None):
+        """Một trade: chạy sự kiện tới ts, khớp các lệnh trong sổ; qty None = không giới hạn."""
+        ts = float(ts)
+        if ts > self._clock:
+            self._clock = ts
+        self.trades_seen += 1
+        heap = self._timers.get(symbol)
+        if heap and heap[0][0] <= ts:
+            self._run_timers(symbol, ts)
+        self._match(symbol, float(price), _INF if qty is None else float(qty))
+        self._last[symbol] = float(price)
+
+    def observe(self, symbol: str, ts: float, price: float):
+        """
+        Giá poll (close/ticker) của engine khi không có luồng trade: như một trade
+        không giới hạn khối lượng tại ts. Nếu luồng trade đã đi trước ts thì chỉ chạy
+        sự kiện (vào sổ/hết hạn) tới đồng hồ hiện tại, không khớp bằng giá cũ.
+        """
+        ts = float(ts)
+        if ts < self._clock:
+            self._run_timers(symbol, self._clock)
+            return
+        self.on_trade(symbol, ts, price)
+
+    def replay(self, trades: Iterable[Tuple[float, str, float, Optional[float]]]) -> int:
+        """Replay luồng (ts, symbol, price, qty) đã sắp theo ts."""
+        n = 0
+        for ts, symbol, price, qty in trades:
+            self.on_trade(symbol, ts, price, qty)
+            n += 1
+        return n
+
+    def replay_arrays(self, symbol: str, ts, price, qty=None, until: Optional[float] = None,
+                      chunk: int = 4096) -> int:
+        """
+        Replay tick của một symbol từ mảng (ts giây, price, qty) đã sắp theo ts, tới
+        ts <= until nếu có. Chỉ các tick có thể đổi trạng thái (tới hạn sự kiện hoặc
+        chạm lệnh trong sổ) đi qua on_trade; đoạn còn lại chỉ cập nhật giá cuối.
+        Trả về chỉ số tick kế tiếp chưa xử lý.
+        """
+        ts = np.asarray(ts, dtype=np.float64)
+        px = np.asarray(price, dtype=np.float64)
+        q = None if qty is None else np.asarray(qty, dtype=np.float64)
+        end = len(ts) if until is None else int(np.searchsorted(ts, until, side="right"))
+        i = 0
+        while i < end:
+            t_next = self._next_timer(symbol)
+            lb, sb = self._bounds(symbol)
+            j = min(i + chunk, end)
+            hit = (ts[i:j] >= t_next) | (px[i:j] <= lb) | (px[i:j] >= sb)
+            k = int(np.argmax(hit)) if hit.any() else -1
+            if k < 0:
+                # không tick nào trong đoạn chạm lệnh/sự kiện
+                self._last[symbol] = float(px[j - 1])
+                self._clock = max(self._clock, float(ts[j - 1]))
+                self.trades_seen += j - i
+                i = j
+                continue
+            if k > 0:
+                self._last[symbol] = float(px[i + k - 1])
+                self.trades_seen += k
+            i += k
+            self.on_trade(symbol, ts[i], px[i], None if q is None else q[i])
+            i += 1
+        return i
+
+def synthetic_trades(n: int, start_ts: float = 0.0, price: float = 100.0, step_sec: float = 1.0,
+                     vol_bps: float = 5.0, mean_qty: float = 1.0, seed: Optional[int] = None):
+    """Luồng trade tổng hợp (random walk): mảng (ts, price, qty)."""
+    rng = np.random.default_rng(seed)
+    ts = start_ts + np.arange(n, dtype=np.float64) * step_sec
+    px = price * np.exp(np.cumsum(rng.normal(0.0, vol_bps / 1e4, n)))
+    qty = rng.exponential(mean_qty, n)
+    return ts, np.round(px, 6), qty
+
+def load_trades_csv(path: str, ts_col: str = "ts", price_col: str = "price", qty_col: str = "qty"):
+    """Trade ghi lại từ CSV (ts giây hoặc ms) → mảng (ts giây, price, qty) sắp theo ts."""
+    with open(path, "r", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    ts = np.array([float(r[ts_col]) for r in rows], dtype=np.float64)
+    if len(ts) and ts.max() > 1e11:
+        ts = ts / 1000.0
+    px = np.array([float(r[price_col]) for r in rows], dtype=np.float64)
+    qty = np.array([float(r.get(qty_col) or "nan") for r in rows], dtype=np.float64)
+    qty = np.where(np.isnan(qty), np.inf, qty)
+    order = np.argsort(ts, kind="stable")
+    return ts[order], px[order], qty[order]
+
+__all__ = ["SimBroker", "synthetic_trades", "load_trades_csv"]
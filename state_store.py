@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Kho trạng thái nhúng (SQLite, WAL) dùng chung cho bot: trade state của
+ExecutionEngine, gate state của StablePassTracker, cooldown và last signal.
+
+Mỗi thành phần là một bảng (key TEXT PRIMARY KEY, value JSON, updated_at).
+sync() chỉ ghi các dòng đổi so với lần ghi trước; trong `with store.batch():`
+mọi lần ghi của một vòng gom vào một transaction. Batch gắn với context của
+asyncio task (contextvars): các task chạy song song (risk loop, housekeeping,
+lượt phân tích) mỗi bên commit phần của mình khi ra khối, không chờ nhau. WAL cho phép dashboard đọc
+song song (mở read-only) mà không chặn hay ghi đè bot.
+
+Khi không bật store, StateJournal giữ trade state bằng snapshot JSON + journal
+append-only để mỗi lần lưu chỉ tốn phần đã đổi.
+"""
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+TABLES = ("trade_state", "gate_state", "cooldown", "last_signal")
+
+def atomic_write(path: str, text: str):
+    """Ghi file qua file tạm cùng thư mục rồi os.replace: reader không bao giờ thấy file ghi dở."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+class StateStore:
+    def __init__(self, path: str = "bot_state.db", busy_timeout_ms: int = 5000):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=busy_timeout_ms / 1000.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        for t in TABLES:
+            self._ensure(t)
+        self._written: Dict[Tuple[str, Any], Dict[str, str]] = {}  # (table, owner) -> dòng đã ghi
+        # danh sách ghi chờ của batch đang mở trong context hiện tại (None: ghi thẳng)
+        self._batch = contextvars.ContextVar(f"state_batch_{id(self)}", default=None)
+        self.commits = 0
+        self.rows_written = 0
+
+    def _ensure(self, table: str):
+        if not table.isidentifier():
+            raise ValueError(f"Tên bảng không hợp lệ: {table!r}")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    # ---- đọc ----
+    def load(self, table: str, owner: Any = None) -> Dict[str, Any]:
+        """Đọc cả bảng; đồng thời là mốc so sánh cho sync() của writer `owner`."""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT key, value FROM {table}").fetchall()
+        self._written[(table, owner)] = {k: v for k, v in rows}
+        return {k: json.loads(v) for k, v in rows}
+
+    def get(self, table: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {table} WHERE key=?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def count(self, table: str) -> int:
+        with self._lock:
+            return int(self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0])
+
+    # ---- ghi ----
+    def write(self, table: str, upserts: Dict[str, Any] = None, deletes: Iterable[str] = ()):
+        """Upsert/xoá theo key; trong batch() thì hoãn tới cuối batch."""
+        now = time.time()
+        ups = [(k, v if isinstance(v, str) else _dumps(v), now) for k, v in (upserts or {}).items()]
+        dels = [(k,) for k in deletes]
+        if not ups and not dels:
+            return
+        pending = self._batch.get()
+        if pending is not None:
+            pending.append((table, ups, dels))
+            return
+        with self._lock:
+            self._commit([(table, ups, dels)])
+
+    def sync(self, table: str, rows: Dict[str, Any], owner: Any = None):
+        """
+        Đưa phần bảng của writer `owner` về đúng `rows`: chỉ ghi dòng đổi so với lần
+        load/sync trước của chính writer đó, chỉ xoá dòng writer đó từng thấy. Nhiều
+        writer cùng bảng (mỗi writer một owner) không xoá/ghi đè dòng của nhau.
+        """
+        last = self._written.get((table, owner))
+        if last is None:
+            self.load(table, owner)
+            last = self._written[(table, owner)]
+        enc = {k: _dumps(v) for k, v in rows.items()}
+        ups = {k: v for k, v in enc.items() if last.get(k) != v}
+        dels = [k for k in last if k not in enc]
+        self._written[(table, owner)] = enc
+        self.write(table, ups, dels)
+
+    def _commit(self, pending):
+        if not pending:
+            return
+        cur = self._conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for table, ups, dels in pending:
+                if ups:
+                    cur.executemany(
+                        f"INSERT INTO {table}(key, value, updated_at) VALUES(?,?,?) "
+                        "ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at",
+                        ups,
+                    )
+                if dels:
+                    cur.executemany(f"DELETE FROM {table} WHERE key=?", dels)
+                self.rows_written += len(ups) + len(dels)
+            cur.execute("COMMIT")
+            self.commits += 1
+        except Exception:
+            cur.execute("ROLLBACK")
+            self._forget({table for table, _, _ in pending})  # lần sync sau đọc lại từ DB
+            raise
+
+    def _forget(self, tables):
+        for key in [k for k in self._written if k[0] in tables]:
+            del self._written[key]
+
+    @contextmanager
+    def batch(self):
+        """
+        Gom mọi lần ghi trong khối (của task hiện tại và các task nó tạo trong khối)
+        vào một transaction; khối lồng nhau gộp vào khối ngoài cùng.
+        """
+        if self._batch.get() is not None:
+            yield self
+            return
+        pending = []
+        token = self._batch.set(pending)
+        try:
+            yield self
+        finally:
+            self._batch.reset(token)
+            with self._lock:
+                self._commit(pending)
+
+    # ---- migrate từ file JSON cũ ----
+    def migrate_json(self, table: str, path: str, to_rows: Optional[Callable[[Any], Dict[str, Any]]] = None) -> int:
+        """
+        Nạp file JSON cũ vào bảng nếu bảng còn trống, rồi đổi tên file thành
+        `<path>.migrated`. Trả về số dòng đã nạp.
+        """
+        if not path or not os.path.exists(path) or self.count(table):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"[WARN] Không migrate được {path}: {e!r}")
+            return 0
+        rows = to_rows(data) if to_rows else dict(data or {})
+        self.write(table, rows)
+        self._forget((table,))
+        os.replace(path, f"{path}.migrated")
+        print(f"[STATE] Migrate {path} → {self.path}:{table} ({len(rows)} dòng)")
+        return len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"commits": self.commits, "rows_written": self.rows_written,
+                **{t: self.count(t) for t in TABLES}}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# trade_state là dict lồng ({"positions": {...}, "orders": {...}, ...}): mỗi
+# phần tử con là một dòng "section/key", giá trị top-level không phải dict giữ key gốc.
+def flatten_sections(state: Dict[str, Any]) -> Dict[str, Any]:
+    rows = {}
+    for section, value in (state or {}).items():
+        if isinstance(value, dict):
+            rows[f"{section}/"] = {}  # giữ section rỗng
+            for k, v in value.items():
+                rows[f"{section}/{k}"] = v
+        else:
+            rows[section] = value
+    return rows
+
+def unflatten_sections(rows: Dict[str, Any]) -> Dict[str, Any]:
+    state: Dict[str, Any] = {}
+    for key in sorted(rows):
+        section, sep, sub = key.partition("/")
+        if not sep:
+            state[key] = rows[key]
+        elif sub:
+            state.setdefault(section, {})[sub] = rows[key]
+        else:
+            state.setdefault(section, {})
+    return state
+
+class StateJournal:
+    """
+    State dạng dòng "section/key" (flatten_sections) lưu bằng snapshot + journal:
+    record() chỉ append một dòng JSON gọn cho mỗi dòng đổi/xoá vào `<path>.journal`;
+    sau snapshot_every bản ghi thì ghi snapshot (atomic) ra `path` và cắt journal.
+    load() = snapshot mới nhất + phát lại journal (dòng cuối ghi dở bị bỏ qua). Bản
+    ghi là giá trị tuyệt đối nên phát lại phần đã có trong snapshot vẫn ra đúng state.
+    """
+    def __init__(self, path: str, snapshot_every: int = 500):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.snapshot_every = max(1, int(snapshot_every))
+        self._rows: Dict[str, str] = {}
+        self._since_snapshot = 0
+        self._fh = None
+        self.records = 0
+        self.snapshots = 0
+
+    def load(self) -> Dict[str, Any]:
+        state = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    state = json.load(f) or {}
+            except Exception as e:
+                print(f"[WARN] Snapshot {self.path} lỗi: {e!r}")
+        rows = flatten_sections(state)
+        n = 0
+        if os.path.exists(self.journal_path):
+            good = 0
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("dòng chưa ghi xong")
+                        rec = json.loads(line)
+                    except ValueError:
+                        break  # dòng cuối ghi dở khi crash
+                    if rec.get("d"):
+                        rows.pop(rec["k"], None)
+                    else:
+                        rows[rec["k"]] = rec["v"]
+                    good += len(line)
+                    n += 1
+            if good < os.path.getsize(self.journal_path):
+                # cắt phần ghi dở để bản ghi append sau không dính vào nó
+                os.truncate(self.journal_path, good)
+        self._rows = {k: _dumps(v) for k, v in rows.items()}
+        self._since_snapshot = n
+        return unflatten_sections(rows)
+
+    def record(self, rows: Dict[str, Any]) -> int:
+        """Append bản ghi cho các dòng khác lần trước; trả về số bản ghi."""
+        enc = {k: _dumps(v) for k, v in rows.items()}
+        last = self._rows
+        lines = [f'{{"k":{json.dumps(k, ensure_ascii=False)},"v":{v}}}' for k, v in enc.items() if last.get(k) != v]
+        lines += [json.dumps({"k": k, "d": 1}, ensure_ascii=False) for k in last if k not in enc]
+        self._rows = enc
+        if not lines:
+            return 0
+        if self._fh is None:
+            self._fh = open(self.journal_path, "a", encoding="utf-8")
+        self._fh.write("\n".join(lines) + "\n")
+        self._fh.flush()
+        self.records += len(lines)
+        self._since_snapshot += len(lines)
+        if self._since_snapshot >= self.snapshot_every:
+            self.snapshot()
+        return len(lines)
+
+    def snapshot(self):
+        state = unflatten_sections({k: json.loads(v) for k, v in self._rows.items()})
+        atomic_write(self.path, json.dumps(state, ensure_ascii=False, separators=(",", ":")))
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        open(self.journal_path, "w").close()
+        self._since_snapshot = 0
+        self.snapshots += 1
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+_store: Optional[StateStore] = None
+
+def get_state_store(cfg: Optional[Dict] = None) -> Optional[StateStore]:
+    """Store dùng chung theo cfg["state_store"]; None nếu chưa bật (các thành phần dùng file JSON)."""
+    global _store
+    if _store is None:
+        scfg = (cfg or {}).get("state_store") or {}
+        if not scfg.get("enabled", False):
+            return None
+        _store = StateStore(path=scfg.get("path", "bot_state.db"),
+                            busy_timeout_ms=int(scfg.get("busy_timeout_ms", 5000)))
+    return _store
+
+def current_state_store() -> Optional[StateStore]:
+    """Store đã mở (nếu có), cho module không có cfg như signal_state."""
+    return _store
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+"""
+Engine chỉ báo dạng streaming: giữ state đệ quy theo (symbol, timeframe) và cập
+nhật O(1) mỗi khi có nến đóng hoặc nến đang chạy thay đổi.
+
+Công thức bám sát calculate_indicators (thư viện ta + pandas): EMA adjust=False,
+Wilder cho RSI/ATR/ADX (kể cả cách seed của ta), cửa sổ trượt cho SMA/Bollinger/
+CMF/volume spike/range, Supertrend theo vòng lặp gốc. Khi stream bắt đầu cùng nến
+đầu của frame, kết quả khớp calculate_indicators với sai số
+|a - b| <= 1e-6 * max(1, |b|); các chỉ báo rời rạc (supertrend, range_filter,
+volume_spike) khớp tuyệt đối.
+
+Lưu ý: EMA/VWAP/ADX phụ thuộc điểm bắt đầu stream, nên giá trị của stream chạy
+lâu sẽ khác calculate_indicators trên cửa sổ 300 nến trượt.
+"""
+import math
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+NAN = float("nan")
+
+INDICATOR_KEYS = (
+    "ema200", "ma50", "macd", "macd_signal", "rsi", "adx", "vwap", "supertrend",
+    "range_filter", "atr", "chaikin_mf", "volume_spike", "stoch_rsi",
+    "bollinger_bands_upper", "bollinger_bands_lower", "bollinger_bands_mid", "bollinger_bands",
+)
+
+def _div(a: float, b: float) -> float:
+    """Chia kiểu numpy: x/0 → ±inf, 0/0 hoặc NaN → NaN."""
+    if a != a or b != b:
+        return NAN
+    if b == 0:
+        return NAN if a == 0 else math.copysign(math.inf, a) * math.copysign(1.0, b)
+    return a / b
+
+class _Ema:
+    """EMA adjust=False, bỏ qua NaN ở đầu chuỗi như pandas ewm."""
+    __slots__ = ("alpha", "min_periods", "value", "count")
+
+    def __init__(self, alpha: float, min_periods: int):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.value = None
+        self.count = 0
+
+    def step(self, x: float, commit: bool) -> float:
+        if x != x:
+            return self.value if self.value is not None and self.count >= self.min_periods else NAN
+        v = x if self.value is None else self.alpha * x + (1.0 - self.alpha) * self.value
+        c = self.count + 1
+        if commit:
+            self.value, self.count = v, c
+        return v if c >= self.min_periods else NAN
+
+class _Window:
+    """Cửa sổ trượt `size` giá trị; tổng chạy được tính lại mỗi `size` lần commit để không trôi số."""
+    __slots__ = ("size", "vals", "total", "nans", "_since_resum")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.vals = deque()
+        self.total = 0.0
+        self.nans = 0
+        self._since_resum = 0
+
+    def _next(self, x: float) -> Tuple[float, int, bool]:
+        """(tổng, số NaN, đủ cửa sổ) của cửa sổ sau khi thêm x."""
+        total, nans = self.total, self.nans
+        if x == x: total += x
+        else: nans += 1
+        full = len(self.vals) + 1 >= self.size
+        if len(self.vals) == self.size:
+            old = self.vals[0]
+            if old == old: total -= old
+            else: nans -= 1
+        return total, nans, full
+
+    def push(self, x: float):
+        total, nans, _ = self._next(x)
+        self.vals.append(x)
+        if len(self.vals) > self.size:
+            self.vals.popleft()
+        self.total, self.nans = total, nans
+        self._since_resum += 1
+        if self._since_resum >= self.size:
+            self.total = math.fsum(v for v in self.vals if v == v)
+            self._since_resum = 0
+
+    def values(self, x: float):
+        vals = list(self.vals)
+        if len(vals) == self.size:
+            vals = vals[1:]
+        vals.append(x)
+        return vals
+
+    def mean(self, x: float) -> float:
+        total, nans, full = self._next(x)
+        return total / self.size if full and nans == 0 else NAN
+
+    def sum(self, x: float) -> float:
+        total, nans, full = self._next(x)
+        return total if full and nans == 0 else NAN
+
+    def std(self, x: float) -> float:
+        total, nans, full = self._next(x)
+        if not full or nans:
+            return NAN
+        m = total / self.size
+        return math.sqrt(sum((v - m) ** 2 for v in self.values(x)) / self.size)
+
+    def min(self, x: float) -> float:
+        _, nans, full = self._next(x)
+        return min(self.values(x)) if full and nans == 0 else NAN
+
+    def max(self, x: float) -> float:
+        _, nans, full = self._next(x)
+        return max(self.values(x)) if full and nans == 0 else NAN
+
+class _WilderAtr:
+    """ATR của ta: 0 cho tới nến window-1, seed bằng trung bình TR rồi làm mượt Wilder."""
+    __slots__ = ("window", "seed", "value", "count")
+
+    def __init__(self, window: int):
+        self.window = window
+        self.seed = 0.0
+        self.value = 0.0
+        self.count = 0
+
+    def step(self, tr: float, commit: bool) -> float:
+        w = self.window
+        c = self.count + 1
+        seed, value = self.seed, self.value
+        if c < w:
+            seed += tr
+            out = 0.0
+        elif c == w:
+            seed += tr
+            value = out = seed / w
+        else:
+            value = out = (value * (w - 1) + tr) / w
+        if commit:
+            self.seed, self.value, self.count = seed, value, c
+        return out
+
+class _Adx:
+    """ADX của ta.trend.adx, bao gồm cách seed tổng 14 nến đầu và trung bình 14 DX đầu."""
+    __slots__ = ("window", "count", "trs", "dip", "din", "dx_seed", "adx")
+
+    def __init__(self, window: int = 14):
+        self.window = window
+        self.count = 0
+        self.trs = self.dip = self.din = 0.0
+        self.dx_seed = []
+        self.adx = 0.0
+
+    def step(self, tr: float, pos: float, neg: float, commit: bool) -> float:
+        """Nhận TR/+DM/-DM của nến k >= 1 (k = count + 1)."""
+        w = self.window
+        k = self.count + 1
+        trs, dip, din, adx = self.trs, self.dip, self.din, self.adx
+        dx_seed = self.dx_seed
+        out = 0.0
+        if k <= w:
+            trs += tr; dip += pos; din += neg
+        else:
+            trs = trs - trs / w + tr
+            dip = dip - dip / w + pos
+            din = din - din / w + neg
+        if k >= w:
+            pdi = 100 * (dip / trs) if trs != 0 else 0.0
+            ndi = 100 * (din / trs) if trs != 0 else 0.0
+            dx = 100 * abs((pdi - ndi) / (pdi + ndi)) if pdi + ndi != 0 else 0.0
+            j = k - w
+            if j < w - 1:
+                if commit:
+                    dx_seed = dx_seed + [dx]
+            elif j == w - 1:
+                adx = out = math.fsum(dx_seed + [dx]) / w
+            else:
+                adx = out = (adx * (w - 1) + dx) / w
+        if commit:
+            self.trs, self.dip, self.din, self.adx = trs, dip, din, adx
+            self.dx_seed = dx_seed
+            self.count = k
+        return out
+
+class StreamingIndicators:
+    """State chỉ báo của một (symbol, timeframe)."""
+
+    def __init__(self):
+        self.ema200 = _Ema(2.0 / 201, 200)
+        self.ema12 = _Ema(2.0 / 13, 12)
+        self.ema26 = _Ema(2.0 / 27, 26)
+        self.macd_sig = _Ema(2.0 / 10, 9)
+        self.rsi_up = _Ema(1.0 / 14, 14)
+        self.rsi_dn = _Ema(1.0 / 14, 14)
+        self.ma50 = _Window(50)
+        self.bb = _Window(20)
+        self.rng = _Window(20)
+        self.vol = _Window(20)
+        self.mfv = _Window(20)
+        self.rsi_win = _Window(14)
+        self.atr14 = _WilderAtr(14)
+        self.atr10 = _WilderAtr(10)
+        self.adx = _Adx(14)
+        self.cum_pv = 0.0
+        self.cum_v = 0.0
+        self.prev: Optional[Tuple[float, float, float]] = None  # (high, low, close) nến đã đóng trước
+        self.st: Optional[Tuple[float, float, int]] = None  # (final_ub, final_lb, trend) của nến đã đóng trước
+        self.count = 0
+        self.last_ts: Optional[int] = None
+        self.last: Dict[str, float] = {}
+
+    @classmethod
+    def from_closed(cls, high, low, close, volume, ts: Optional[int] = None) -> "StreamingIndicators":
+        """
+        State sau khi update() lần lượt mọi nến (đã đóng) của các mảng, dựng bằng vài
+        vòng lặp float thuần thay vì một lần update() mỗi nến; tổng cửa sổ trượt được
+        tính lại bằng fsum. ts: timestamp nến cuối.
+        """
+        h = np.asarray(high, dtype=np.float64).tolist()
+        l = np.asarray(low, dtype=np.float64).tolist()
+        c = np.asarray(close, dtype=np.float64).tolist()
+        v = np.asarray(volume, dtype=np.float64).tolist()
+        st = cls()
+        n = len(c)
+        if n == 0:
+            return st
+
+        def ema_run(ema, xs):
+            """Chạy _Ema qua xs (commit), trả về output từng bước."""
+            a, value, count, mp = ema.alpha, ema.value, ema.count, ema.min_periods
+            outs = []
+            for x in xs:
+                if x != x:
+                    outs.append(value if value is not None and count >= mp else NAN)
+                    continue
+                value = x if value is None else a * x + (1.0 - a) * value
+                count += 1
+                outs.append(value if count >= mp else NAN)
+            ema.value, ema.count = value, count
+            return outs
+
+        ema_run(st.ema200, c)
+        fast = ema_run(st.ema12, c)
+        slow = ema_run(st.ema26, c)
+        ema_run(st.macd_sig, [f - s_ for f, s_ in zip(fast, slow)])
+
+        ups, dns, trs = [0.0], [0.0], [h[0] - l[0]]
+        for i in range(1, n):
+            diff = c[i] - c[i-1]
+            ups.append(diff if diff > 0 else 0.0)
+            dns.append(-diff if diff < 0 else 0.0)
+            trs.append(max(h[i], c[i-1]) - min(l[i], c[i-1]))
+        eus = ema_run(st.rsi_up, ups)
+        eds = ema_run(st.rsi_dn, dns)
+        rsis = []
+        for eu, ed in zip(eus, eds):
+            if ed != ed or eu != eu:
+                rsis.append(NAN)
+            elif ed == 0:
+                rsis.append(100.0)
+            else:
+                rsis.append(100 - (100 / (1 + eu / ed)))
+
+        for i in range(1, n):
+            diff_up = h[i] - h[i-1]
+            diff_down = l[i-1] - l[i]
+            pos = diff_up if (diff_up > diff_down and diff_up > 0) else 0.0
+            neg = diff_down if (diff_down > diff_up and diff_down > 0) else 0.0
+            st.adx.step(trs[i], pos, neg, True)
+        for tr in trs:
+            st.atr14.step(tr, True)
+        atr10 = [st.atr10.step(tr, True) for tr in trs]
+
+        cum_pv = cum_v = 0.0
+        for i in range(n):
+            cum_pv += (h[i] + l[i] + c[i]) / 3 * v[i]
+            cum_v += v[i]
+        st.cum_pv, st.cum_v = cum_pv, cum_v
+
+        fub = flb = None
+        trend = 1
+        for i in range(n):
+            hl2 = (h[i] + l[i]) / 2
+            bub = hl2 + 3 * atr10[i]
+            blb = hl2 - 3 * atr10[i]
+            if fub is None:
+                fub, flb, trend = bub, blb, 1
+                continue
+            pc = c[i-1]
+            if c[i] > fub: trend = 1
+            elif c[i] < flb: trend = -1
+            fub, flb = (min(bub, fub) if pc > fub else bub), (max(blb, flb) if pc < flb else blb)
+        st.st = (fub, flb, trend)
+
+        mfvs = []
+        for i in range(max(0, n - st.mfv.size), n):
+            hl = h[i] - l[i]
+            mfv = ((c[i] - l[i]) - (h[i] - c[i])) / hl * v[i] if hl != 0 else 0.0
+            mfvs.append(0.0 if mfv != mfv or math.isinf(mfv) else mfv)
+        for win, xs in ((st.ma50, c), (st.bb, c), (st.rng, [a - b for a, b in zip(h[-20:], l[-20:])]),
+                        (st.vol, v), (st.mfv, mfvs), (st.rsi_win, rsis)):
+            win.vals.extend(xs[-win.size:])
+            win.total = math.fsum(x for x in win.vals if x == x)
+            win.nans = sum(1 for x in win.vals if x != x)
+
+        st.prev = (h[-1], l[-1], c[-1])
+        st.count = n
+        st.last_ts = int(ts) if ts is not None else None
+        return st
+
+    def update(self, high: float, low: float, close: float, volume: float, closed: bool = True, ts: Optional[int] = None) -> Dict[str, float]:
+        """
+        Cập nhật với một nến. closed=False: nến đang chạy, tính giá trị tạm mà không
+        đổi state (gọi lại bao nhiêu lần cũng được trước khi nến đóng).
+        """
+        c = closed
+        out: Dict[str, float] = {}
+        out["ema200"] = self.ema200.step(close, c)
+        f = self.ema12.step(close, c)
+        s = self.ema26.step(close, c)
+        macd = f - s
+        out["macd"] = macd
+        out["macd_signal"] = self.macd_sig.step(macd, c)
+        out["ma50"] = self.ma50.mean(close)
+
+        if self.prev is None:
+            # Nến đầu: diff NaN → up/down = 0, TR = high - low
+            up = dn = 0.0
+            tr = high - low
+        else:
+            ph, pl, pc = self.prev
+            diff = close - pc
+            up = diff if diff > 0 else 0.0
+            dn = -diff if diff < 0 else 0.0
+            tr = max(high, pc) - min(low, pc)
+        eu = self.rsi_up.step(up, c)
+        ed = self.rsi_dn.step(dn, c)
+        if ed != ed or eu != eu:
+            rsi = NAN
+        elif ed == 0:
+            rsi = 100.0
+        else:
+            rsi = 100 - (100 / (1 + eu / ed))
+        out["rsi"] = rsi
+
+        if self.prev is None:
+            out["adx"] = 0.0
+        else:
+            diff_up = high - ph
+            diff_down = pl - low
+            pos = diff_up if (diff_up > diff_down and diff_up > 0) else 0.0
+            neg = diff_down if (diff_down > diff_up and diff_down > 0) else 0.0
+            out["adx"] = self.adx.step(tr, pos, neg, c)
+
+        out["atr"] = self.atr14.step(tr, c)
+        atr10 = self.atr10.step(tr, c)
+
+        cum_pv = self.cum_pv + (high + low + close) / 3 * volume
+        cum_v = self.cum_v + volume
+        out["vwap"] = cum_pv / cum_v if cum_v != 0 else NAN
+
+        hl2 = (high + low) / 2
+        bub = hl2 + 3 * atr10
+        blb = hl2 - 3 * atr10
+        if self.st is None:
+            st = (bub, blb, 1)
+        else:
+            fub_p, flb_p, trend_p = self.st
+            pc = self.prev[2]
+            fub = min(bub, fub_p) if pc > fub_p else bub
+            flb = max(blb, flb_p) if pc < flb_p else blb
+            if close > fub_p: trend = 1
+            elif close < flb_p: trend = -1
+            else: trend = trend_p
+            st = (fub, flb, trend)
+        out["supertrend"] = st[2]
+
+        rng = high - low
+        rng_mean = self.rng.mean(rng)
+        out["range_filter"] = int(rng > rng_mean * 1.5)
+
+        hl = high - low
+        if hl != 0:
+            mfv = ((close - low) - (high - close)) / hl * volume
+        else:
+            mfv = 0.0
+        if mfv != mfv or math.isinf(mfv):
+            mfv = 0.0
+        mfv_sum = self.mfv.sum(mfv)
+        v_sum = self.vol.sum(volume)
+        out["chaikin_mf"] = _div(mfv_sum, v_sum)
+        v_mean = self.vol.mean(volume)
+        out["volume_spike"] = int(volume > v_mean * 1.5)
+
+        lo = self.rsi_win.min(rsi)
+        hi = self.rsi_win.max(rsi)
+        out["stoch_rsi"] = _div(rsi - lo, hi - lo)
+
+        mid = self.bb.mean(close)
+        sd = self.bb.std(close)
+        out["bollinger_bands_mid"] = mid
+        out["bollinger_bands_upper"] = mid + 2 * sd
+        out["bollinger_bands_lower"] = mid - 2 * sd
+        out["bollinger_bands"] = out["bollinger_bands_upper"] - out["bollinger_bands_lower"]
+
+        if closed:
+            self.ma50.push(close)
+            self.rng.push(rng)
+            self.vol.push(volume)
+            self.mfv.push(mfv)
+            self.rsi_win.push(rsi)
+            self.bb.push(close)
+            self.cum_pv, self.cum_v = cum_pv, cum_v
+            self.prev = (high, low, close)
+            self.st = st
+            self.count += 1
+            if ts is not None:
+                self.last_ts = int(ts)
+        self.last = out
+        return out
+
+class IndicatorStreamEngine:
+    """Quản lý StreamingIndicators theo (symbol, timeframe) và đồng bộ với frame OHLCV."""
+
+    def __init__(self):
+        self.states: Dict[Tuple[str, str], StreamingIndicators] = {}
+
+    def reset(self, symbol: str, timeframe: str):
+        self.states.pop((symbol, timeframe), None)
+
+    def sync(self, symbol: str, timeframe: str, df: pd.DataFrame, last_closed: bool = False) -> Dict[str, float]:
+        """
+        Đẩy các nến mới của df vào state: mọi nến trước nến cuối được commit, nến cuối
+        là nến đang chạy (trừ khi last_closed=True). Nếu df không nối tiếp state
+        (thiếu nến) thì dựng lại state từ đầu df.
+        """
+        key = (symbol, timeframe)
+        ts = df["timestamp"].to_numpy()
+        st = self.states.get(key)
+        start = 0
+        if st is not None and st.last_ts is not None:
+            i = int(np.searchsorted(ts, st.last_ts))
+            if i < len(ts) and int(ts[i]) == st.last_ts:
+                start = i + 1
+            else:
+                st = None
+        if st is None or st.last_ts is None:
+            st = StreamingIndicators()
+            self.states[key] = st
+            start = 0
+        h = df["high"].to_numpy(); l = df["low"].to_numpy()
+        c = df["close"].to_numpy(); v = df["volume"].to_numpy()
+        n = len(df)
+        out = st.last
+        for i in range(start, n):
+            closed = last_closed or i < n - 1
+            out = st.update(float(h[i]), float(l[i]), float(c[i]), float(v[i]), closed=closed, ts=int(ts[i]))
+        return out
@@ -0,0 +1,46 @@
+import math
+
+import numpy as np
+import pytest
+
+from batch_indicators import calculate_indicators_many, compute_batch
+from indicators import GATE_KEYS, calculate_indicators
+from test_indicators import _ohlcv
+from tight_gate import build_indicator_results
+from votes import tally_votes
+
+def _assert_same(got, want):
+    for key in GATE_KEYS:
+        a, b = got[key], want[key]
+        if isinstance(b, str) or key in ("supertrend", "range_filter", "volume_spike"):
+            assert a == b, key
+        elif math.isnan(b):
+            assert math.isnan(a), key
+        else:
+            assert a == pytest.approx(b, rel=1e-9, abs=1e-9), key
+
+@pytest.mark.parametrize("tf", ["4h", "1d", "15m"])
+def test_batch_matches_gate_per_symbol(tf):
+    frames = {f"S{i}/USDT": _ohlcv(n=300, seed=i) for i in range(12)}
+    many = calculate_indicators_many(frames, timeframe=tf)
+    for symbol, df in frames.items():
+        gate = calculate_indicators(df, timeframe=tf, mode="gate")
+        _assert_same(many[symbol], gate)
+        votes = build_indicator_results(df, many[symbol])
+        assert votes == build_indicator_results(df, gate)
+        assert tally_votes(votes, {}) == tally_votes(build_indicator_results(df, gate), {})
+
+def test_batch_groups_frames_by_length():
+    frames = {"A": _ohlcv(n=250, seed=1), "B": _ohlcv(n=400, seed=2), "C": _ohlcv(n=120, seed=3), "D": None}
+    many = calculate_indicators_many(frames)
+    assert many["C"] is None and many["D"] is None
+    for symbol in ("A", "B"):
+        _assert_same(many[symbol], calculate_indicators(frames[symbol], mode="gate"))
+
+def test_compute_batch_takes_symbol_by_bar_matrices():
+    dfs = [_ohlcv(n=260, seed=s) for s in (4, 5)]
+    mats = [np.stack([df[col].to_numpy() for df in dfs]) for col in ("close", "high", "low", "volume")]
+    out = compute_batch(*mats)
+    assert len(out) == 2
+    for snap, df in zip(out, dfs):
+        _assert_same(snap, calculate_indicators(df, mode="gate"))
@@ -0,0 +1,116 @@
+import asyncio
+
+import numpy as np
+
+from data import AsyncFetcher, CandleBuffer, CandleStore
+from fake_exchange import AsyncFakeExchange
+
+def _rows(start, n, step=1):
+    return [[t, t + 0.1, t + 0.5, t - 0.5, t + 0.2, 1.0] for t in range(start, start + n * step, step)]
+
+def test_buffer_merge_overwrites_forming_bar_and_skips_old_rows():
+    buf = CandleBuffer(5)
+    buf.merge(_rows(0, 3))
+    assert len(buf) == 3 and buf.last_ts == 2
+    buf.merge([[2, 9.0, 9.0, 9.0, 9.0, 9.0], [1, 7.0, 7.0, 7.0, 7.0, 7.0], [3, 3.1, 3.5, 2.5, 3.2, 1.0]])
+    ts, px = buf.arrays()
+    assert ts.tolist() == [0, 1, 2, 3]
+    assert px[2].tolist() == [9.0] * 5        # nến đang chạy bị ghi đè
+    assert px[1].tolist() == _rows(1, 1)[0][1:]  # nến cũ đến muộn bị bỏ qua
+
+def test_buffer_compacts_at_twice_size_and_keeps_last_size_bars():
+    buf = CandleBuffer(4)
+    buf.merge(_rows(0, 8))
+    assert buf._end == buf._cap == 8 and buf.arrays()[0].tolist() == [4, 5, 6, 7]
+    buf.merge(_rows(8, 1))
+    ts, px = buf.arrays()
+    assert buf._start == 0 and buf._end == 4
+    assert ts.tolist() == [5, 6, 7, 8]
+    assert px[:, 3].tolist() == [5.2, 6.2, 7.2, 8.2]
+
+def test_frame_is_a_view_until_next_merge():
+    buf = CandleBuffer(3)
+    buf.merge(_rows(0, 3))
+    df = buf.frame()
+    assert np.shares_memory(df["close"].to_numpy(), buf._px)
+    kept = df.copy()
+    buf.merge([[2, 1.0, 1.0, 1.0, 1.0, 1.0]])
+    assert df["close"].iloc[-1] == 1.0         # view đổi theo nến đang chạy bị ghi đè
+    buf.merge(_rows(3, 4))                     # dồn buffer: vùng nhớ cũ bị ghi lại
+    assert df["close"].tolist() == [4.2, 5.2, 6.2]  # giá đã thuộc nến khác
+    assert df["timestamp"].tolist() == [0, 1, 2]   # còn timestamp thì không
+    assert kept["close"].iloc[-1] == 2.2       # bản copy (như tf_cache.put_frame) giữ nguyên
+
+M5, M15 = 5 * 60 * 1000, 15 * 60 * 1000
+SYM = "BTC/USDT"
+
+def _store(verify=False, now_ms=1_700_002_800_000 + 60_000):
+    ex = AsyncFakeExchange(latency=0, now_ms=now_ms)
+    return ex, CandleStore(AsyncFetcher(exchange=ex), derive={"15m": "5m"}, verify=verify)
+
+async def _tick(store, minutes=0):
+    store.fetcher.exchange._now_ms += minutes * 60_000
+    await store.update(SYM, "5m", 60)
+    return await store.update_derived(SYM, "15m", 30)
+
+def _exchange_15m(ex, n):
+    return np.asarray(ex._candles(SYM, "15m", None, n), dtype=np.float64)
+
+def test_derived_seed_then_incremental_aggregation():
+    async def run():
+        ex, store = _store()
+        df = await _tick(store)
+        seeded = ex.requests
+        assert seeded == 2 and len(df) == 30
+        for _ in range(7):
+            df = await _tick(store, 5)
+            n = len(df)
+            np.testing.assert_allclose(df.to_numpy(), _exchange_15m(ex, n), rtol=1e-9)
+        assert ex.requests == seeded + 7  # khung 15m không fetch thêm sau lần seed
+        base = store.frame(SYM, "5m")
+        bucket = base["timestamp"] - base["timestamp"] % M15
+        ref = base.groupby(bucket).agg(open=("open", "first"), high=("high", "max"), low=("low", "min"),
+                                       close=("close", "last"), volume=("volume", "sum"))
+        ref = ref[bucket.groupby(bucket).size() == 3]  # chỉ bucket đủ 3 nến 5m
+        got = df.set_index("timestamp").loc[ref.index]
+        np.testing.assert_allclose(got.to_numpy(), ref.to_numpy(), rtol=1e-12)
+    asyncio.run(run())
+
+def test_derived_forming_bucket_is_merged_in_place():
+    async def run():
+        ex, store = _store(now_ms=1_700_002_800_000 + 60_000)  # phút 1 của bucket 15m
+        df = await _tick(store)
+        last_ts, n = int(df["timestamp"].iloc[-1]), len(df)
+        df = await _tick(store, 5)
+        assert len(df) == n and int(df["timestamp"].iloc[-1]) == last_ts
+        base = store.frame(SYM, "5m")
+        tail = base[base["timestamp"] >= last_ts]
+        assert len(tail) == 2
+        assert df["close"].iloc[-1] == tail["close"].iloc[-1]
+        assert df["high"].iloc[-1] == tail["high"].max()
+        assert df["volume"].iloc[-1] == tail["volume"].sum()
+    asyncio.run(run())
+
+def test_derived_reseeds_when_base_no_longer_covers_last_bar():
+    async def run():
+        ex, store = _store()
+        await _tick(store)
+        before = ex.requests
+        df = await _tick(store, 60 * 24)  # khung gốc fetch lại toàn bộ, bỏ xa nến 15m cuối
+        base_ts, _ = store.buffers[(SYM, "5m")].arrays()
+        assert ex.requests == before + 2  # fetch đủ 5m + seed lại 15m
+        assert int(df["timestamp"].iloc[-1]) >= int(base_ts[0])
+        np.testing.assert_allclose(df.to_numpy(), _exchange_15m(ex, len(df)), rtol=1e-9)
+    asyncio.run(run())
+
+def test_verify_patches_mismatched_closed_bar():
+    async def run():
+        ex, store = _store(verify=True)
+        await _tick(store, 5)
+        ts, px = store.buffers[(SYM, "5m")].arrays()
+        assert int(ts[-2]) % M15 == 0            # nến 5m đã đóng trong bucket đang chạy
+        px[-2, 1] = px[:, 1].max() * 1.01        # làm lệch high của nến gốc
+        df = await _tick(store, 10)              # bucket đóng → so với sàn
+        assert store.verify_mismatches == 1
+        np.testing.assert_allclose(df.to_numpy()[-2], _exchange_15m(ex, 2)[0], rtol=1e-9)
+    asyncio.run(run())
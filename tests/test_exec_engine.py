@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from exec_engine import ExecutionEngine
+
+PLAN = {"entry_price": 100.0, "ttl_sec": 30, "size_probe": 1.0, "sl": 98.0, "tp": 103.0, "r_value": 2.0}
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("DISCORD_WEBHOOK_URL", raising=False)
+    return {"discord": {"webhook_url": ""}, "trading": {"state_path": "trade_state.json", "journal_snapshot_every": 25}}
+
+def _round_trip(eng, symbol, t):
+    eng.tick(symbol, "15m", "LONG", PLAN, 100.0, ts_now=t)      # đặt lệnh
+    eng.tick(symbol, "15m", "LONG", PLAN, 99.9, ts_now=t + 1)   # khớp
+    eng.tick(symbol, "15m", "LONG", PLAN, 103.5, ts_now=t + 2)  # chốt lời
+
+def test_journal_rebuilds_state_and_compacts_orders(cfg, tmp_path):
+    eng = ExecutionEngine(cfg)
+    for i in range(40):
+        _round_trip(eng, "BTC/USDT", 1000 + 10 * i)
+    eng.tick("ETH/USDT", "15m", "LONG", PLAN, 100.0, ts_now=5000)
+    eng.tick("ETH/USDT", "15m", "LONG", PLAN, 99.9, ts_now=5001)
+    # chỉ còn lệnh đang mở trong state; lệnh đã xong nằm trong archive
+    assert eng.state["orders"] == {}
+    assert len((tmp_path / "trade_state_orders.jsonl").read_text().splitlines()) == 41
+    assert eng.journal.snapshots >= 1
+    eng.journal.close()
+
+    again = ExecutionEngine(cfg)
+    assert again.state == json.loads(json.dumps(eng.state))
+    assert list(again.state["positions"]) == ["ETH/USDT|15m"]
+
+def test_journal_write_cost_is_constant(cfg, tmp_path):
+    eng = ExecutionEngine(cfg)
+    sizes = []
+    for i in range(30):
+        before = eng.journal.records
+        _round_trip(eng, "BTC/USDT", 1000 + 10 * i)
+        sizes.append(eng.journal.records - before)
+    assert len(set(sizes[1:])) == 1
+
+def test_journal_ignores_torn_tail(cfg, tmp_path):
+    eng = ExecutionEngine(cfg)
+    eng.tick("SOL/USDT", "15m", "LONG", PLAN, 100.0, ts_now=1000)
+    eng.journal.close()
+    with open(tmp_path / "trade_state.json.journal", "a") as f:
+        f.write('{"k":"positions/X|15m","v":{"si')
+    again = ExecutionEngine(cfg)
+    assert "X|15m" not in again.state.get("positions", {})
+    assert again.state["pair_index"] == eng.state["pair_index"]
+    again.tick("SOL/USDT", "15m", "LONG", PLAN, 99.9, ts_now=1001)  # khớp, append sau phần bị cắt
+    again.journal.close()
+    assert "SOL/USDT|15m" in ExecutionEngine(cfg).state["positions"]
+
+def test_tick_many_matches_individual_ticks(cfg, tmp_path, monkeypatch):
+    symbols = ["BTC/USDT", "ETH/USDT", "SOL/USDT"]
+    steps = [(1000, 100.0), (1001, 99.9), (1002, 101.0), (1003, 103.5)]
+    (tmp_path / "a").mkdir(); (tmp_path / "b").mkdir()
+    monkeypatch.chdir(tmp_path / "a")
+    one = ExecutionEngine(cfg)
+    monkeypatch.chdir(tmp_path / "b")
+    many = ExecutionEngine(cfg)
+    saves = []
+    orig = many._save_state
+    monkeypatch.setattr(many, "_save_state", lambda: (saves.append(many._batch_depth), orig()))
+    for t, px in steps:
+        ref = {f"{s}|15m": one.tick(s, "15m", "LONG", PLAN, px, ts_now=t) for s in symbols}
+        saves.clear()
+        got = many.tick_many([(s, "LONG", PLAN, px) for s in symbols], ts_now=t)
+        assert got == ref
+        assert saves.count(0) == 1  # chỉ một lần ghi thật cho cả lượt
+    assert many.state == one.state
+    monkeypatch.chdir(tmp_path / "b")
+    assert ExecutionEngine(cfg).state == json.loads(json.dumps(one.state))
+
+def test_batch_queues_notifications(cfg, monkeypatch):
+    eng = ExecutionEngine(cfg)
+    sent = []
+    monkeypatch.setattr(eng.notifier, "enabled", lambda: True)
+    monkeypatch.setattr(eng.notifier, "send", lambda msg: sent.append(msg))
+    eng.tick_many([("BTC/USDT", "LONG", PLAN, 100.0), ("ETH/USDT", "LONG", PLAN, 100.0)], ts_now=1000)
+    assert eng.notify_queue.flush(timeout=5)
+    # hai tin đặt lệnh gom vào một post
+    assert len(sent) == 1 and "BTC/USDT" in sent[0] and "ETH/USDT" in sent[0]
+
+def test_risk_tick_exits_and_trails_from_prices_only(cfg):
+    eng = ExecutionEngine(cfg)
+    eng.tick_many([("BTC/USDT", "LONG", PLAN, 100.0), ("ETH/USDT", "LONG", PLAN, 100.0)], ts_now=1000)
+    eng.tick_many([("BTC/USDT", "LONG", PLAN, 99.9), ("ETH/USDT", "LONG", PLAN, 99.9)], ts_now=1001)
+    out = eng.risk_tick({"BTC/USDT": 102.5, "ETH/USDT": 97.5, "SOL/USDT": 1.0}, ts_now=1002)
+    assert set(out) == {"BTC/USDT|15m", "ETH/USDT|15m"}
+    assert list(eng.state["positions"]) == ["BTC/USDT|15m"]   # ETH chạm SL
+    assert eng.state["positions"]["BTC/USDT|15m"]["sl"] > 99.9  # BTC: hoà vốn / trailing
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from indicator_registry import VOTE_NAMES, active_indicators, fields_for, lookback, min_bars
+from indicators import calculate_indicators, last_value
+from test_indicators import _ohlcv
+from tight_gate import build_indicator_results
+from votes import tally_votes
+
+def test_active_indicators_follow_tally_weight_rules():
+    w = {"EMA200": 0.0, "Supertrend": 0, "MACD": 2.0, "Chaikin MF": 0.0}
+    names = active_indicators(w)
+    assert "EMA200" not in names and "Supertrend" not in names and "Chaikin_MF" not in names
+    # Không có trong weights → tally_votes dùng DEFAULT_WEIGHTS nên vẫn phải tính
+    assert "StochRSI" in names and "BollingerBands" in names
+    assert active_indicators({"EMA200": 3.0, "Range": 0.0}, use_defaults=False) == ("EMA200",)
+
+@pytest.mark.parametrize("mode", ["full", "gate"])
+def test_pruned_votes_keep_scores(mode):
+    cfg = json.load(open("config.json", encoding="utf-8"))
+    w = cfg["weights_sets"]["M15"]
+    names = active_indicators(w)
+    df = _ohlcv(n=300, seed=5)
+    full = calculate_indicators(df, mode=mode)
+    pruned = calculate_indicators(df, mode=mode, fields=fields_for(names))
+    a = tally_votes(build_indicator_results(df, full), w)
+    b = tally_votes(build_indicator_results(df, pruned, names), w)
+    assert (a["score_long"], a["score_short"]) == (b["score_long"], b["score_short"])
+
+def test_fields_limit_computation_and_frame_size():
+    df = _ohlcv(n=300, seed=8)
+    fields = fields_for(("MA50", "Range"), ("atr",))
+    assert lookback(fields) == 150 and min_bars(fields) == 54
+    ind = calculate_indicators(df.iloc[-60:], fields=fields)
+    assert set(ind) == {"ma50", "range_filter", "atr", "trend_h4", "trend_d1"}
+    snap = calculate_indicators(df.iloc[-60:], mode="gate", fields=fields)
+    assert snap["ema200"] is None
+    assert snap["ma50"] == pytest.approx(last_value(ind["ma50"]))
+    assert set(build_indicator_results(df, snap)) == {"MA50", "Range"}
+    assert len(build_indicator_results(df, calculate_indicators(df))) == len(VOTE_NAMES)
@@ -0,0 +1,114 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+import ta
+
+from indicators import (
+    GATE_KEYS, SUPERTREND_IMPLS, IndicatorMemo, IndicatorSnapshot, calculate_indicators,
+    last_value, true_range, wilder_atr,
+)
+from tight_gate import build_indicator_results
+
+def _ohlcv(n=400, seed=3):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.005, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.005, n))
+    vol = rng.uniform(50, 500, n)
+    ts = 1_700_000_000_000 + np.arange(n, dtype=np.int64) * 900_000
+    return pd.DataFrame({"timestamp": ts, "open": open_, "high": high, "low": low, "close": close, "volume": vol})
+
+@pytest.mark.parametrize("seed", [0, 3, 11])
+def test_supertrend_numpy_matches_pandas_loop(seed):
+    df = _ohlcv(n=600, seed=seed)
+    ref = SUPERTREND_IMPLS["pandas"](df)
+    got = SUPERTREND_IMPLS["numpy"](df)
+    pd.testing.assert_series_equal(got, ref)
+
+def test_supertrend_impl_selectable_from_config():
+    df = _ohlcv()
+    a = calculate_indicators(df, {"indicators": {"supertrend_impl": "pandas"}})
+    b = calculate_indicators(df)
+    pd.testing.assert_series_equal(a["supertrend"], b["supertrend"])
+
+def test_wilder_atr_matches_ta():
+    df = _ohlcv(n=500)
+    for window in (10, 14):
+        ref = ta.volatility.average_true_range(df["high"], df["low"], df["close"], window=window)
+        got = wilder_atr(true_range(df["high"], df["low"], df["close"]), window)
+        np.testing.assert_array_equal(got, ref.to_numpy())
+
+@pytest.mark.parametrize("seed,n,tf", [(0, 204, "4h"), (3, 300, "1d"), (11, 1000, "15m")])
+def test_gate_mode_matches_last_bar_of_full(seed, n, tf):
+    df = _ohlcv(n=n, seed=seed)
+    full = calculate_indicators(df, timeframe=tf)
+    gate = calculate_indicators(df, {"indicators": {"mode": "gate"}}, timeframe=tf)
+    assert isinstance(gate, IndicatorSnapshot)
+    for key in GATE_KEYS:
+        want, got = last_value(full[key]), gate[key]
+        if isinstance(want, str) or key in ("supertrend", "range_filter", "volume_spike"):
+            assert got == want, key
+        elif math.isnan(want):
+            assert math.isnan(got), key
+        else:
+            assert got == pytest.approx(want, rel=1e-9, abs=1e-9), key
+    assert build_indicator_results(df, gate) == build_indicator_results(df, full)
+
+def test_gate_mode_rejects_short_frames_like_full():
+    df = _ohlcv(n=203)
+    assert calculate_indicators(df) is None
+    assert calculate_indicators(df, mode="gate") is None
+
+def test_memo_hits_until_bar_changes_and_evicts_lru():
+    memo = IndicatorMemo(maxsize=2)
+    cfg = {"indicators": {"mode": "gate"}}
+    df = _ohlcv(n=260)
+    assert memo.get("BTC/USDT", "15m", df, cfg) is None
+    ind = calculate_indicators(df, cfg)
+    memo.put("BTC/USDT", "15m", df, ind, cfg)
+    assert memo.get("BTC/USDT", "15m", df.copy(), cfg) is ind
+    # Nến đang chạy đổi giá → miss; config khác → miss
+    ticked = df.copy()
+    ticked.loc[ticked.index[-1], "close"] *= 1.001
+    assert memo.get("BTC/USDT", "15m", ticked, cfg) is None
+    # Nến đã đóng bị sửa tại chỗ (đối chiếu với sàn) → miss
+    patched = df.copy()
+    patched.loc[patched.index[-2], "close"] *= 1.001
+    assert memo.get("BTC/USDT", "15m", patched, cfg) is None
+    assert memo.get("BTC/USDT", "15m", df, {"indicators": {"mode": "full"}}) is None
+    memo.put("ETH/USDT", "15m", df, ind, cfg)
+    memo.put("SOL/USDT", "15m", df, ind, cfg)
+    assert memo.get("BTC/USDT", "15m", df, cfg) is None
+    st = memo.stats()
+    assert (st["hits"], st["evictions"], st["entries"]) == (1, 1, 2)
+
+def test_memo_recomputes_only_forming_bar_between_closes():
+    memo = IndicatorMemo(maxsize=8, tail_after=2)
+    df = _ohlcv(n=300, seed=9)
+    fields = ("ema200", "adx", "rsi", "atr", "supertrend", "macd_signal")
+
+    def tick(k):
+        f = df.copy()
+        f.loc[f.index[-1], ["high", "close", "volume"]] = [f["high"].iloc[-1] * (1 + k / 1e3),
+                                                           f["close"].iloc[-1] * (1 + k / 2e3), 100.0 + k]
+        return f
+
+    for k in range(2):  # chưa đủ tail_after: tính lại cả frame
+        f = tick(k)
+        assert memo.get("BTC/USDT", "4h", f, mode="gate") is None
+        memo.put("BTC/USDT", "4h", f, calculate_indicators(f, mode="gate", timeframe="4h", fields=fields), mode="gate")
+    for k in range(2, 6):
+        f = tick(k)
+        got = memo.get("BTC/USDT", "4h", f, mode="gate")
+        ref = calculate_indicators(f, mode="gate", timeframe="4h", fields=fields)
+        for key, want in ref.items():
+            if isinstance(want, float) and not math.isnan(want):
+                assert got[key] == pytest.approx(want, rel=1e-6, abs=1e-9), key
+            else:
+                assert got[key] == want or (want != want and got[key] != got[key]), key
+    assert memo.stats()["tail_hits"] == 4
+    # nến mới đóng → phần đã đóng khác, không dùng state cũ
+    assert memo.get("BTC/USDT", "4h", _ohlcv(n=301, seed=9).iloc[1:], mode="gate") is None
@@ -0,0 +1,20 @@
+import notifier
+from notifier import NotificationQueue
+
+class _Flaky:
+    def __init__(self):
+        self.posts = []
+
+    def send(self, content):
+        if "boom" in content:
+            raise RuntimeError("webhook 500")
+        self.posts.append(content)
+        return True
+
+def test_failed_post_does_not_drop_the_rest_of_the_batch():
+    n = _Flaky()
+    q = NotificationQueue(n, max_chars=4)  # mỗi tin một bài post
+    q.put_many(["boom", "a1", "b2", "c3"])
+    assert q.flush(5.0)
+    assert sorted("\n\n".join(n.posts).split("\n\n")) == ["a1", "b2", "c3"]
+    assert q in notifier._LIVE_QUEUES
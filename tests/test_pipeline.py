@@ -0,0 +1,26 @@
+import pytest
+
+from indicators import calculate_indicators_cached
+from pipeline import H1_GATES, analyze_symbol, indicator_plan, screen_h1
+from test_indicators import _ohlcv
+from tf_cache import TimeframeCache
+
+CFG = {"thresholds": {"M15": 0.0, "H1": 2.0}, "adx_h1_threshold": 15, "tight_mode": {"heavy_required": 1},
+       "weights_sets": {"H1": {"EMA200": 2.65, "SUPERTREND": 2.12, "RANGE": 1.38, "MACD": 1.8, "ADX": 1.16}}}
+
+@pytest.mark.parametrize("seed", range(12))
+def test_h1_screen_only_prunes_symbols_that_fail_gates(seed):
+    vote_names, fields = indicator_plan(CFG)
+    tf_cache = TimeframeCache(timeframes=())
+    frames = {tf: _ohlcv(n=300, seed=seed * 4 + i) for i, tf in enumerate(("5m", "15m", "1h", "1d"))}
+    ind_tf = {"5m": "5m", "15m": "15m", "1h": "4h", "1d": "1d"}
+    ind = {tf: calculate_indicators_cached(df, CFG, timeframe=ind_tf[tf], fields=fields[tf]) for tf, df in frames.items()}
+    prep = (frames["5m"], frames["15m"], frames["1h"], frames["1d"], ind["5m"], ind["15m"], ind["1h"], ind["1d"])
+
+    gate = screen_h1(CFG, "S/USDT", frames["1h"], None, vote_names, fields, tf_cache, 0.0)
+    rec = analyze_symbol(CFG, "S/USDT", prep, vote_names)
+    assert gate in ("",) + H1_GATES
+    if gate:
+        assert not rec["gates_ok"]
+    if rec["gates_ok"]:
+        assert gate == ""
@@ -0,0 +1,27 @@
+from scheduler import BarCloseScheduler
+
+T0 = 1_700_000_100.0  # giờ đóng nến 5m và 15m, không phải 1h
+
+def test_due_is_next_close_plus_grace():
+    s = BarCloseScheduler(grace_sec=2.0)
+    assert s.due_after("5m", T0 - 10) == T0 + 2
+    assert s.due_after("5m", T0 + 1) == T0 + 2      # nến vừa đóng, chưa qua grace
+    assert s.due_after("5m", T0 + 2) == T0 + 302
+    assert s.closed_timeframes(T0 + 2, ("5m", "15m", "1h")) == ["5m", "15m"]
+    assert s.closed_timeframes(T0 + 302, ("5m", "15m", "1h")) == ["5m"]
+
+def test_jobs_rearm_independently():
+    s = BarCloseScheduler(grace_sec=2.0)
+    for sym in ("BTC", "ETH", "SOL"):
+        s.arm(sym, "5m", now_ts=T0 - 60)
+    assert s.pop_due(T0 + 1) == []
+    assert sorted(k for k, _ in s.pop_due(T0 + 2)) == ["BTC", "ETH", "SOL"]
+    # BTC, ETH xong nhanh; SOL chạy quá 1 nến → lỡ nến T0+300 của riêng nó
+    s.arm("BTC", "5m", now_ts=T0 + 3)
+    s.arm("ETH", "5m", now_ts=T0 + 4)
+    assert s.pop_due(T0 + 302) == [("BTC", T0 + 302), ("ETH", T0 + 302)]
+    s.arm("SOL", "5m", now_ts=T0 + 310)
+    assert s.next_due() == T0 + 602
+    assert s.stats()["skipped"] == 1
+    s.disarm("SOL")
+    assert s.pop_due(T0 + 1000) == []
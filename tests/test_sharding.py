@@ -0,0 +1,29 @@
+from sharding import ShardPlanner
+
+SYMBOLS = [f"S{i}/USDT" for i in range(8)]
+
+def test_assignment_is_sticky_until_load_is_skewed():
+    p = ShardPlanner(2, alpha=1.0, rebalance_ratio=1.25)
+    first = p.assign(SYMBOLS)
+    assert sorted(sum(first, [])) == sorted(SYMBOLS)
+    assert [len(s) for s in first] == [4, 4]
+
+    p.observe({s: 1.0 for s in SYMBOLS})
+    assert p.assign(SYMBOLS) == first and p.rebalances == 0
+
+    # hai symbol nặng cùng nằm ở shard 0 → chia lại theo chi phí đo được
+    heavy = first[0][:2]
+    p.observe({s: 5.0 for s in heavy})
+    shards = p.assign(SYMBOLS)
+    assert p.rebalances == 1
+    assert [s for s in heavy if s in shards[0]] != heavy
+    loads = p.loads(SYMBOLS)
+    assert max(loads) <= 1.25 * sum(loads) / 2
+
+def test_new_symbols_go_to_least_loaded_shard():
+    p = ShardPlanner(3, alpha=1.0)
+    p.assign(SYMBOLS[:3])
+    p.observe({SYMBOLS[0]: 3.0, SYMBOLS[1]: 1.0, SYMBOLS[2]: 2.0})
+    shards = p.assign(SYMBOLS[1:4])  # S0 bỏ khỏi danh sách, S3 mới
+    assert SYMBOLS[0] not in p.owner
+    assert shards[p.owner[SYMBOLS[3]]] == [SYMBOLS[3]]
@@ -0,0 +1,87 @@
+import pytest
+
+from broker import get_broker
+from exec_engine import ExecutionEngine
+from sim_broker import SimBroker, synthetic_trades
+
+CFG = {"trading": {"mode": "sim", "sim": {"latency_ms": 100, "slippage_bps": 10, "queue_ahead_mult": 1.0}}}
+
+def _broker():
+    b = get_broker(CFG)
+    assert isinstance(b, SimBroker)
+    b.on_trade("BTC/USDT", 1000.0, 101.0, 1.0)
+    return b
+
+def test_latency_queue_and_partial_fill():
+    b = _broker()
+    od = b.place_limit("BTC/USDT", "LONG", 100.0, 2.0, ttl_sec=60)
+    b.on_trade("BTC/USDT", 1000.05, 99.0, 5.0)  # lệnh chưa tới sàn
+    b.on_trade("BTC/USDT", 1000.08, 100.5, 1.0)
+    assert b.order_update(od["id"])["status"] == "pending"
+    b.on_trade("BTC/USDT", 1000.2, 100.5, 1.0)  # vào sổ, giá cuối trên limit → lệnh maker
+    b.on_trade("BTC/USDT", 1001.0, 100.0, 1.5)  # tiêu hết 1.5 trong hàng đợi phía trước (2.0)
+    assert b.order_update(od["id"])["filled_size"] == 0
+    b.on_trade("BTC/USDT", 1002.0, 100.0, 1.0)  # 0.5 hàng đợi + khớp 0.5
+    assert b.order_update(od["id"]) == {"status": "open", "filled_size": 0.5, "avg_price": 100.0}
+    b.on_trade("BTC/USDT", 1003.0, 99.5, 4.0)   # xuyên giá: khớp phần còn lại tại giá limit
+    assert b.order_update(od["id"]) == {"status": "filled", "filled_size": 2.0, "avg_price": 100.0}
+
+def test_ttl_expires_remainder_and_taker_on_arrival():
+    b = _broker()
+    od = b.place_limit("BTC/USDT", "SHORT", 102.0, 1.0, ttl_sec=5)
+    b.on_trade("BTC/USDT", 1010.0, 101.5, 1.0)
+    assert b.order_update(od["id"])["status"] == "expired"
+    taker = b.place_limit("BTC/USDT", "LONG", 102.0, 1.0)
+    b.on_trade("BTC/USDT", 1010.5, 101.6, 0.1)
+    upd = b.order_update(taker["id"])
+    assert upd["status"] == "filled"
+    assert upd["avg_price"] == pytest.approx(101.5 * 1.001)  # giá trade cuối + trượt giá, <= limit
+
+def test_replay_arrays_matches_trade_by_trade():
+    ts, px, qty = synthetic_trades(20_000, start_ts=1e9, seed=3)
+    fast, slow = SimBroker(CFG), SimBroker(CFG)
+    i = j = 0
+    for k in range(0, len(ts), 500):
+        i += fast.replay_arrays("ETH/USDT", ts[i:], px[i:], qty[i:], until=ts[k])
+        while j < len(ts) and ts[j] <= ts[k]:
+            slow.on_trade("ETH/USDT", ts[j], px[j], qty[j]); j += 1
+        for b in (fast, slow):
+            side = "LONG" if k % 1000 else "SHORT"
+            b.place_limit("ETH/USDT", side, round(float(px[k]) * (0.9995 if side == "LONG" else 1.0005), 6), 2.0, ttl_sec=90)
+    fast.replay_arrays("ETH/USDT", ts[i:], px[i:], qty[i:])
+    while j < len(ts):
+        slow.on_trade("ETH/USDT", ts[j], px[j], qty[j]); j += 1
+    assert fast.orders == slow.orders
+    assert fast.trades_seen == slow.trades_seen == len(ts)
+    assert {o["status"] for o in fast.orders.values()} == {"filled", "expired"}
+
+def test_engine_opens_partial_probe_after_ttl(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("DISCORD_WEBHOOK_URL", raising=False)
+    eng = ExecutionEngine(dict(CFG, discord={"webhook_url": ""}, trading=dict(CFG["trading"], state_path="s.json")))
+    eng.broker.on_trade("BTC/USDT", 1000.0, 101.0, 1.0)
+    plan = {"entry_price": 100.0, "ttl_sec": 30, "size_probe": 2.0, "sl": 98.0, "tp": 103.0, "r_value": 2.0}
+    eng.tick("BTC/USDT", "15m", "LONG", plan, 101.0)
+    eng.broker.on_trade("BTC/USDT", 1001.0, 100.0, 2.5)  # khớp 0.5 sau hàng đợi
+    assert "positions" not in eng.state or not eng.state["positions"]
+    eng.broker.on_trade("BTC/USDT", 1031.0, 100.8, 1.0)
+    out = eng.tick("BTC/USDT", "15m", "LONG", plan, 100.8)
+    pos = eng.state["positions"]["BTC/USDT|15m"]
+    assert (pos["size"], pos["entry"]) == (0.5, 100.0)
+    assert any("một phần" in a for a in out["actions"])
+
+def test_engine_ticks_drive_broker_without_trade_feed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("DISCORD_WEBHOOK_URL", raising=False)
+    eng = ExecutionEngine(dict(CFG, discord={"webhook_url": ""}, trading=dict(CFG["trading"], state_path="s.json")))
+    plan = {"entry_price": 100.0, "ttl_sec": 30, "size_probe": 1.0, "sl": 98.0, "tp": 103.0, "r_value": 2.0}
+    eng.tick("BTC/USDT", "15m", "LONG", plan, 101.0, ts_now=1000.0)
+    eng.tick("ETH/USDT", "15m", "LONG", plan, 101.0, ts_now=1000.0)
+    eng.tick("BTC/USDT", "15m", "LONG", plan, 99.0, ts_now=1001.0)   # vào sổ rồi giá xuyên limit
+    assert eng.state["positions"]["BTC/USDT|15m"]["entry"] == 100.0
+    first = eng.state["pair_index"]["ETH/USDT|15m"]
+    out = eng.tick("ETH/USDT", "15m", "LONG", plan, 100.5, ts_now=1100.0)  # hết TTL, trượt giá quá bảo vệ
+    assert eng.broker.order_update(first)["status"] == "expired"
+    assert "ETH/USDT|15m" not in eng.state["positions"]
+    assert out["actions"][0] == f"Hủy lệnh thăm dò id={first}"
+    assert eng.state["pair_index"]["ETH/USDT|15m"] != first  # cặp không bị kẹt: lệnh mới được đặt
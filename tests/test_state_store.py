@@ -0,0 +1,79 @@
+import asyncio
+import json
+import sqlite3
+
+from state_store import StateStore, flatten_sections, unflatten_sections
+from tight_gate import CooldownManager, StablePassTracker
+
+def test_sync_writes_only_changed_rows_in_one_batch(tmp_path):
+    store = StateStore(str(tmp_path / "s.db"))
+    store.sync("gate_state", {"a": {"count": 1}, "b": {"count": 2}})
+    assert store.rows_written == 2
+    with store.batch():
+        store.sync("gate_state", {"a": {"count": 1}, "b": {"count": 3}})
+        store.sync("last_signal", {"x": 1})
+    assert store.rows_written == 4 and store.commits == 2
+    store.sync("gate_state", {"b": {"count": 3}})  # a bị xoá
+    assert StateStore(str(tmp_path / "s.db")).load("gate_state") == {"b": {"count": 3}}
+
+def test_reader_sees_committed_state_while_writer_open(tmp_path):
+    path = str(tmp_path / "s.db")
+    store = StateStore(path)
+    state = {"positions": {"BTC/USDT|15m": {"size": 1.0}}, "orders": {}, "equity": 100.0}
+    store.sync("trade_state", flatten_sections(state))
+    ro = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    assert ro.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    rows = {k: json.loads(v) for k, v in ro.execute("SELECT key, value FROM trade_state")}
+    assert unflatten_sections(rows) == state
+
+def test_migrate_json_and_tracker_on_store(tmp_path):
+    legacy = tmp_path / "tight_state.json"
+    legacy.write_text(json.dumps({"ETH/USDT|15m": {"last_side": "LONG", "count": 1, "last_ts": 100.0}}))
+    store = StateStore(str(tmp_path / "s.db"))
+    tr = StablePassTracker(path=str(legacy), min_gap_sec=10, required_passes=2, flush_interval_sec=None, store=store)
+    assert not legacy.exists() and (tmp_path / "tight_state.json.migrated").exists()
+    assert tr.update("ETH/USDT", "15m", "LONG", True, now_ts=120) is True
+    tr.flush()
+    assert store.get("gate_state", "ETH/USDT|15m")["count"] == 2
+
+def test_writers_sharing_a_table_keep_each_others_rows(tmp_path):
+    store = StateStore(str(tmp_path / "s.db"))
+    main_cd = CooldownManager(path=str(tmp_path / "a.json"), flush_interval_sec=None, store=store)
+    facade_cd = CooldownManager(path=str(tmp_path / "b.json"), flush_interval_sec=None, store=store)
+    main_cd.mark("BTC/USDT", "15m", now_ts=100)
+    main_cd.flush()
+    facade_cd.mark("ETH/USDT", "15m", now_ts=100)
+    facade_cd.flush()
+    main_cd.mark("SOL/USDT", "15m", now_ts=101)
+    main_cd.flush()
+    assert set(store.load("cooldown")) == {"BTC/USDT|15m", "ETH/USDT|15m", "SOL/USDT|15m"}
+
+def test_overlapping_task_batches_commit_independently(tmp_path):
+    path = str(tmp_path / "s.db")
+    store = StateStore(path)
+    ro = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    seen = {}
+
+    async def long_pass(release):
+        with store.batch():
+            store.sync("gate_state", {"a": {"count": 1}})
+            await release.wait()
+
+    async def risk_pass():
+        with store.batch():
+            store.sync("cooldown", {"BTC/USDT|15m": {"ts": 1.0}})
+            await asyncio.sleep(0)
+
+    async def go():
+        release = asyncio.Event()
+        slow = asyncio.create_task(long_pass(release))
+        await asyncio.sleep(0)
+        await risk_pass()
+        seen["cooldown"] = ro.execute("SELECT COUNT(*) FROM cooldown").fetchone()[0]
+        seen["gate"] = ro.execute("SELECT COUNT(*) FROM gate_state").fetchone()[0]
+        release.set()
+        await slow
+
+    asyncio.run(go())
+    assert seen == {"cooldown": 1, "gate": 0}  # lượt dài còn mở không giữ commit của lượt kia
+    assert ro.execute("SELECT COUNT(*) FROM gate_state").fetchone()[0] == 1
@@ -0,0 +1,88 @@
+import math
+
+import pytest
+
+from indicators import calculate_indicators
+from stream_indicators import INDICATOR_KEYS, IndicatorStreamEngine, StreamingIndicators
+from test_indicators import _ohlcv
+
+RTOL = 1e-6
+DISCRETE = ("supertrend", "range_filter", "volume_spike")
+
+def _spiky(n=400, seed=7):
+    df = _ohlcv(n=n, seed=seed)
+    df.loc[::37, "volume"] *= 4  # vài nến volume spike
+    return df
+
+def _close(a, b):
+    if isinstance(b, float) and math.isnan(b):
+        return isinstance(a, float) and math.isnan(a)
+    return abs(a - b) <= RTOL * max(1.0, abs(b))
+
+@pytest.mark.parametrize("seed", [1, 7, 42])
+def test_streaming_matches_calculate_indicators_every_bar(seed):
+    df = _spiky(seed=seed)
+    ref = calculate_indicators(df)
+    st = StreamingIndicators()
+    for i, row in enumerate(df.itertuples(index=False)):
+        out = st.update(row.high, row.low, row.close, row.volume, closed=True, ts=row.timestamp)
+        for key in INDICATOR_KEYS:
+            want = float(ref[key].iloc[i])
+            if key in DISCRETE:
+                assert out[key] == want, (key, i)
+            else:
+                assert _close(float(out[key]), want), (key, i, out[key], want)
+
+def test_forming_bar_does_not_change_state():
+    df = _spiky(n=300)
+    st = StreamingIndicators()
+    for row in df.iloc[:-1].itertuples(index=False):
+        st.update(row.high, row.low, row.close, row.volume, closed=True)
+    last = df.iloc[-1]
+    # Nến đang chạy nhảy giá nhiều lần trước khi đóng
+    for px in (last.close * 0.99, last.close * 1.02, last.close):
+        tmp = st.update(max(last.high, px), min(last.low, px), px, last.volume / 2, closed=False)
+    assert st.count == len(df) - 1
+    final = st.update(last.high, last.low, last.close, last.volume, closed=True)
+    ref = calculate_indicators(df)
+    for key in INDICATOR_KEYS:
+        assert _close(float(final[key]), float(ref[key].iloc[-1])), key
+    assert tmp["ema200"] == pytest.approx(final["ema200"], rel=1e-3)
+
+def test_engine_sync_incremental_frames():
+    df = _spiky(n=360)
+    eng = IndicatorStreamEngine()
+    out = eng.sync("BTC/USDT", "15m", df.iloc[:250])
+    for end in range(251, len(df) + 1):
+        out = eng.sync("BTC/USDT", "15m", df.iloc[:end])
+    ref = calculate_indicators(df)
+    for key in INDICATOR_KEYS:
+        assert _close(float(out[key]), float(ref[key].iloc[-1])), key
+    assert eng.states[("BTC/USDT", "15m")].count == len(df) - 1
+
+def test_engine_rebuilds_on_gap():
+    df = _spiky(n=300)
+    eng = IndicatorStreamEngine()
+    eng.sync("ETH/USDT", "1h", df.iloc[:200])
+    tail = df.iloc[250:].reset_index(drop=True)
+    out = eng.sync("ETH/USDT", "1h", tail)
+    fresh = StreamingIndicators()
+    for i, row in enumerate(tail.itertuples(index=False)):
+        want = fresh.update(row.high, row.low, row.close, row.volume, closed=i < len(tail) - 1)
+    assert eng.states[("ETH/USDT", "1h")].count == len(tail) - 1
+    for key in INDICATOR_KEYS:
+        assert _close(float(out[key]), float(want[key])), key
+
+@pytest.mark.parametrize("n", [1, 15, 30, 299])
+def test_from_closed_matches_bar_by_bar_updates(n):
+    df = _spiky(n=300, seed=5)
+    seq = StreamingIndicators()
+    for row in df.iloc[:n].itertuples(index=False):
+        seq.update(row.high, row.low, row.close, row.volume)
+    fast = StreamingIndicators.from_closed(*(df[c].to_numpy()[:n] for c in ("high", "low", "close", "volume")))
+    assert fast.count == seq.count
+    nxt = df.iloc[n]
+    want = seq.update(nxt.high, nxt.low, nxt.close, nxt.volume, closed=False)
+    got = fast.update(nxt.high, nxt.low, nxt.close, nxt.volume, closed=False)
+    for key in INDICATOR_KEYS:
+        assert _close(float(got[key]), float(want[key])), key
@@ -0,0 +1,49 @@
+import pandas as pd
+
+from tf_cache import TimeframeCache, next_close_ts, patch_live_price
+
+H1 = 3600.0
+T0 = 1_700_002_800.0 + 600  # phút 10 của một nến 1h
+
+def _frame(close=100.0):
+    return pd.DataFrame({"timestamp": [0, 1], "open": [99.0, close], "high": [101.0, close + 1],
+                         "low": [98.0, close - 1], "close": [100.0, close], "volume": [1.0, 2.0]})
+
+def test_entry_expires_at_next_close_plus_grace():
+    cache = TimeframeCache(timeframes=("1h",), grace_sec=2.0)
+    assert next_close_ts("1h", T0) == T0 - 600 + H1
+    cache.put_frame("S", "1h", _frame(), now_ts=T0)
+    close = next_close_ts("1h", T0)
+    assert cache.get_frame("S", "1h", now_ts=close + 1.9) is not None
+    assert cache.get_frame("S", "1h", now_ts=close + 2.0) is None
+    assert (cache.frame_hits, cache.frame_misses) == (1, 1)
+    assert cache.get_frame("S", "15m", now_ts=T0) is None  # khung không cache: không tính miss
+    assert cache.frame_misses == 1
+
+def test_put_frame_copies_and_indicators_hit_until_expiry():
+    cache = TimeframeCache(timeframes=("1h",))
+    df = _frame()
+    cache.put_frame("S", "1h", df, now_ts=T0)
+    df.loc[1, "close"] = 0.0
+    assert cache.get_frame("S", "1h", now_ts=T0)["close"].iloc[-1] == 100.0
+    calls = []
+    compute = lambda: calls.append(1) or {"ema200": 90.0, "trend_h4": "UP", "trend_d1": "-"}
+    assert not cache.has_indicators("S", "1h", now_ts=T0)
+    first = cache.get_indicators("S", "1h", compute, now_ts=T0)
+    again = cache.get_indicators("S", "1h", compute, now_ts=T0 + 60)
+    assert first is again and len(calls) == 1 and cache.has_indicators("S", "1h", now_ts=T0)
+    assert (cache.ind_hits, cache.ind_misses) == (1, 1)
+    cache.get_indicators("S", "1h", compute, now_ts=next_close_ts("1h", T0) + 5)
+    assert len(calls) == 2 and cache.stats()["ind_hit_rate"] == 0.3333
+
+def test_live_price_patches_close_and_trend_without_touching_cache():
+    cache = TimeframeCache(timeframes=("1h",))
+    cache.put_frame("S", "1h", _frame(), now_ts=T0)
+    ind = {"ema200": pd.Series([90.0, 95.0]), "trend_h4": "UP", "trend_d1": "-"}
+    cache.get_indicators("S", "1h", lambda: ind, now_ts=T0)
+    live = cache.get_indicators("S", "1h", lambda: None, live_price=94.0, now_ts=T0)
+    assert live["trend_h4"] == "DOWN" and live["trend_d1"] == "-"  # "-" = chưa đủ dữ liệu, giữ nguyên
+    assert ind["trend_h4"] == "UP"
+    patched = patch_live_price(cache.get_frame("S", "1h", now_ts=T0), 103.0)
+    assert patched["close"].iloc[-1] == 103.0 and patched["high"].iloc[-1] == 103.0
+    assert cache.get_frame("S", "1h", now_ts=T0)["close"].iloc[-1] == 100.0
@@ -0,0 +1,68 @@
+import gc
+import json
+import weakref
+
+from tight_gate import CooldownManager, StablePassTracker, _flush_live_states
+
+def test_stable_tracker_writes_behind(tmp_path):
+    path = tmp_path / "tight_state.json"
+    tr = StablePassTracker(path=str(path), min_gap_sec=10, required_passes=2, flush_interval_sec=None)
+    assert tr.update("BTC/USDT", "15m", "LONG", True, now_ts=100) is False
+    assert tr.update("BTC/USDT", "15m", "LONG", True, now_ts=115) is True
+    assert not path.exists()  # chưa flush thì chưa ghi
+    assert tr.flush() is True and tr.flush() is False
+    assert json.loads(path.read_text())["BTC/USDT|15m"]["count"] == 2
+    assert not (tmp_path / "tight_state.json.tmp").exists()
+
+    again = StablePassTracker(path=str(path), min_gap_sec=10, required_passes=2)
+    assert again.update("BTC/USDT", "15m", "LONG", True, now_ts=130) is True
+
+def test_stable_tracker_jsonl_roundtrip(tmp_path):
+    path = tmp_path / "tight_state.jsonl"
+    tr = StablePassTracker(path=str(path), flush_interval_sec=None)
+    for i, sym in enumerate(("BTC/USDT", "ETH/USDT", "SOL/USDT")):
+        tr.update(sym, "15m", "SHORT", True, now_ts=1000 + i)
+    tr.flush()
+    assert len(path.read_text().splitlines()) == 3
+    assert StablePassTracker(path=str(path)).state == tr.state
+
+def test_cooldown_manager_expires_and_persists(tmp_path):
+    path = tmp_path / "tight_cooldown.json"
+    cd = CooldownManager(path=str(path), default_cooldown_sec=60, flush_interval_sec=None)
+    cd.mark("BTC/USDT", "15m", now_ts=1000)
+    cd.mark("ETH/USDT", "15m", now_ts=1000, cooldown_sec=600)
+    assert cd.in_cooldown("BTC/USDT", "15m", 60, now_ts=1059)
+    assert not cd.in_cooldown("BTC/USDT", "1h", 60, now_ts=1059)
+    assert not cd.in_cooldown("BTC/USDT", "15m", 60, now_ts=1060)
+    assert "BTC/USDT|15m" not in cd.state  # mục hết hạn bị bỏ khỏi heap/state
+    assert cd.in_cooldown("ETH/USDT", "15m", 600, now_ts=1500)
+    cd.flush()
+
+    again = CooldownManager(path=str(path), default_cooldown_sec=60)
+    assert again.in_cooldown("ETH/USDT", "15m", 600, now_ts=1599)
+    assert not again.in_cooldown("ETH/USDT", "15m", 600, now_ts=1600)
+    assert again.state == {}
+
+def test_cooldown_keeps_entries_for_longest_query(tmp_path):
+    cd = CooldownManager(path=str(tmp_path / "cd.json"), default_cooldown_sec=60, flush_interval_sec=None)
+    cd.mark("SOL/USDT", "15m", now_ts=0)
+    assert cd.in_cooldown("SOL/USDT", "15m", 300, now_ts=100)  # hỏi với cooldown dài hơn lúc mark
+    assert cd.in_cooldown("SOL/USDT", "15m", 300, now_ts=299)
+
+def test_cooldown_reads_legacy_until_rows(tmp_path):
+    path = tmp_path / "tight_cooldown.json"
+    path.write_text(json.dumps({"TON/USDT|15m": {"until": 2000.0}}))
+    cd = CooldownManager(path=str(path), flush_interval_sec=None)
+    assert cd.in_cooldown("TON/USDT", "15m", 900, now_ts=1999)
+    assert not cd.in_cooldown("TON/USDT", "15m", 900, now_ts=2000)
+
+def test_exit_flush_covers_live_instances_only(tmp_path):
+    live = CooldownManager(path=str(tmp_path / "live.json"), flush_interval_sec=None)
+    live.mark("BTC/USDT", "15m", now_ts=1000)
+    dropped = CooldownManager(path=str(tmp_path / "dropped.json"), flush_interval_sec=None)
+    ref = weakref.ref(dropped)
+    del dropped
+    gc.collect()
+    assert ref() is None  # không bị atexit giữ lại
+    _flush_live_states()
+    assert "BTC/USDT|15m" in json.loads((tmp_path / "live.json").read_text())
@@ -0,0 +1,35 @@
+import time
+
+import numpy as np
+import pytest
+
+from timing import LogHistogram, StageTimer, query_stage_timings
+
+def test_histogram_percentiles_within_bucket_error():
+    values = np.random.default_rng(5).lognormal(8, 1.5, 20_000).astype(np.int64)
+    h = LogHistogram()
+    for v in values:
+        h.record(int(v))
+    for p in (50, 95, 99):
+        exact = np.percentile(values, p, method="inverted_cdf")
+        assert h.percentile(p) == pytest.approx(exact, rel=1 / 32)
+    assert (h.n, h.max) == (len(values), values.max())
+    for v in (0, 1, 127, 128, 129, 255, 256, 10**9):
+        assert v <= LogHistogram.upper(LogHistogram.index(v))
+
+def test_nested_stages_record_self_time_and_dump(tmp_path):
+    timer = StageTimer(path=str(tmp_path / "t.json"), dump_interval_sec=0)
+    with timer.stage("simulator", "BTC/USDT"):
+        time.sleep(0.02)
+        with timer.stage("csv_log", "BTC/USDT"):
+            time.sleep(0.03)
+    timer.add("fetch:5m", "ETH/USDT", 0.5)
+    last = timer.end_iteration(["BTC/USDT"], wall_s=0.06)
+    assert 20 <= last["simulator"][0] < 48 and last["csv_log"][0] >= 30  # không gồm 30ms của csv_log
+    assert "fetch:5m" not in last  # ETH/USDT không thuộc lượt này
+
+    snap = query_stage_timings(path=timer.path)
+    assert snap["iterations"] == 1
+    assert set(snap["stages"]["simulator"]) == {"*", "BTC/USDT", "@iter"}
+    assert query_stage_timings("fetch", "ETH/USDT", path=timer.path)["stages"] == {
+        "fetch:5m": {"ETH/USDT": {"wall": {"n": 1, "mean": 500.0, "p50": 500.0, "p95": 500.0, "p99": 500.0, "max": 500.0}}}}
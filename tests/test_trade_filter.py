@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from trade_filter import (
+    REASON_DIRECTION, REASON_H1_LOW, REASON_LTF_LOW, REASON_M15_LOW, REASON_NEUTRAL_LOW,
+    REASON_NEUTRAL_OK, REASON_NO_HTF, REASON_OK, align_closed, filter_m15_with_h1,
+    filter_m15_with_h1_batch, filter_m5_with_m15_and_h1, filter_m5_with_m15_and_h1_batch,
+    score_indicators_matrix,
+)
+
+NAMES = ["EMA200", "MA50", "MACD", "RSI", "ADX", "VWAP", "Supertrend", "Range"]
+SIDES = {1: "LONG", 0: "-", -1: "SHORT"}
+T0 = 1_700_000_000_000 - 1_700_000_000_000 % 3_600_000
+CFG = {
+    "weights_sets": {"M5": {"RSI": 2}, "M15": {"EMA200": 2, "MACD": 1.5}, "H1": {"ADX": 0.5}},
+    "thresholds": {"M5": 3, "M15": 3.5, "H1": 2, "neutral_bump": 1.5},
+}
+
+def _dirs(rng, n):
+    # thiên về một chiều theo đoạn để có đủ các nhánh luật
+    bias = np.repeat(rng.choice([-1, 0, 1], size=n // 10 + 1), 10)[:n]
+    d = rng.integers(-1, 2, size=(n, len(NAMES)))
+    keep = rng.random((n, len(NAMES))) < 0.5
+    return np.where(keep, bias[:, None], d).astype(np.int8)
+
+def _maps(d):
+    return [{k: SIDES[int(x)] for k, x in zip(NAMES, row)} for row in d]
+
+def _last_closed(ts, tf_ms, htf_ts, htf_ms):
+    closed = [j for j, t in enumerate(htf_ts) if t + htf_ms <= ts + tf_ms]
+    return closed[-1] if closed else -1
+
+def _code(res):
+    r = res["reason"]
+    if "NEUTRAL →" in r:
+        return REASON_NEUTRAL_OK if res["pass"] else REASON_NEUTRAL_LOW
+    if "không cùng hướng" in r:
+        return REASON_DIRECTION
+    if r.startswith("H1 ("):
+        return REASON_H1_LOW
+    if r.startswith("M15 ("):
+        return REASON_M15_LOW
+    return REASON_OK if res["pass"] else REASON_LTF_LOW
+
+def test_align_closed_has_no_lookahead():
+    ts15 = T0 + np.arange(8) * 900_000
+    ts1h = T0 + np.arange(2) * 3_600_000
+    # M15 00:00..00:30 đóng trước khi H1 00:00 đóng; M15 00:45 đóng cùng lúc với H1 00:00
+    assert align_closed(ts15, "15m", ts1h, "1h").tolist() == [-1, -1, -1, 0, 0, 0, 0, 1]
+
+@pytest.mark.parametrize("enforce", [True, False])
+def test_m15_batch_matches_scalar(enforce):
+    rng = np.random.default_rng(4)
+    cfg = dict(CFG, filter={"enforce_same_direction": enforce})
+    ts15 = T0 + np.arange(240) * 900_000
+    ts1h = T0 - 3_600_000 + np.arange(61) * 3_600_000
+    d15, d1h = _dirs(rng, len(ts15)), _dirs(rng, len(ts1h))
+    out = filter_m15_with_h1_batch(
+        score_indicators_matrix(d15, NAMES, CFG["weights_sets"]["M15"]),
+        score_indicators_matrix(d1h, NAMES, CFG["weights_sets"]["H1"]),
+        cfg, ts15=ts15, ts1h=ts1h,
+    )
+    m15, h1 = _maps(d15), _maps(d1h)
+    for i, t in enumerate(ts15):
+        j = _last_closed(t, 900_000, ts1h, 3_600_000)
+        assert out["h1_index"][i] == j
+        ref = filter_m15_with_h1(m15[i], h1[j], cfg)
+        assert out["pass"][i] == ref["pass"], i
+        assert out["reason"][i] == _code(ref), (i, ref["reason"])
+        assert out["required_m15_threshold"][i] == ref["required_m15_threshold"]
+    assert set(out["reason"].tolist()) >= {REASON_OK, REASON_NEUTRAL_OK, REASON_H1_LOW}
+
+def test_m5_batch_matches_scalar():
+    rng = np.random.default_rng(9)
+    ts5 = T0 + np.arange(600) * 300_000
+    ts15 = T0 - 900_000 + np.arange(201) * 900_000
+    ts1h = T0 + np.arange(50) * 3_600_000
+    d5, d15, d1h = _dirs(rng, len(ts5)), _dirs(rng, len(ts15)), _dirs(rng, len(ts1h))
+    w = CFG["weights_sets"]
+    out = filter_m5_with_m15_and_h1_batch(
+        score_indicators_matrix(d5, NAMES, w["M5"]),
+        score_indicators_matrix(d15, NAMES, w["M15"]),
+        score_indicators_matrix(d1h, NAMES, w["H1"]),
+        CFG, ts5=ts5, ts15=ts15, ts1h=ts1h,
+    )
+    m5, m15, h1 = _maps(d5), _maps(d15), _maps(d1h)
+    for i, t in enumerate(ts5):
+        j15 = _last_closed(t, 300_000, ts15, 900_000)
+        j1h = _last_closed(t, 300_000, ts1h, 3_600_000)
+        if j1h < 0:
+            assert out["reason"][i] == REASON_NO_HTF and not out["pass"][i]
+            continue
+        ref = filter_m5_with_m15_and_h1(m5[i], m15[j15], h1[j1h], CFG)
+        assert out["pass"][i] == ref["pass"], i
+        assert out["reason"][i] == _code(ref), (i, ref["reason"])
+        assert out["required_m5_threshold"][i] == ref["required_m5_threshold"]
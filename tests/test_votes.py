@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from indicator_registry import INDICATOR_REGISTRY, VOTE_NAMES, direction_matrix
+from indicators import calculate_indicators
+from trade_filter import score_indicators, score_indicators_matrix
+from votes import VoteScorer, encode_directions, get_vote_scorer, tally_votes, tally_votes_matrix
+
+from test_indicators import _ohlcv
+
+NAMES = ("EMA200", "MA50", "MACD", "RSI", "ADX", "VWAP", "Supertrend", "Range",
+         "Chaikin MF", "Volume_Spike", "StochRSI", "BollingerBands", "Custom")
+SIDES = {1: "LONG", 0: "-", -1: "SHORT"}
+
+def _assert_tally_parity(d, names, weights):
+    out = tally_votes_matrix(d, names, weights)
+    for i in range(len(d)):
+        ref = tally_votes({n: SIDES[int(x)] for n, x in zip(names, d[i])}, weights)
+        assert out["votes_long"][i] == ref["votes_long"], i
+        assert out["votes_short"][i] == ref["votes_short"], i
+        assert out["score_long"][i] == ref["score_long"], i
+        assert out["score_short"][i] == ref["score_short"], i
+        assert out["active_total_weight"][i] == ref["active_total_weight"], i
+        assert out["total_weight"] == ref["total_weight"]
+
+@pytest.mark.parametrize("seed", [0, 5])
+def test_tally_matrix_matches_tally_votes_random(seed):
+    rng = np.random.default_rng(seed)
+    d = rng.integers(-1, 2, size=(500, len(NAMES))).astype(np.int8)
+    weights = {n: float(rng.choice([0, 0.05, 0.1, 0.15, 0.35, 1])) for n in NAMES[::2]}
+    _assert_tally_parity(d, NAMES, weights)
+    _assert_tally_parity(d, NAMES, None)
+
+def test_tally_matrix_on_indicator_history():
+    df = _ohlcv(n=400)
+    ind = calculate_indicators(df)
+    d = direction_matrix(df["close"], ind)
+    close = df["close"].to_numpy()
+    # luật vector khớp luật scalar từng nến
+    for i in range(0, len(df), 7):
+        vals = {f: float(ind[f].iloc[i]) for s in INDICATOR_REGISTRY.values() for f in s["fields"]}
+        want = [INDICATOR_REGISTRY[n]["vote"](close[i], vals) for n in VOTE_NAMES]
+        assert [SIDES[int(x)] for x in d[i]] == want, i
+    _assert_tally_parity(d, VOTE_NAMES, {"EMA200": 0.3, "RSI": 0.05})
+
+def test_score_indicators_matrix_matches_scalar():
+    rng = np.random.default_rng(3)
+    names = list(VOTE_NAMES)
+    d = rng.integers(-1, 2, size=(300, len(names))).astype(np.int8)
+    weights = {"EMA200": 2, "MACD": 0.5, "RSI": 1.5}
+    out = score_indicators_matrix(d, names, weights)
+    code = {"LONG": 1, "NEUTRAL": 0, "SHORT": -1}
+    for i in range(len(d)):
+        ref = score_indicators({n: SIDES[int(x)] for n, x in zip(names, d[i])}, weights)
+        assert out["score_long"][i] == ref["score_long"]
+        assert out["score_short"][i] == ref["score_short"]
+        assert out["side"][i] == code[ref["side"]]
+
+def test_encode_directions():
+    d = encode_directions([{"RSI": "BUY", "ADX": "-"}, {"RSI": "SHORT"}], ["RSI", "ADX"])
+    assert d.tolist() == [[1, 0], [-1, 0]]
+
+def test_vote_scorer_matches_tally_votes():
+    rng = np.random.default_rng(11)
+    weights = {"EMA200": 3.1, "Chaikin MF": 0.4, "Custom": 2}
+    scorer = VoteScorer(weights)
+    names = list(NAMES) + ["rsi", "ADX"]  # key trùng sau normalize
+    for _ in range(200):
+        picked = [n for n in names if rng.random() < 0.8]
+        m = {n: rng.choice(["LONG", "SHORT", "-", "BUY", None]) for n in picked}
+        ref = tally_votes(m, weights)
+        got = scorer.score(m)
+        assert got.to_dict() == ref
+        assert list(got["breakdown_long"]) == list(ref["breakdown_long"])
+
+def test_get_vote_scorer_compiles_once_per_cfg():
+    cfg = {"weights_sets": {"M15": {"RSI": 2.0}}}
+    sc = get_vote_scorer(cfg, "M15")
+    assert get_vote_scorer(cfg, "M15") is sc
+    assert get_vote_scorer(cfg, "H1").score({"RSI": "LONG"})["score_long"] == 1.16
+    cfg["weights_sets"] = {"M15": {"RSI": 3.0}}
+    assert get_vote_scorer(cfg, "M15").score({"RSI": "LONG"})["score_long"] == 3.0
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Cache theo khung thời gian cho các khung chậm (H1/D1).
+
+Frame và dict chỉ báo của một (symbol, timeframe) được giữ tới khi nến hiện tại
+của khung đó đóng (+ grace cho sàn chốt nến). Giữa hai lần đóng nến, caller nhận
+lại bản cache; nếu truyền `live_price` thì chỉ giá close cuối được vá theo giá live.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+
+from data import timeframe_ms
+
+def next_close_ts(timeframe: str, now_ts: float) -> float:
+    """Thời điểm (giây) đóng nến hiện tại của timeframe, căn theo epoch UTC."""
+    tf_sec = timeframe_ms(timeframe) / 1000.0
+    return (int(now_ts // tf_sec) + 1) * tf_sec
+
+def patch_live_price(df: Optional[pd.DataFrame], price: Optional[float]) -> Optional[pd.DataFrame]:
+    """Bản copy của df với close nến cuối = price (high/low nới theo nếu cần)."""
+    if df is None or df.empty or price is None:
+        return df
+    out = df.copy()
+    i = out.index[-1]
+    out.at[i, "close"] = float(price)
+    out.at[i, "high"] = max(float(out.at[i, "high"]), float(price))
+    out.at[i, "low"] = min(float(out.at[i, "low"]), float(price))
+    return out
+
+def _patch_trend(ind: Dict[str, Any], price: float) -> Dict[str, Any]:
+    out = dict(ind)
+    ema = ind.get("ema200")
+    try:
+        ema_last = float(ema.iloc[-1]) if hasattr(ema, "iloc") else float(ema)
+    except Exception:
+        return out
+    if pd.isna(ema_last):
+        return out
+    trend = "UP" if price > ema_last else "DOWN"
+    for key in ("trend_h4", "trend_d1"):
+        if out.get(key) not in (None, "-"):
+            out[key] = trend
+    return out
+
+class TimeframeCache:
+    """Dùng chung giữa event loop và worker thread tính chỉ báo, nên bộ đếm/ghi chỉ báo giữ lock."""
+
+    def __init__(self, timeframes: Iterable[str] = ("1h", "1d"), grace_sec: float = 2.0):
+        self.timeframes = set(timeframes or ())
+        self.grace_sec = float(grace_sec)
+        self._entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.frame_hits = 0
+        self.frame_misses = 0
+        self.ind_hits = 0
+        self.ind_misses = 0
+
+    def enabled(self, timeframe: str) -> bool:
+        return timeframe in self.timeframes
+
+    def _fresh(self, key: Tuple[str, str], now_ts: float) -> Optional[Dict[str, Any]]:
+        ent = self._entries.get(key)
+        if ent is None or now_ts >= ent["expires_at"]:
+            return None
+        return ent
+
+    def get_frame(self, symbol: str, timeframe: str, now_ts: Optional[float] = None) -> Optional[pd.DataFrame]:
+        """Frame còn hạn hoặc None (None cũng trả về cho khung không cache, không tính miss)."""
+        if not self.enabled(timeframe):
+            return None
+        if now_ts is None: now_ts = time.time()
+        ent = self._fresh((symbol, timeframe), now_ts)
+        with self._lock:
+            if ent is None:
+                self.frame_misses += 1
+                return None
+            self.frame_hits += 1
+        return ent["frame"]
+
+    def put_frame(self, symbol: str, timeframe: str, df: Optional[pd.DataFrame], now_ts: Optional[float] = None):
+        if not self.enabled(timeframe) or df is None or df.empty:
+            return
+        if now_ts is None: now_ts = time.time()
+        self._entries[(symbol, timeframe)] = {
+            # copy: frame từ CandleStore là view, sẽ đổi ở lần merge sau
+            "frame": df.copy(),
+            "indicators": None,
+            "expires_at": next_close_ts(timeframe, now_ts) + self.grace_sec,
+        }
+
+    def has_indicators(self, symbol: str, timeframe: str, now_ts: Optional[float] = None) -> bool:
+        """Chỉ báo của (symbol, timeframe) còn hạn cache (không tính hit/miss)."""
+        if not self.enabled(timeframe):
+            return False
+        if now_ts is None: now_ts = time.time()
+        ent = self._fresh((symbol, timeframe), now_ts)
+        return ent is not None and ent["indicators"] is not None
+
+    def get_indicators(
+        self,
+        symbol: str,
+        timeframe: str,
+        compute: Callable[[], Optional[Dict[str, Any]]],
+        live_price: Optional[float] = None,
+        now_ts: Optional[float] = None,
+    ) -> Optional[Dict[str, Any]]:
+        if not self.enabled(timeframe):
+            return compute()
+        if now_ts is None: now_ts = time.time()
+        ent = self._fresh((symbol, timeframe), now_ts)
+        with self._lock:
+            ind = ent["indicators"] if ent is not None else None
+            if ind is not None:
+                self.ind_hits += 1
+            else:
+                self.ind_misses += 1
+        if ind is None:
+            ind = compute()
+            if ent is not None and ind is not None:
+                with self._lock:
+                    ent["indicators"] = ind
+        if ind is not None and live_price is not None:
+            ind = _patch_trend(ind, float(live_price))
+        return ind
+
+    def stats(self) -> Dict[str, Any]:
+        def _rate(h, m):
+            return round(h / (h + m), 4) if (h + m) else 0.0
+        return {
+            "frame_hits": self.frame_hits,
+            "frame_misses": self.frame_misses,
+            "frame_hit_rate": _rate(self.frame_hits, self.frame_misses),
+            "ind_hits": self.ind_hits,
+            "ind_misses": self.ind_misses,
+            "ind_hit_rate": _rate(self.ind_hits, self.ind_misses),
+            "entries": len(self._entries),
+        }
+
+_tf_cache: Optional[TimeframeCache] = None
+
+def get_tf_cache(cfg: Optional[Dict] = None) -> TimeframeCache:
+    global _tf_cache
+    if _tf_cache is None:
+        dcfg = (cfg or {}).get("data") or {}
+        _tf_cache = TimeframeCache(
+            timeframes=dcfg.get("cache_timeframes", ("1h", "1d")),
+            grace_sec=float(dcfg.get("cache_grace_sec", 2.0)),
+        )
+    return _tf_cache
@@ -1,27 +1,27 @@
-import json, os, time
+import atexit, heapq, json, os, time, weakref
 from typing import Dict, Tuple
 
+from indicator_registry import INDICATOR_REGISTRY, VOTE_NAMES
+from indicators import last_value
+from state_store import atomic_write
+
 def _normalize_key(name: str) -> str:
     return name.strip().replace(" ", "").replace("-", "").replace("_", "").upper()
 
-def build_indicator_results(ohlcv, indicators):
-    return {
-        'EMA200': "LONG" if ohlcv['close'].iloc[-1] > indicators['ema200'].iloc[-1] else "SHORT",
-        'MA50': "LONG" if ohlcv['close'].iloc[-1] > indicators['ma50'].iloc[-1] else "SHORT",
-        'MACD': "LONG" if indicators['macd'].iloc[-1] > indicators['macd_signal'].iloc[-1] else "SHORT",
-        'RSI': "LONG" if indicators['rsi'].iloc[-1] > 55 else ("SHORT" if indicators['rsi'].iloc[-1] < 45 else "-"),
-        'ADX': "LONG" if indicators['adx'].iloc[-1] > 25 else "-",
-        'VWAP': "LONG" if ohlcv['close'].iloc[-1] > indicators['vwap'].iloc[-1] else "SHORT",
-        'Supertrend': "LONG" if indicators['supertrend'].iloc[-1] == 1 else "SHORT",
-        'Range': "LONG" if indicators['range_filter'].iloc[-1] == 1 else "SHORT",
-        'Chaikin_MF': "LONG" if indicators['chaikin_mf'].iloc[-1] > 0 else "SHORT",
-        'Volume_Spike': "LONG" if indicators['volume_spike'].iloc[-1] == 1 else "-",
-        'StochRSI': "LONG" if indicators['stoch_rsi'].iloc[-1] > 0.8 else ("SHORT" if indicators['stoch_rsi'].iloc[-1] < 0.2 else "-"),
-        'BollingerBands': (
-            "LONG" if ohlcv['close'].iloc[-1] > indicators['bollinger_bands_upper'].iloc[-1]
-            else ("SHORT" if ohlcv['close'].iloc[-1] < indicators['bollinger_bands_lower'].iloc[-1] else "-")
-        )
-    }
+def build_indicator_results(ohlcv, indicators, names=None):
+    """
+    Map vote theo nến cuối, luật vote lấy từ INDICATOR_REGISTRY; indicators có thể là
+    dict Series (mode full) hoặc IndicatorSnapshot. names: chỉ vote các chỉ báo này;
+    mặc định mọi chỉ báo vote có đủ field trong indicators.
+    """
+    close = ohlcv['close'].iloc[-1]
+    out = {}
+    for name in (names if names is not None else VOTE_NAMES):
+        spec = INDICATOR_REGISTRY[name]
+        if names is None and any(indicators.get(f) is None for f in spec['fields']):
+            continue
+        out[name] = spec['vote'](close, {f: last_value(indicators[f]) for f in spec['fields']})
+    return out
 
 def _heavy_hits(h1_map: Dict[str,str], ema200_series, side: str) -> int:
     """
@@ -42,39 +42,171 @@ def _heavy_hits(h1_map: Dict[str,str], ema200_series, side: str) -> int:
 
 def anti_chase_ok(m15, ind_m15, mult: float=0.5) -> Tuple[bool,float,float,float]:
     price = float(m15["close"].iloc[-1])
-    vwap = float(ind_m15["vwap"].iloc[-1])
-    atr = float(ind_m15["atr"].iloc[-1]) if ind_m15.get("atr") is not None else 0.0
+    vwap = float(last_value(ind_m15["vwap"]))
+    atr = float(last_value(ind_m15["atr"])) if ind_m15.get("atr") is not None else 0.0
     dist = abs(price - vwap)
     return (dist <= mult * atr), price, vwap, atr
 
-class StablePassTracker:
-    def __init__(self, path="tight_state.json", min_gap_sec=300, required_passes=2):
+def _dump_state(path: str, state: Dict[str, Dict]) -> str:
+    """*.jsonl: mỗi key một dòng {"key": ..., ...}; còn lại: JSON gọn (không indent)."""
+    if path.endswith(".jsonl"):
+        return "".join(json.dumps({"key": k, **v}, ensure_ascii=False, separators=(",", ":")) + "\n" for k, v in state.items())
+    return json.dumps(state, ensure_ascii=False, separators=(",", ":"))
+
+def _load_state(path: str) -> Dict[str, Dict]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if not path.endswith(".jsonl"):
+                return json.load(f)
+            out = {}
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    out[row.pop("key")] = row
+            return out
+    except Exception:
+        return {}
+
+_LIVE_STATES = weakref.WeakSet()  # instance còn sống, flush một lần lúc thoát tiến trình
+
+@atexit.register
+def _flush_live_states():
+    for st in list(_LIVE_STATES):
+        st.flush()
+
+class _WriteBehindState:
+    """
+    State dict {key: row} ghi kiểu write-behind: thay đổi chỉ đánh dấu dirty; flush()
+    ghi khi có thay đổi (cuối mỗi vòng, tự động sau flush_interval_sec, lúc thoát
+    tiến trình) vào bảng TABLE của StateStore nếu có, không thì ghi atomic ra `path`.
+    """
+    TABLE = ""
+
+    def __init__(self, path, flush_interval_sec=5.0, store=None):
         self.path = path
-        self.min_gap = int(min_gap_sec)
-        self.req = int(required_passes)
+        self.flush_interval = float(flush_interval_sec) if flush_interval_sec is not None else None
+        self.store = None
         self.state = self._load()
+        self._dirty = False
+        self._last_flush = time.time()
+        self.flushes = 0
+        _LIVE_STATES.add(self)
+        if store is not None:
+            self.use_store(store)
+        else:
+            self._loaded()
     def _load(self):
-        if os.path.exists(self.path):
-            try:
-                return json.load(open(self.path, "r", encoding="utf-8"))
-            except Exception: pass
-        return {}
-    def _save(self):
+        return _load_state(self.path)
+    def _loaded(self):
+        """Hook sau khi state được nạp lại."""
+    def use_store(self, store):
+        """Chuyển sang StateStore (migrate file JSON cũ nếu bảng còn trống)."""
+        store.migrate_json(self.TABLE, self.path)
+        self.store = store
+        self.state = store.load(self.TABLE, owner=id(self))
+        self._dirty = False
+        self._loaded()
+    def flush(self, force=False):
+        """Ghi state nếu dirty (force: ghi luôn). Trả về True nếu có ghi."""
+        if not (self._dirty or force):
+            return False
         try:
-            json.dump(self.state, open(self.path,"w",encoding="utf-8"), ensure_ascii=False, indent=2)
-        except Exception: pass
+            if self.store is not None:
+                self.store.sync(self.TABLE, self.state, owner=id(self))
+            else:
+                atomic_write(self.path, _dump_state(self.path, self.state))
+        except Exception as e:
+            print(f"[WARN] Không ghi được {self.TABLE}: {e!r}")
+            return False
+        self._dirty = False
+        self._last_flush = time.time()
+        self.flushes += 1
+        return True
+    def _touch(self):
+        self._dirty = True
+        if self.flush_interval is not None and time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+class StablePassTracker(_WriteBehindState):
+    """Đếm số lần pass liên tiếp (cách nhau >= min_gap_sec) theo symbol|timeframe."""
+    TABLE = "gate_state"
+
+    def __init__(self, path="tight_state.json", min_gap_sec=300, required_passes=2, flush_interval_sec=5.0, store=None):
+        self.min_gap = int(min_gap_sec)
+        self.req = int(required_passes)
+        super().__init__(path, flush_interval_sec=flush_interval_sec, store=store)
     def update(self, symbol, timeframe, side, gates_ok, now_ts=None):
         if now_ts is None: now_ts = time.time()
         key = f"{symbol}|{timeframe}"
         st = self.state.get(key) or {"last_side": None, "count": 0, "last_ts": 0.0}
         if not gates_ok or side == "NEUTRAL":
             st.update({"last_side": None, "count": 0, "last_ts": now_ts})
-            self.state[key] = st; self._save(); return False
+            self.state[key] = st; self._touch(); return False
         if st["last_side"] != side:
             st.update({"last_side": side, "count": 1, "last_ts": now_ts})
         else:
             if now_ts - float(st["last_ts"]) >= self.min_gap:
                 st["count"] = int(st.get("count",0)) + 1
                 st["last_ts"] = now_ts
-        self.state[key] = st; self._save()
+        self.state[key] = st; self._touch()
         return int(st["count"]) >= self.req
+
+class CooldownManager(_WriteBehindState):
+    """
+    Cooldown theo symbol|timeframe, mỗi mục {"ts": lúc mark, "until": hết hạn}.
+    in_cooldown() tra dict O(1): now - ts < cooldown_sec (mục chỉ có "until" thì
+    now < until). Mục hết hạn được bỏ dần qua heap (expires_at, key); hạn giữ là
+    max(until, ts + cooldown_sec lớn nhất từng hỏi).
+    """
+    TABLE = "cooldown"
+
+    def __init__(self, path="tight_cooldown.json", default_cooldown_sec=900, flush_interval_sec=5.0, store=None):
+        self.default_sec = float(default_cooldown_sec)
+        self._max_query = 0.0
+        self._heap = []
+        super().__init__(path, flush_interval_sec=flush_interval_sec, store=store)
+    def _expires(self, ent):
+        until = float(ent.get("until") or 0.0)
+        if "ts" in ent:
+            until = max(until, float(ent["ts"]) + self._max_query)
+        return until
+    def _loaded(self):
+        self._heap = [(self._expires(v), k) for k, v in self.state.items()]
+        heapq.heapify(self._heap)
+    def _purge(self, now_ts):
+        heap = self._heap
+        dropped = False
+        while heap and heap[0][0] <= now_ts:
+            _, key = heapq.heappop(heap)
+            ent = self.state.get(key)
+            if ent is None:
+                continue
+            expires = self._expires(ent)
+            if expires > now_ts:
+                heapq.heappush(heap, (expires, key))  # mục đã mark lại hoặc có truy vấn dài hơn
+            else:
+                del self.state[key]
+                dropped = True
+        if dropped:
+            self._touch()
+    def in_cooldown(self, symbol, timeframe, cooldown_sec=None, now_ts=None):
+        if now_ts is None: now_ts = time.time()
+        cooldown_sec = self.default_sec if cooldown_sec is None else float(cooldown_sec)
+        if cooldown_sec > self._max_query:
+            self._max_query = cooldown_sec
+        self._purge(now_ts)
+        ent = self.state.get(f"{symbol}|{timeframe}")
+        if ent is None:
+            return False
+        if "ts" in ent:
+            return now_ts - float(ent["ts"]) < cooldown_sec
+        return now_ts < float(ent.get("until") or 0.0)
+    def mark(self, symbol, timeframe, now_ts=None, cooldown_sec=None):
+        if now_ts is None: now_ts = time.time()
+        key = f"{symbol}|{timeframe}"
+        until = float(now_ts) + (self.default_sec if cooldown_sec is None else float(cooldown_sec))
+        self.state[key] = {"ts": float(now_ts), "until": until}
+        heapq.heappush(self._heap, (until, key))
+        self._touch()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Đo thời gian từng bước của vòng giao dịch (wall + CPU) theo stage × symbol.
+
+- `with timer.stage("tally_votes", symbol):` đo một đoạn đồng bộ. Stage lồng nhau
+  chỉ tính thời gian riêng (self time): CSV/Discord bên trong "simulator" không bị
+  đếm hai lần. CPU = thread_time của thread chạy đoạn đó.
+- `await timer.timed(coro, "fetch:5m", symbol)` cho bước I/O bất đồng bộ: chỉ đo
+  wall (CPU của event loop lúc chờ là của coroutine khác).
+- Mỗi mẫu vào LogHistogram (bucket log-tuyến tính kiểu HDR, sai số tương đối
+  ≤ 1/64) của (stage, symbol) và (stage, "*"). end_iteration() cộng tổng từng stage
+  của các symbol trong lượt vào (stage, "@iter") rồi ghi file tóm tắt gọn (p50/
+  p95/p99, ms) sau mỗi dump_interval_sec; dashboard đọc file qua query.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterable, Optional
+
+from state_store import atomic_write
+
+ALL = "*"
+ITER = "@iter"
+
+class LogHistogram:
+    """Histogram số nguyên (µs) với bucket log-tuyến tính: 64 bucket con mỗi bậc lũy thừa 2."""
+    SUB_BITS = 7
+    __slots__ = ("counts", "n", "total", "max")
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.n = 0
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def index(cls, v: int) -> int:
+        shift = v.bit_length() - cls.SUB_BITS
+        if shift <= 0:
+            return v
+        half = 1 << (cls.SUB_BITS - 1)
+        return (shift + 1) * half + (v >> shift) - half
+
+    @classmethod
+    def upper(cls, idx: int) -> int:
+        """Giá trị lớn nhất rơi vào bucket idx."""
+        full = 1 << cls.SUB_BITS
+        if idx < full:
+            return idx
+        half = full >> 1
+        shift = idx // half - 1
+        return ((idx % half + half + 1) << shift) - 1
+
+    def record(self, v: int):
+        v = max(0, int(v))
+        i = self.index(v)
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.n += 1
+        self.total += v
+        if v > self.max:
+            self.max = v
+
+    def percentile(self, p: float) -> int:
+        if not self.n:
+            return 0
+        rank = max(1, int(round(p / 100.0 * self.n + 0.5 - 1e-9)))
+        seen = 0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            if seen >= rank:
+                return min(self.upper(i), self.max)
+        return self.max
+
+    def merge(self, other: "LogHistogram"):
+        for i, c in other.counts.items():
+            self.counts[i] = self.counts.get(i, 0) + c
+        self.n += other.n
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def summary(self) -> Dict[str, Any]:
+        """Tóm tắt theo ms: n, mean, p50, p95, p99, max."""
+        ms = lambda us: round(us / 1000.0, 3)
+        return {"n": self.n, "mean": ms(self.total / self.n) if self.n else 0.0,
+                "p50": ms(self.percentile(50)), "p95": ms(self.percentile(95)),
+                "p99": ms(self.percentile(99)), "max": ms(self.max)}
+
+class StageTimer:
+    def __init__(self, path: str = "stage_timing.json", dump_interval_sec: float = 60.0, enabled: bool = True):
+        self.path = path
+        self.dump_interval = float(dump_interval_sec)
+        self.enabled = bool(enabled)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._hists: Dict[tuple, list] = {}            # (stage, symbol) -> [wall, cpu | None]
+        self._pending: Dict[str, Dict[str, list]] = {}  # symbol -> stage -> [wall_s, cpu_s] của lượt đang chạy
+        self._last_dump = time.time()
+        self.iterations = 0
+        self.last_iteration: Dict[str, list] = {}
+        self.dumps = 0
+
+    def _record(self, keys, wall_us: int, cpu_us: Optional[int]):
+        for key in keys:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [LogHistogram(), None]
+            h[0].record(wall_us)
+            if cpu_us is not None:
+                if h[1] is None:
+                    h[1] = LogHistogram()
+                h[1].record(cpu_us)
+
+    def add(self, stage: str, symbol: Optional[str], wall_s: float, cpu_s: Optional[float] = None):
+        cpu_us = None if cpu_s is None else int(cpu_s * 1e6)
+        with self._lock:
+            self._record(((stage, ALL), (stage, symbol)) if symbol else ((stage, ALL),), int(wall_s * 1e6), cpu_us)
+            acc = self._pending.setdefault(symbol or ALL, {}).setdefault(stage, [0.0, 0.0])
+            acc[0] += wall_s
+            acc[1] += cpu_s or 0.0
+
+    @contextmanager
+    def _stage(self, stage: str, symbol: Optional[str]):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        frame = [0.0, 0.0]  # wall, cpu của stage con
+        stack.append(frame)
+        w0, c0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - w0, time.thread_time() - c0
+            stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+            self.add(stage, symbol, max(0.0, wall - frame[0]), max(0.0, cpu - frame[1]))
+
+    def stage(self, stage: str, symbol: Optional[str] = None):
+        """Context manager đo một đoạn đồng bộ (self time, wall + CPU)."""
+        return self._stage(stage, symbol) if self.enabled else nullcontext()
+
+    async def timed(self, coro, stage: str, symbol: Optional[str] = None):
+        """Await coro và ghi wall time của nó vào stage."""
+        if not self.enabled:
+            return await coro
+        t0 = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.add(stage, symbol, time.perf_counter() - t0)
+
+    def end_iteration(self, symbols: Iterable[str] = (), wall_s: Optional[float] = None) -> Dict[str, list]:
+        """
+        Khép một lượt (một lần run_once) của `symbols`: tổng từng stage (kèm mẫu không
+        gắn symbol) vào histogram "@iter"; ghi file nếu tới hạn. Trả về {stage: [wall_ms, cpu_ms]}.
+        """
+        if not self.enabled:
+            return {}
+        totals: Dict[str, list] = {}
+        with self._lock:
+            for sym in list(symbols) + [ALL]:
+                for stage, (w, c) in self._pending.pop(sym, {}).items():
+                    acc = totals.setdefault(stage, [0.0, 0.0])
+                    acc[0] += w
+                    acc[1] += c
+            for stage, (w, c) in totals.items():
+                self._record(((stage, ITER),), int(w * 1e6), int(c * 1e6))
+            if wall_s is not None:
+                self._record((("iteration", ITER),), int(wall_s * 1e6), None)
+            self.iterations += 1
+            self.last_iteration = {s: [round(w * 1000, 3), round(c * 1000, 3)] for s, (w, c) in totals.items()}
+        if time.time() - self._last_dump >= self.dump_interval:
+            self.dump()
+        return self.last_iteration
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stages: Dict[str, Dict[str, Any]] = {}
+            for (stage, symbol), (wall, cpu) in sorted(self._hists.items()):
+                ent = {"wall": wall.summary()}
+                if cpu is not None:
+                    ent["cpu"] = cpu.summary()
+                stages.setdefault(stage, {})[symbol] = ent
+            return {"ts": int(time.time()), "iterations": self.iterations,
+                    "last_iteration": dict(self.last_iteration), "stages": stages}
+
+    def query(self, stage: Optional[str] = None, symbol: Optional[str] = None) -> Dict[str, Any]:
+        return filter_timings(self.snapshot(), stage, symbol)
+
+    def dump(self) -> bool:
+        """Ghi tóm tắt (atomic) ra path; trả về True nếu ghi được."""
+        try:
+            atomic_write(self.path, json.dumps(self.snapshot(), ensure_ascii=False, separators=(",", ":")))
+        except Exception as e:
+            print(f"[WARN] Không ghi được {self.path}: {e!r}")
+            return False
+        self._last_dump = time.time()
+        self.dumps += 1
+        return True
+
+def filter_timings(snap: Dict[str, Any], stage: Optional[str] = None, symbol: Optional[str] = None) -> Dict[str, Any]:
+    """Lọc snapshot theo stage (khớp tiền tố, vd "fetch") và/hoặc symbol ("*", "@iter", "BTC/USDT")."""
+    stages = {}
+    for name, by_symbol in (snap.get("stages") or {}).items():
+        if stage and not (name == stage or name.startswith(f"{stage}:")):
+            continue
+        rows = {s: v for s, v in by_symbol.items() if symbol is None or s == symbol}
+        if rows:
+            stages[name] = rows
+    return dict(snap, stages=stages)
+
+_timer: Optional[StageTimer] = None
+
+def get_stage_timer(cfg: Optional[Dict] = None) -> StageTimer:
+    """Timer dùng chung theo cfg["timing"] (lần gọi đầu quyết định cấu hình)."""
+    global _timer
+    if _timer is None:
+        tcfg = (cfg or {}).get("timing") or {}
+        _timer = StageTimer(path=tcfg.get("path", "stage_timing.json"),
+                            dump_interval_sec=float(tcfg.get("dump_interval_sec", 60)),
+                            enabled=bool(tcfg.get("enabled", True)))
+    return _timer
+
+def query_stage_timings(stage: Optional[str] = None, symbol: Optional[str] = None,
+                        path: Optional[str] = None) -> Dict[str, Any]:
+    """Timing của timer trong process; path: đọc file đã dump (process khác, vd dashboard)."""
+    if path is None:
+        return get_stage_timer().query(stage, symbol)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return filter_timings(json.load(f), stage, symbol)
+
+__all__ = ["LogHistogram", "StageTimer", "get_stage_timer", "filter_timings", "query_stage_timings"]
@@ -1,4 +1,6 @@
-from typing import Dict
+from typing import Dict, Sequence
+
+import numpy as np
 
 def _get_weights(cfg, tf):
     return cfg.get("weights_sets", {}).get(tf, {})
@@ -29,6 +31,24 @@ def score_indicators(indicators: Dict[str, str], weights: Dict[str, float]) -> D
         side = "SHORT"
     return {"score_long": score_long, "score_short": score_short, "side": side}
 
+def score_indicators_matrix(directions: np.ndarray, names: Sequence[str], weights: Dict[str, float]) -> Dict:
+    """
+    score_indicators cho cả chuỗi nến: directions int8 (bars × len(names)), 1/0/-1 =
+    LONG/NEUTRAL/SHORT. Trả về mảng score_long, score_short và side (1/0/-1 = LONG/NEUTRAL/SHORT).
+    """
+    d = np.asarray(directions, dtype=np.int8)
+    score_long = np.zeros(d.shape[0])
+    score_short = np.zeros(d.shape[0])
+    # cộng lần lượt theo cột như vòng for của score_indicators
+    for j, k in enumerate(names):
+        w = weights.get(k, 1)
+        score_long = score_long + np.where(d[:, j] == 1, w, 0)
+        score_short = score_short + np.where(d[:, j] == -1, w, 0)
+    side = np.zeros(d.shape[0], dtype=np.int8)
+    side[(score_long > score_short) & (score_long > 0)] = 1
+    side[(score_short > score_long) & (score_short > 0)] = -1
+    return {"score_long": score_long, "score_short": score_short, "side": side}
+
 def filter_m15_with_h1(
     indicators_m15: Dict[str, str],
     indicators_h1: Dict[str, str],
@@ -174,3 +194,121 @@ def filter_m5_with_m15_and_h1(
         "required_m5_threshold": req_th5,
         "reason": "M5/M15/H1 cùng chiều và đạt ngưỡng. " + ("OK" if ok else "M5 chưa đủ điểm."),
     }
+
+# ---- Bản batch trên cả lịch sử (sweep ngưỡng / neutral_bump) ----
+# Mã lý do theo từng nến, cùng thứ tự luật với bản scalar ở trên
+REASON_OK = 0            # cùng chiều và đạt ngưỡng
+REASON_NEUTRAL_OK = 1    # khung lớn NEUTRAL, khung nhỏ đạt ngưỡng đã nâng
+REASON_NEUTRAL_LOW = 2   # khung lớn NEUTRAL, khung nhỏ không đạt ngưỡng đã nâng
+REASON_DIRECTION = 3     # enforce và các khung không cùng hướng
+REASON_H1_LOW = 4        # H1 không đủ điểm
+REASON_M15_LOW = 5       # M15 không đủ điểm (chỉ filter M5)
+REASON_LTF_LOW = 6       # khung đang xét (M15 / M5) chưa đủ điểm
+REASON_NO_HTF = 7        # chưa có nến khung lớn nào đã đóng
+
+REASON_TEXT = {
+    REASON_OK: "OK",
+    REASON_NEUTRAL_OK: "Khung lớn NEUTRAL → đạt ngưỡng đã nâng.",
+    REASON_NEUTRAL_LOW: "Khung lớn NEUTRAL → không đủ ngưỡng đã nâng.",
+    REASON_DIRECTION: "Các khung không cùng hướng. Bị chặn.",
+    REASON_H1_LOW: "H1 không đủ điểm.",
+    REASON_M15_LOW: "M15 không đủ điểm.",
+    REASON_LTF_LOW: "Khung nhỏ chưa đủ điểm.",
+    REASON_NO_HTF: "Chưa có nến khung lớn đã đóng.",
+}
+
+def align_closed(ltf_ts, ltf_timeframe: str, htf_ts, htf_timeframe: str) -> np.ndarray:
+    """
+    Với mỗi nến khung nhỏ (timestamp mở nến, ms), index nến khung lớn gần nhất đã
+    đóng tại thời điểm nến nhỏ đóng; -1 nếu chưa có. Không nhìn trước nến lớn đang chạy.
+    """
+    from data import timeframe_ms
+    ltf_close = np.asarray(ltf_ts, dtype=np.int64) + timeframe_ms(ltf_timeframe)
+    htf_close = np.asarray(htf_ts, dtype=np.int64) + timeframe_ms(htf_timeframe)
+    return np.searchsorted(htf_close, ltf_close, side="right") - 1
+
+def _score_arrays(s: Dict, idx=None):
+    sl = np.asarray(s["score_long"], dtype=np.float64)
+    ss = np.asarray(s["score_short"], dtype=np.float64)
+    side = s.get("side")
+    if side is None:
+        side = np.zeros(len(sl), dtype=np.int8)
+        side[(sl > ss) & (sl > 0)] = 1
+        side[(ss > sl) & (ss > 0)] = -1
+    side = np.asarray(side, dtype=np.int8)
+    best = np.maximum(sl, ss)
+    if idx is not None:
+        j = np.maximum(idx, 0)
+        if len(best) == 0:
+            return np.zeros(len(idx)), np.zeros(len(idx), dtype=np.int8)
+        return best[j], side[j]
+    return best, side
+
+def filter_m15_with_h1_batch(s15: Dict, s1h: Dict, cfg: Dict, ts15=None, ts1h=None,
+                             tf15: str = "15m", tf1h: str = "1h") -> Dict:
+    """
+    filter_m15_with_h1 cho mọi nến M15. s15/s1h: mảng score_long/score_short (side tuỳ
+    chọn) như score_indicators_matrix. Có ts15/ts1h (ms) thì mỗi nến M15 lấy nến H1
+    đã đóng gần nhất; không có thì coi hai chuỗi đã căn sẵn theo nến.
+    Trả về mảng pass, reason (REASON_*), required_m15_threshold, h1_index.
+    """
+    th15 = _get_threshold(cfg, "M15")
+    th1h = _get_threshold(cfg, "H1")
+    bump = _get_neutral_bump(cfg)
+    best15, side15 = _score_arrays(s15)
+    n = len(best15)
+    idx = align_closed(ts15, tf15, ts1h, tf1h) if ts15 is not None else np.arange(n)
+    best1h, side1h = _score_arrays(s1h, idx)
+
+    # Gán ngược thứ tự luật: luật đứng trước trong bản scalar ghi đè sau cùng
+    reason = np.full(n, REASON_LTF_LOW, dtype=np.int8)
+    reason[best15 >= th15] = REASON_OK
+    reason[best1h < th1h] = REASON_H1_LOW
+    if _enforce_same_dir(cfg):
+        reason[side15 != side1h] = REASON_DIRECTION
+    neutral = side1h == 0
+    reason[neutral] = np.where(best15[neutral] >= th15 + bump, REASON_NEUTRAL_OK, REASON_NEUTRAL_LOW)
+    reason[idx < 0] = REASON_NO_HTF
+    return {
+        "pass": (reason == REASON_OK) | (reason == REASON_NEUTRAL_OK),
+        "reason": reason,
+        "required_m15_threshold": np.where(neutral, th15 + bump, th15),
+        "h1_index": idx,
+    }
+
+def filter_m5_with_m15_and_h1_batch(s5: Dict, s15: Dict, s1h: Dict, cfg: Dict, ts5=None, ts15=None, ts1h=None,
+                                    tf5: str = "5m", tf15: str = "15m", tf1h: str = "1h") -> Dict:
+    """
+    filter_m5_with_m15_and_h1 cho mọi nến M5; M15 và H1 đều lấy nến đã đóng gần nhất
+    tại lúc nến M5 đóng. Trả về pass, reason, required_m5_threshold, m15_index, h1_index.
+    """
+    th5 = _get_threshold(cfg, "M5")
+    th15 = _get_threshold(cfg, "M15")
+    th1h = _get_threshold(cfg, "H1")
+    bump = _get_neutral_bump(cfg)
+    best5, side5 = _score_arrays(s5)
+    n = len(best5)
+    if ts5 is not None:
+        i15 = align_closed(ts5, tf5, ts15, tf15)
+        i1h = align_closed(ts5, tf5, ts1h, tf1h)
+    else:
+        i15 = i1h = np.arange(n)
+    best15, side15 = _score_arrays(s15, i15)
+    best1h, side1h = _score_arrays(s1h, i1h)
+
+    reason = np.full(n, REASON_LTF_LOW, dtype=np.int8)
+    reason[best5 >= th5] = REASON_OK
+    reason[best15 < th15] = REASON_M15_LOW
+    reason[best1h < th1h] = REASON_H1_LOW
+    if _enforce_same_dir(cfg):
+        reason[(side5 != side15) | (side15 != side1h)] = REASON_DIRECTION
+    neutral = (side1h == 0) | (side15 == 0)
+    reason[neutral] = np.where(best5[neutral] >= th5 + bump, REASON_NEUTRAL_OK, REASON_NEUTRAL_LOW)
+    reason[(i15 < 0) | (i1h < 0)] = REASON_NO_HTF
+    return {
+        "pass": (reason == REASON_OK) | (reason == REASON_NEUTRAL_OK),
+        "reason": reason,
+        "required_m5_threshold": np.where(neutral, th5 + bump, th5),
+        "m15_index": i15,
+        "h1_index": i1h,
+    }
@@ -1,4 +1,7 @@
-from typing import Dict, List
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
 
 DEFAULT_WEIGHTS: Dict[str, float] = {
     "EMA200": 2.65,
@@ -88,3 +91,221 @@ def tally_votes(indicators: Dict[str,str], weights: Dict[str,float]=None) -> Dic
         "total_weight": round(total_weight,2),
         "active_total_weight": round(active_total,2),
     }
+
+# ---- Scorer biên dịch sẵn cho luồng live ----
+_INTERN_LOCK = threading.Lock()
+_DIR_FAST = {"LONG": 1, "SHORT": -1, "-": 0, "NEUTRAL": 0, None: 0}
+_CODE_NAME = {1: "LONG", -1: "SHORT", 0: "NEUTRAL"}
+
+class VoteResult:
+    """
+    Kết quả của VoteScorer.score, đọc như dict của tally_votes (get/[]/keys).
+    Các số được tính sẵn; long/short/neutral_list và breakdown_* chỉ dựng khi được đọc.
+    """
+    __slots__ = ("_scorer", "_slots", "_codes", "votes_long", "votes_short",
+                 "score_long", "score_short", "total_weight", "active_total_weight")
+    KEYS = ("votes_long", "votes_short", "score_long", "score_short", "long_list", "short_list",
+            "neutral_list", "breakdown_long", "breakdown_short", "breakdown_neutral",
+            "total_weight", "active_total_weight")
+
+    def _list(self, code):
+        keys = self._scorer.keys
+        return [keys[s] for s, c in zip(self._slots, self._codes) if c == code]
+
+    @property
+    def long_list(self): return self._list(1)
+    @property
+    def short_list(self): return self._list(-1)
+    @property
+    def neutral_list(self): return self._list(0)
+
+    def _breakdown(self, code):
+        sc = self._scorer
+        out = {}
+        for s, c in zip(self._slots, self._codes):
+            out[sc.keys[s]] = sc.score_w[s] if c == code else 0.0
+        for k in sc.keys[:sc.n_weights]:
+            if k not in out: out[k] = 0.0
+        return out
+
+    @property
+    def breakdown_long(self): return self._breakdown(1)
+    @property
+    def breakdown_short(self): return self._breakdown(-1)
+    @property
+    def breakdown_neutral(self): return self._breakdown(0)
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.KEYS else default
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def keys(self):
+        return self.KEYS
+
+    def to_dict(self) -> Dict:
+        return {k: getattr(self, k) for k in self.KEYS}
+
+    def __repr__(self):
+        return f"VoteResult(L={self.score_long}, S={self.score_short}, votes={self.votes_long}/{self.votes_short})"
+
+class VoteScorer:
+    """
+    tally_votes với bảng trọng số biên dịch một lần: mỗi key normalize có một slot
+    cố định, tên chỉ báo thô được intern vào slot ở lần gặp đầu. Kết quả khớp tally_votes.
+    """
+    __slots__ = ("keys", "score_w", "active_w", "n_weights", "total_weight", "_slot_of")
+
+    def __init__(self, weights: Dict[str,float]=None):
+        wmap=_normalize_weight_dict(DEFAULT_WEIGHTS)
+        if weights: wmap.update(_normalize_weight_dict(weights))
+        self.keys: List[str] = list(wmap)
+        self.score_w: List[float] = list(wmap.values())
+        self.active_w: List[float] = list(wmap.values())
+        self.n_weights = len(wmap)
+        self.total_weight = round(sum(wmap.values()), 2)
+        self._slot_of: Dict[str,int] = {k: i for i, k in enumerate(self.keys)}
+
+    def _intern(self, raw_name: str) -> int:
+        nk = _normalize_key(raw_name)
+        with _INTERN_LOCK:  # pipeline chấm điểm từ nhiều thread
+            slot = self._slot_of.get(nk)
+            if slot is None:
+                # key ngoài bảng: vote với trọng số 1.0, không tính vào active_total (như tally_votes)
+                slot = len(self.keys)
+                self.keys.append(nk); self.score_w.append(1.0); self.active_w.append(0.0)
+                self._slot_of[nk] = slot
+            self._slot_of[raw_name] = slot
+        return slot
+
+    def score(self, indicators: Dict[str,str]) -> VoteResult:
+        slot_of = self._slot_of; w = self.score_w
+        slots = []; codes = []
+        votes_long = votes_short = 0
+        score_long = score_short = 0.0
+        for raw_name, raw_dir in (indicators or {}).items():
+            s = slot_of.get(raw_name)
+            if s is None: s = self._intern(raw_name)
+            try:
+                c = _DIR_FAST.get(raw_dir)
+            except TypeError:
+                c = None
+            if c is None: c = _DIR_CODE[_to_direction(raw_dir)]
+            slots.append(s); codes.append(c)
+            if c == 1:
+                votes_long += 1; score_long += w[s]
+            elif c == -1:
+                votes_short += 1; score_short += w[s]
+        r = VoteResult()
+        r._scorer = self; r._slots = slots; r._codes = codes
+        r.votes_long = votes_long; r.votes_short = votes_short
+        r.score_long = round(score_long, 2); r.score_short = round(score_short, 2)
+        r.total_weight = self.total_weight
+        aw = self.active_w
+        r.active_total_weight = round(sum(aw[s] for s in set(slots)), 2)
+        return r
+
+_SCORERS: Dict[int, tuple] = {}
+
+def compile_weight_sets(weights_sets: Dict[str,Dict[str,float]]) -> Dict[str,VoteScorer]:
+    """Một VoteScorer cho mỗi entry của weights_sets (M15, H1, ...)."""
+    return {tf: VoteScorer(w) for tf, w in (weights_sets or {}).items()}
+
+def get_vote_scorer(cfg: Dict, tf: str) -> VoteScorer:
+    """
+    Scorer của weights_sets[tf] trong cfg, biên dịch ở lần gọi đầu cho mỗi cfg
+    (và lại khi object weights_sets bị thay). tf không có trong weights_sets → DEFAULT_WEIGHTS.
+    """
+    cfg = cfg if cfg is not None else {}
+    wsets = cfg.get("weights_sets")
+    ent = _SCORERS.get(id(cfg))
+    if ent is None or ent[0] is not cfg or ent[1] is not wsets:
+        if len(_SCORERS) >= 32: _SCORERS.clear()
+        ent = (cfg, wsets, compile_weight_sets(wsets))
+        _SCORERS[id(cfg)] = ent
+    scorers = ent[2]
+    sc = scorers.get(tf)
+    if sc is None:
+        sc = scorers[tf] = VoteScorer(None)
+    return sc
+
+# Mã hoá chiều vote cho dạng ma trận (bars × indicators, int8)
+DIR_LONG, DIR_NEUTRAL, DIR_SHORT = 1, 0, -1
+_DIR_CODE = {"LONG": DIR_LONG, "SHORT": DIR_SHORT, "NEUTRAL": DIR_NEUTRAL}
+
+def encode_directions(maps: Sequence[Dict[str,str]], names: Sequence[str]) -> np.ndarray:
+    """List map vote theo nến → ma trận int8 (bars × len(names)); thiếu key = 0 (NEUTRAL)."""
+    out = np.zeros((len(maps), len(names)), dtype=np.int8)
+    for i, m in enumerate(maps):
+        for j, name in enumerate(names):
+            out[i, j] = _DIR_CODE[_to_direction(m.get(name))]
+    return out
+
+def weight_vector(names: Sequence[str], weights: Dict[str,float]=None) -> np.ndarray:
+    """Trọng số từng cột theo đúng luật tally_votes: DEFAULT_WEIGHTS + weights, key lạ = 1.0."""
+    wmap=_normalize_weight_dict(DEFAULT_WEIGHTS)
+    if weights: wmap.update(_normalize_weight_dict(weights))
+    return np.array([wmap.get(_normalize_key(n), 1.0) for n in names], dtype=np.float64)
+
+def _round2(x: np.ndarray) -> np.ndarray:
+    """round(x, 2) của Python trên mảng: np.round lệch khi x*100 sát .5 nên tính lại riêng các phần tử đó."""
+    r = np.round(x, 2)
+    y = x * 100
+    amb = np.abs(y - np.floor(y) - 0.5) < 1e-6
+    if amb.any():
+        r[amb] = [round(float(v), 2) for v in x[amb]]
+    return r
+
+def tally_votes_matrix(
+    directions: np.ndarray,
+    names: Sequence[str],
+    weights: Dict[str,float]=None,
+    present: Optional[np.ndarray]=None,
+) -> Dict:
+    """
+    tally_votes cho cả chuỗi nến trong một lượt NumPy.
+    directions: int8 (bars × indicators) với 1/0/-1 = LONG/NEUTRAL/SHORT, cột theo `names`.
+    present: bool cùng shape, False = chỉ báo không có trong map của nến đó (mặc định có đủ).
+    Trả về mảng theo nến: votes_long/short, score_long/short (làm tròn 2 số như tally_votes),
+    active_total_weight; total_weight là scalar. Khớp tally_votes từng nến.
+    """
+    d = np.asarray(directions, dtype=np.int8)
+    if d.ndim != 2 or d.shape[1] != len(names):
+        raise ValueError(f"directions phải có shape (bars, {len(names)})")
+    n = d.shape[0]
+    w = weight_vector(names, weights)
+    pres = np.ones(d.shape, dtype=bool) if present is None else np.asarray(present, dtype=bool)
+    is_long = (d == DIR_LONG) & pres
+    is_short = (d == DIR_SHORT) & pres
+
+    # Cộng lần lượt theo cột (cùng thứ tự với vòng for của tally_votes) để tổng khớp từng bit
+    score_long = np.zeros(n)
+    score_short = np.zeros(n)
+    for j in range(len(names)):
+        score_long = score_long + np.where(is_long[:, j], w[j], 0.0)
+        score_short = score_short + np.where(is_short[:, j], w[j], 0.0)
+
+    wmap=_normalize_weight_dict(DEFAULT_WEIGHTS)
+    if weights: wmap.update(_normalize_weight_dict(weights))
+    # active_total: mỗi key (đã normalize) tính một lần nếu có mặt, key lạ = 0 như tally_votes
+    cols: Dict[str, List[int]] = {}
+    for j, name in enumerate(names):
+        cols.setdefault(_normalize_key(name), []).append(j)
+    active = np.zeros(n)
+    for k, js in cols.items():
+        active = active + np.where(pres[:, js].any(axis=1), wmap.get(k, 0.0), 0.0)
+
+    return {
+        "votes_long": is_long.sum(axis=1),
+        "votes_short": is_short.sum(axis=1),
+        "score_long": _round2(score_long),
+        "score_short": _round2(score_short),
+        "total_weight": round(sum(wmap.values()), 2),
+        "active_total_weight": _round2(active),
+    }